@@ -1,11 +1,66 @@
-from sklearn.ensemble import IsolationForest
+import numpy as np
+from instrumentation import stage
+
+# Most recent claims kept as the reference set the detector is refitted on
+DEFAULT_WINDOW = 100000
 
 class AnomalyDetection:
-    def __init__(self):
-        self.model = IsolationForest(contamination=0.01, random_state=42)
+    # Set by fit; detectors saved before reference sets existed have none
+    reference_ = None
+    window = DEFAULT_WINDOW
+
+    def __init__(self, contamination=0.01, n_estimators=100, n_jobs=None, random_state=42, window=DEFAULT_WINDOW):
+        """
+        Args:
+            contamination (float): Expected fraction of anomalous claims.
+            n_estimators (int): Number of isolation trees.
+            n_jobs (int): Cores used for fitting and scoring; -1 uses all
+                cores. Results do not depend on it.
+            random_state (int): Random seed.
+            window (int): Size of the sliding reference set used by update.
+        """
+        # Imported here so scoring through the flat engine never loads sklearn
+        from sklearn.ensemble import IsolationForest
+        self.model = IsolationForest(contamination=contamination, n_estimators=n_estimators,
+                                     n_jobs=n_jobs, random_state=random_state)
+        self.window = window
 
     def fit(self, X):
-        self.model.fit(X)
+        with stage('anomaly_fit', X):
+            self.model.fit(X)
+            # IsolationForest works in float32, so the reference set loses nothing by it
+            self.reference_ = np.array(X[-self.window:], dtype=np.float32)
+
+    def update(self, X):
+        """
+        Slide the reference set forward by a batch of new claims, dropping
+        the oldest, and refit on it. Costs time proportional to the window,
+        however long the history is.
+        Args:
+            X (np.ndarray): Features of the new claims.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        reference = X if self.reference_ is None else np.concatenate([self.reference_, X])
+        with stage('anomaly_update', X):
+            self.reference_ = reference[-self.window:]
+            self.model.fit(self.reference_)
 
     def predict(self, X):
-        return self.model.predict(X)
+        with stage('anomaly_predict', X):
+            return self.model.predict(X)
+
+    def score(self, X):
+        """
+        Predict anomaly labels and anomaly scores in one pass over the forest.
+        Args:
+            X (np.ndarray): Features.
+        Returns:
+            tuple: (labels, scores) where labels are -1 for anomalies and 1
+                for normal claims, as from predict, and scores are
+                score_samples values (lower is more anomalous).
+        """
+        with stage('anomaly_predict', X):
+            scores = self.model.score_samples(X)
+            # Same rule as IsolationForest.predict: anomalous below offset_
+            labels = np.where(scores - self.model.offset_ < 0, -1, 1)
+        return labels, scores
@@ -0,0 +1,199 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import parallel_scoring
+from data_processing import FILE_FORMATS, save_data
+from model_registry import get_artifact
+from streaming import score_csv_stream, DEFAULT_CHUNKSIZE
+from investigation_priority import InvestigationQueue
+from risk_rules import load_rules
+
+DEFAULT_TOP_K = 1000
+PRIORITY_FILE = 'investigation_priority.csv'
+SUMMARY_FILE = 'batch_summary.json'
+# Output extension for each --format choice
+FORMAT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+def expand_inputs(inputs):
+    """
+    Claims files named by a list of paths, glob patterns and directories.
+    A directory contributes the files directly inside it with a supported
+    extension. Each file appears once, in the order first named; glob and
+    directory matches are sorted.
+    Args:
+        inputs (list): Paths, glob patterns or directories.
+    Returns:
+        list: File paths.
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(os.path.join(item, name) for name in os.listdir(item)
+                             if os.path.splitext(name)[1].lower() in FILE_FORMATS)
+        elif glob.has_magic(item):
+            matches = sorted(path for path in glob.glob(item) if os.path.isfile(path))
+        else:
+            matches = [item]
+        for path in matches:
+            if path not in files:
+                files.append(path)
+    return files
+
+def output_paths(files, output_dir, fmt=None):
+    """
+    Scored output path of each input file: <name>.scored<ext> in output_dir,
+    numbered when two inputs share a name. The extension is the input's own
+    unless fmt ('csv', 'parquet' or 'arrow') is given.
+    """
+    paths, used = [], set()
+    for path in files:
+        stem, extension = os.path.splitext(os.path.basename(path))
+        extension = FORMAT_EXTENSIONS[fmt] if fmt else extension
+        name, n = f"{stem}.scored{extension}", 1
+        while name in used:
+            n += 1
+            name = f"{stem}-{n}.scored{extension}"
+        used.add(name)
+        paths.append(os.path.join(output_dir, name))
+    return paths
+
+def _score_file(input_path, output_path, chunksize, top_k, project_columns=False, artifact=None):
+    # Runs in a worker, set up as parallel_scoring's are, unless artifact is given. Failures are returned rather
+    # than raised, so one bad file is reported without stopping the batch.
+    start = time.perf_counter()
+    result = {'file': input_path, 'output': output_path}
+    try:
+        artifact = artifact or parallel_scoring._worker_artifact
+        queue = InvestigationQueue(top_k, rules=load_rules(), claimant_store=artifact.pipeline.claimant_store)
+        monitor = artifact.drift_monitor()
+        result.update(score_csv_stream(input_path, output_path, artifact, chunksize=chunksize, queue=queue,
+                                       monitor=monitor, project_columns=project_columns))
+        result['top'] = queue.top()
+        if monitor is not None:
+            result['drift'] = monitor.report()
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def score_files(files, output_dir, artifact=None, n_workers=None, chunksize=DEFAULT_CHUNKSIZE, top_k=DEFAULT_TOP_K,
+                fmt=None, project_columns=False):
+    """
+    Score many claims files in a pool of worker processes, each file chunk by
+    chunk as in streaming.score_csv_stream. The artifact is loaded once and
+    handed to every worker when the pool starts. Claimant history is read but
+    not updated, so each file is scored independently of the others.
+    Args:
+        files (list): Claims files to score.
+        output_dir (str): Directory for the scored files and the merged list.
+        artifact (ModelArtifact): Artifact to score with. Defaults to the
+            latest artifact in the model registry.
+        n_workers (int): Worker processes. Defaults to the CPU count, capped
+            at the number of files. 1 scores in this process.
+        chunksize (int): Rows read and scored at a time within a file.
+        top_k (int): Length of the merged investigation list.
+        fmt (str): Output format for every file; defaults to each input's.
+        project_columns (bool): Write only the columns the pipeline reads;
+            see streaming.score_csv_stream.
+    Returns:
+        tuple: (summary dict, merged investigation list as a DataFrame with
+            a source_file column). Each file's entry in summary['results']
+            holds its drift report under 'drift' when the artifact has a
+            drift profile.
+    """
+    if artifact is None:
+        artifact = get_artifact()
+        if artifact is None:
+            raise ValueError("No trained model artifact found. Run 'python model_registry.py train <csv>' first.")
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = output_paths(files, output_dir, fmt)
+    n_workers = max(1, min(n_workers or os.cpu_count() or 1, len(files)))
+    jobs = [(path, output, chunksize, top_k, project_columns) for path, output in zip(files, outputs)]
+
+    start = time.perf_counter()
+    if n_workers == 1:
+        results = [_score_file(*job, artifact=artifact) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=parallel_scoring._init_worker,
+                                 initargs=(artifact,)) as executor:
+            futures = [executor.submit(_score_file, *job) for job in jobs]
+            results = [_result(future, job) for future, job in zip(futures, jobs)]
+    wall_seconds = time.perf_counter() - start
+
+    # Merged in input order, so ties between files always break the same way. Claims keep the
+    # scores their file gave them, which risk rules may have computed from the whole chunk.
+    merged = InvestigationQueue(top_k, confidence_col='file_score')
+    for result in results:
+        top = result.pop('top', None)
+        if top is not None and len(top):
+            merged.push_batch(top.rename(columns={'investigation_score': 'file_score'}).assign(source_file=result['file']))
+    succeeded = [r for r in results if 'error' not in r]
+    rows = sum(r['rows'] for r in succeeded)
+    summary = {
+        'files': len(files),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'rows': rows,
+        'flagged': sum(r['flagged'] for r in succeeded),
+        'wall_seconds': wall_seconds,
+        'claims_per_second': rows / wall_seconds if wall_seconds else None,
+        'n_workers': n_workers,
+        'model_version': artifact.version,
+        'results': results,
+    }
+    # With nothing flagged, or every file failed, the list is empty and has no columns
+    return summary, merged.top().drop(columns='file_score', errors='ignore')
+
+def _result(future, job):
+    # A worker that dies takes its file with it; report it like any other failure
+    try:
+        return future.result()
+    except Exception as e:
+        return {'file': job[0], 'output': job[1], 'error': f"{type(e).__name__}: {e}", 'seconds': None}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score many claims files in parallel with the registered model.")
+    parser.add_argument('inputs', nargs='+', help="Claims files, glob patterns (quoted) or directories.")
+    parser.add_argument('-o', '--output-dir', required=True, help="Directory for the scored files and summary.")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per core).")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="Rows scored at a time per file.")
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K, help="Length of the merged investigation list.")
+    parser.add_argument('--format', choices=sorted(FORMAT_EXTENSIONS), default=None,
+                        help="Output format (default: each input's own).")
+    parser.add_argument('--model-version', default=None, help="Artifact version (default: latest).")
+    parser.add_argument('--project-columns', action='store_true',
+                        help="Read and write only the columns the model uses.")
+    args = parser.parse_args(argv)
+
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("No claims files matched the given inputs.")
+        return 1
+    artifact = get_artifact(args.model_version)
+    if artifact is None:
+        print("No trained model artifact found. Run 'python model_registry.py train <csv>' first.")
+        return 1
+    summary, prioritized = score_files(files, args.output_dir, artifact, args.workers, args.chunksize,
+                                       args.top_k, args.format, args.project_columns)
+    save_data(prioritized, os.path.join(args.output_dir, PRIORITY_FILE))
+    with open(os.path.join(args.output_dir, SUMMARY_FILE), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"Scored {summary['rows']} claims from {summary['succeeded']} of {summary['files']} files "
+          f"in {summary['wall_seconds']:.1f}s ({summary['claims_per_second'] or 0:.0f} claims/sec) "
+          f"with {summary['n_workers']} workers; flagged {summary['flagged']}.")
+    print(f"Top {len(prioritized)} claims across all files written to "
+          f"{os.path.join(args.output_dir, PRIORITY_FILE)}")
+    for result in summary['results']:
+        if 'error' in result:
+            print(f"FAILED {result['file']}: {result['error']}")
+        elif result.get('drift', {}).get('drifted'):
+            print(f"DRIFT {result['file']}: {', '.join(result['drift']['drifted'])}")
+    return 1 if summary['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import sklearn
+from synthetic_data import write_claims_csv
+from data_processing import load_data
+from model_registry import train_artifact, save_artifact
+from main import score_claims
+from streaming import score_csv_stream
+from instrumentation import pipeline_run, peak_rss_bytes
+
+DEFAULT_SIZES = [10000, 100000, 1000000, 10000000]
+RESULTS_FILE = 'benchmark_results.jsonl'
+# Cold start: a fresh interpreter importing serve.py, loading the serving
+# artifact and scoring COLD_START_ROWS claims, end to end. Tracked against
+# this target so import-time regressions show up in every result.
+COLD_START_TARGET_SECONDS = 1.0
+COLD_START_ROWS = 1000
+COLD_START_SCRIPT = '''
+import sys, json, time
+start = time.perf_counter()
+import serve
+imported = time.perf_counter()
+artifact = serve.load_serving_artifact()
+loaded = time.perf_counter()
+serve.score_file(sys.argv[1], sys.argv[2], artifact)
+done = time.perf_counter()
+print(json.dumps({'import_seconds': imported - start, 'load_seconds': loaded - imported,
+                  'score_seconds': done - loaded, 'sklearn_loaded': 'sklearn' in sys.modules}))
+'''
+
+def git_commit():
+    """
+    Commit hash of the working tree, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def summarize_stages(run):
+    """
+    Sum the stage records of a run by stage name.
+    """
+    stages = {}
+    for record in run.stages:
+        totals = stages.setdefault(record.stage, {'runs': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows': 0})
+        totals['runs'] += 1
+        totals['wall_seconds'] += record.wall_seconds
+        totals['cpu_seconds'] += record.cpu_seconds
+        totals['rows'] += record.rows or 0
+    return stages
+
+def measure_cold_start(registry_dir, claims_path, repeats=3):
+    """
+    Time the lean scoring entry point in fresh interpreters, as a cron job
+    or a newly started web worker would run it.
+    Args:
+        registry_dir (str): Model registry holding the artifact to load.
+        claims_path (str): Small claims file to score.
+        repeats (int): Runs; the fastest is reported, as the others only
+            add noise from the machine.
+    Returns:
+        dict: 'seconds' (whole process, interpreter startup included), the
+            'import_seconds', 'load_seconds' and 'score_seconds' within it,
+            'sklearn_loaded', 'target_seconds' and 'met'.
+    """
+    env = dict(os.environ, FRAUD_MODEL_DIR=registry_dir)
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT, claims_path, claims_path + '.scored.csv'],
+                                   capture_output=True, text=True, check=True, env=env,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        seconds = time.perf_counter() - start
+        runs.append({'seconds': seconds, **json.loads(completed.stdout.strip().splitlines()[-1])})
+    best = min(runs, key=lambda run: run['seconds'])
+    return {**best, 'target_seconds': COLD_START_TARGET_SECONDS, 'met': best['seconds'] <= COLD_START_TARGET_SECONDS}
+
+def run_benchmark(n_rows, n_claimants=None, n_claim_types=5, fraud_rate=0.1, train_rows=100000,
+                  mode='batch', chunksize=100000, seed=42, work_dir=None, n_jobs=None, n_workers=None):
+    """
+    Generate a synthetic claims file, train an artifact on a separate
+    synthetic training file, then time scoring the claims file end to end
+    and the cold start of the lean scoring entry point.
+    Args:
+        n_rows (int): Number of claims to score.
+        n_claimants (int): Distinct claimants. Defaults to n_rows // 3.
+        n_claim_types (int): Distinct claim types.
+        fraud_rate (float): Fraction of fraudulent claims.
+        train_rows (int): Training file size, capped at n_rows.
+        mode (str): 'batch' scores with main.score_claims; 'stream' with
+            streaming.score_csv_stream in chunks of chunksize rows.
+        chunksize (int): Chunk size for 'stream' mode.
+        seed (int): Random seed for the generated files.
+        work_dir (str): Directory for the temporary files.
+        n_jobs (int): Cores used to fit the forests.
+        n_workers (int): Scoring worker processes.
+    Returns:
+        dict: One benchmark result record.
+    """
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        train_path = os.path.join(tmp_dir, 'train.csv')
+        score_path = os.path.join(tmp_dir, 'claims.csv')
+        n_claimants = n_claimants or max(1, n_rows // 3)
+        generate_start = time.perf_counter()
+        write_claims_csv(train_path, min(train_rows, n_rows), seed=seed + 1000003, n_claimants=n_claimants,
+                         n_claim_types=n_claim_types, fraud_rate=fraud_rate)
+        write_claims_csv(score_path, n_rows, seed=seed, n_claimants=n_claimants,
+                         n_claim_types=n_claim_types, fraud_rate=fraud_rate)
+        generate_seconds = time.perf_counter() - generate_start
+
+        with pipeline_run('benchmark_train') as train_run:
+            artifact = train_artifact(load_data(train_path), n_jobs=n_jobs)
+
+        with pipeline_run('benchmark_score') as score_run:
+            if mode == 'stream':
+                score_csv_stream(score_path, os.path.join(tmp_dir, 'scored.csv'), artifact, chunksize=chunksize,
+                                 n_workers=n_workers)
+            else:
+                score_claims(score_path, artifact, n_workers=n_workers)
+
+        registry_dir = os.path.join(tmp_dir, 'models')
+        save_artifact(artifact, registry_dir)
+        cold_path = os.path.join(tmp_dir, 'cold_start.csv')
+        write_claims_csv(cold_path, COLD_START_ROWS, seed=seed + 2, n_claimants=n_claimants,
+                         n_claim_types=n_claim_types, fraud_rate=fraud_rate)
+        cold_start = measure_cold_start(registry_dir, cold_path)
+
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'cpu_count': os.cpu_count(),
+        'mode': mode,
+        'n_jobs': n_jobs,
+        'n_workers': n_workers,
+        'n_rows': n_rows,
+        'n_claimants': n_claimants,
+        'n_claim_types': n_claim_types,
+        'fraud_rate': fraud_rate,
+        'train_rows': min(train_rows, n_rows),
+        'generate_seconds': generate_seconds,
+        'train_seconds': train_run.wall_seconds,
+        'score_seconds': score_run.wall_seconds,
+        'claims_per_second': n_rows / score_run.wall_seconds if score_run.wall_seconds else None,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'cold_start': cold_start,
+        'train_stages': summarize_stages(train_run),
+        'score_stages': summarize_stages(score_run),
+    }
+
+def run_isolated(**kwargs):
+    """
+    Run run_benchmark in a fresh process so peak RSS reflects this size only.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_benchmark, **kwargs).result()
+
+def append_result(result, results_file=RESULTS_FILE):
+    with open(results_file, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+def compare_results(results_file=RESULTS_FILE):
+    """
+    Print throughput and peak memory of every recorded run, grouped by
+    benchmark configuration, so runs from different commits line up.
+    """
+    with open(results_file) as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    results.sort(key=lambda r: (r['mode'], r['n_rows'], r['timestamp']))
+    print(f"{'mode':<7}{'rows':>12}  {'commit':<10}{'claims/sec':>14}{'score s':>10}{'peak RSS MB':>13}{'cold s':>9}")
+    for r in results:
+        # Results recorded before cold starts were measured have none
+        cold = f"{r['cold_start']['seconds']:>9.2f}" if r.get('cold_start') else f"{'-':>9}"
+        print(f"{r['mode']:<7}{r['n_rows']:>12}  {(r['commit'] or '-')[:8]:<10}"
+              f"{r['claims_per_second'] or 0:>14.0f}{r['score_seconds']:>10.2f}{r['peak_rss_bytes'] / 2 ** 20:>13.0f}"
+              f"{cold}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the fraud detection pipeline on synthetic claims.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Numbers of claims to score.")
+    parser.add_argument('--n-claimants', type=int, default=None, help="Distinct claimants (default: rows / 3).")
+    parser.add_argument('--n-claim-types', type=int, default=5, help="Distinct claim types.")
+    parser.add_argument('--fraud-rate', type=float, default=0.1, help="Fraction of fraudulent claims.")
+    parser.add_argument('--train-rows', type=int, default=100000, help="Rows in the training file.")
+    parser.add_argument('--mode', choices=['batch', 'stream'], default='batch', help="Scoring path to benchmark.")
+    parser.add_argument('--chunksize', type=int, default=100000, help="Chunk size for stream mode.")
+    parser.add_argument('--n-jobs', type=int, default=None, help="Cores used to fit the forests (-1 for all).")
+    parser.add_argument('--n-workers', type=int, default=None, help="Scoring worker processes.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=RESULTS_FILE, help="JSON lines file results are appended to.")
+    parser.add_argument('--compare', action='store_true', help="Print the recorded results and exit.")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare_results(args.output)
+        return
+    for n_rows in args.sizes:
+        result = run_isolated(n_rows=n_rows, n_claimants=args.n_claimants, n_claim_types=args.n_claim_types,
+                              fraud_rate=args.fraud_rate, train_rows=args.train_rows, mode=args.mode,
+                              chunksize=args.chunksize, seed=args.seed, n_jobs=args.n_jobs,
+                              n_workers=args.n_workers)
+        append_result(result, args.output)
+        cold_start = result['cold_start']
+        print(f"{n_rows} claims: {result['claims_per_second']:.0f} claims/sec, "
+              f"score {result['score_seconds']:.2f}s, peak RSS {result['peak_rss_bytes'] / 2 ** 20:.0f} MB, "
+              f"cold start {cold_start['seconds']:.2f}s (target {cold_start['target_seconds']:.2f}s"
+              f"{'' if cold_start['met'] else ', MISSED'})")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+import joblib
+
+# Marker for "no previous claim" in days_since_last_claim
+NO_HISTORY = -1.0
+
+class ClaimantAggregateStore:
+    """
+    Running per-claimant aggregates (claim count, total claim amount and last
+    claim date) kept in a dict so each claimant is updated and looked up in
+    O(1). Lets small batches, or a single claim, be enriched with history
+    features without reloading past claims.
+    """
+    def __init__(self):
+        # claimant_id -> [claim_count, amount_sum, last_claim_day]
+        self._stats = {}
+
+    def __len__(self):
+        return len(self._stats)
+
+    def lookup(self, claimant_id):
+        """
+        Args:
+            claimant_id: Claimant identifier.
+        Returns:
+            tuple: (claim_count, amount_sum, last_claim_day) or (0, 0.0, None)
+                for an unknown claimant. last_claim_day counts days since
+                1970-01-01.
+        """
+        stats = self._stats.get(claimant_id)
+        if stats is None:
+            return 0, 0.0, None
+        return tuple(stats)
+
+    def update(self, claimant_ids, amounts=None, claim_days=None):
+        """
+        Add a batch of claims to the aggregates. Claims without a claimant
+        ID (NaN, None or '') are left out.
+        Args:
+            claimant_ids (array-like): Claimant of each claim.
+            amounts (array-like): Optional claim amount of each claim.
+            claim_days (array-like): Optional claim date of each claim as days
+                since 1970-01-01, NaN when unknown.
+        """
+        claimant_ids, amounts, claim_days = _known_claims(claimant_ids, amounts, claim_days)[1:]
+        unique_ids, inverse, counts = np.unique(claimant_ids, return_inverse=True, return_counts=True)
+        sums = np.zeros(len(unique_ids))
+        if amounts is not None:
+            np.add.at(sums, inverse, np.nan_to_num(np.asarray(amounts, dtype=float)))
+        last_days = np.full(len(unique_ids), np.nan)
+        if claim_days is not None:
+            days = np.asarray(claim_days, dtype=float)
+            known = ~np.isnan(days)
+            last_days[:] = -np.inf
+            np.maximum.at(last_days, inverse[known], days[known])
+            last_days[np.isinf(last_days)] = np.nan
+
+        for claimant_id, count, amount_sum, last_day in zip(unique_ids.tolist(), counts.tolist(), sums.tolist(), last_days.tolist()):
+            stats = self._stats.get(claimant_id)
+            last_day = None if np.isnan(last_day) else last_day
+            if stats is None:
+                self._stats[claimant_id] = [count, amount_sum, last_day]
+            else:
+                stats[0] += count
+                stats[1] += amount_sum
+                if last_day is not None and (stats[2] is None or last_day > stats[2]):
+                    stats[2] = last_day
+
+    def history_features(self, claimant_ids, amounts=None, claim_days=None):
+        """
+        Compute history features for a batch from the stored aggregates plus
+        the batch itself. The store is not modified.
+        Args:
+            claimant_ids (array-like): Claimant of each claim.
+            amounts (array-like): Optional claim amount of each claim.
+            claim_days (array-like): Optional claim date of each claim as days
+                since 1970-01-01, NaN when unknown.
+        Returns:
+            dict: Arrays 'claimant_claim_count', 'claimant_total_amount' and,
+                when claim_days is given, 'claimant_days_since_last_claim':
+                days since the claimant's previous claim, the latest earlier
+                one in the batch or else the last stored one (NO_HISTORY
+                when there is neither). Training claims, added to an empty
+                store, thus get the same feature later claims are scored on.
+                Claims without a claimant ID have no history: a count and
+                total of 0 and NO_HISTORY.
+        """
+        known, claimant_ids, amounts, claim_days = _known_claims(claimant_ids, amounts, claim_days)
+        if known.all():
+            return self._history_features(claimant_ids, amounts, claim_days)
+        features = {'claimant_claim_count': np.zeros(len(known)), 'claimant_total_amount': np.zeros(len(known))}
+        if claim_days is not None:
+            features['claimant_days_since_last_claim'] = np.full(len(known), NO_HISTORY)
+        for name, values in self._history_features(claimant_ids, amounts, claim_days).items():
+            features[name][known] = values
+        return features
+
+    def _history_features(self, claimant_ids, amounts, claim_days):
+        unique_ids, inverse, counts = np.unique(claimant_ids, return_inverse=True, return_counts=True)
+        batch_sums = np.zeros(len(unique_ids))
+        if amounts is not None:
+            np.add.at(batch_sums, inverse, np.nan_to_num(np.asarray(amounts, dtype=float)))
+
+        stored = [self.lookup(claimant_id) for claimant_id in unique_ids.tolist()]
+        stored_counts = np.array([s[0] for s in stored], dtype=float)
+        stored_sums = np.array([s[1] for s in stored], dtype=float)
+
+        features = {
+            'claimant_claim_count': (stored_counts + counts)[inverse],
+            'claimant_total_amount': (stored_sums + batch_sums)[inverse],
+        }
+        if claim_days is not None:
+            days = np.asarray(claim_days, dtype=float)
+            previous = np.array([np.nan if s[2] is None else s[2] for s in stored], dtype=float)[inverse]
+            # Each claimant's claims in date order (unknown dates last); every
+            # claim after the first follows an earlier one in the batch
+            order = np.lexsort((days, inverse))
+            follows = inverse[order][1:] == inverse[order][:-1]
+            previous[order[1:][follows]] = days[order][:-1][follows]
+            days_since = days - previous
+            features['claimant_days_since_last_claim'] = np.where(np.isnan(days_since), NO_HISTORY, days_since)
+        return features
+
+    def save(self, path):
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path):
+        return joblib.load(path)
+
+def known_claimants(claimant_ids):
+    """
+    Boolean mask of the claims that have a claimant ID: not NaN, None or ''.
+    """
+    claimant_ids = np.asarray(claimant_ids)
+    if claimant_ids.dtype.kind == 'f':
+        return ~np.isnan(claimant_ids)
+    if claimant_ids.dtype.kind in 'OUS':
+        return pd.notna(claimant_ids) & (claimant_ids != '')
+    return np.ones(len(claimant_ids), dtype=bool)
+
+def claim_counts(claimant_ids):
+    """
+    Number of claims each claim's claimant has within the batch, 0 for
+    claims without a claimant ID.
+    """
+    known = known_claimants(claimant_ids)
+    counts = np.zeros(len(known))
+    _, inverse, batch_counts = np.unique(np.asarray(claimant_ids)[known], return_inverse=True, return_counts=True)
+    counts[known] = batch_counts[inverse]
+    return counts
+
+def _known_claims(claimant_ids, amounts, claim_days):
+    # The mask of claims with a claimant ID, and those claims' IDs, amounts and dates
+    claimant_ids = np.asarray(claimant_ids)
+    known = known_claimants(claimant_ids)
+    if known.all():
+        return known, claimant_ids, amounts, claim_days
+    return (known, claimant_ids[known], None if amounts is None else np.asarray(amounts)[known],
+            None if claim_days is None else np.asarray(claim_days)[known])
+
+def text_claimant_ids(values):
+    """
+    Text claimant IDs as strings, '' when missing, so they can key the
+    claimant history like numeric IDs do.
+    """
+    values = pd.Series(values, dtype=object)
+    keys = values.astype(str).to_numpy(dtype=object)
+    keys[values.isna().to_numpy()] = ''
+    return keys
+
+def to_claim_days(dates):
+    """
+    Convert a date column to float days since 1970-01-01, NaN when missing or
+    unparseable.
+    """
+    dates = pd.Series(dates)
+    if isinstance(dates.dtype, pd.CategoricalDtype):
+        # Parse each distinct date once; code -1 (missing) takes the appended NaN
+        return np.append(to_claim_days(dates.cat.categories), np.nan)[dates.cat.codes.to_numpy()]
+    parsed = pd.to_datetime(dates, errors='coerce')
+    days = parsed.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(float)
+    days[parsed.isna().to_numpy()] = np.nan
+    return days
+
+def record_claim_day(value):
+    """
+    Days since 1970-01-01 for a single claim date, NaN when missing or
+    unparseable. ISO dates are parsed with NumPy; other formats fall back to
+    pandas.
+    """
+    if value is None or value != value:
+        return np.nan
+    try:
+        return float(np.datetime64(value).astype('datetime64[D]').astype(np.int64))
+    except (TypeError, ValueError):
+        parsed = pd.to_datetime(value, errors='coerce')
+        return np.nan if pd.isna(parsed) else float((parsed.normalize() - pd.Timestamp(0)).days)
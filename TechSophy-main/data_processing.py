@@ -1,39 +1,675 @@
+import os
+import numpy as np
 import pandas as pd
+from claimant_store import to_claim_days, record_claim_day
+from instrumentation import stage
 
-def load_data(file_path):
+# Numeric features derived from each date column
+DATE_FEATURES = ('days', 'month', 'dayofweek')
+# Values that look like 2023-01-15, 15/01/2023 or 2023/1/15, with optional time
+_DATE_PATTERN = r'\s*\d{1,4}[-/]\d{1,2}[-/]\d{1,4}'
+
+# File extensions of the supported input formats
+FILE_FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+}
+
+# In lean mode, text columns whose distinct values are at most this share of
+# their rows load as categoricals
+CATEGORY_MAX_SHARE = 0.5
+# Rows parsed at a time when loading a CSV file in lean mode
+LEAN_CHUNK_ROWS = 250000
+# Rows sampled to find the text columns before a lean CSV load
+LEAN_SAMPLE_ROWS = 1000
+# Text column dtypes for select_dtypes: pandas 3 stores text as 'str' and
+# deprecates selecting it through 'object', which pandas 2 needs
+TEXT_DTYPES = ['object', 'str'] if int(pd.__version__.split('.')[0]) >= 3 else ['object']
+
+def file_format(file_path):
     """
-    Load insurance claims data from a CSV file.
+    'csv', 'parquet' or 'arrow' (Arrow IPC / Feather v2) from the file
+    extension. Unknown extensions are read as CSV.
+    """
+    return FILE_FORMATS.get(os.path.splitext(file_path)[1].lower(), 'csv')
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError as e:
+        raise ImportError("Reading and writing Parquet or Arrow files requires pyarrow (pip install pyarrow).") from e
+    return pyarrow
+
+def _read_table(file_path, columns=None):
+    # Columnar files are memory-mapped and only the requested columns are decoded
+    pa = _import_pyarrow()
+    if file_format(file_path) == 'parquet':
+        parquet_file = pa.parquet.ParquetFile(file_path, memory_map=True)
+        return parquet_file.read(columns=_present(parquet_file.schema_arrow.names, columns))
+    source = pa.memory_map(file_path, 'r')
+    try:
+        table = pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        # Arrow IPC streams have no footer and are read front to back
+        source.seek(0)
+        table = pa.ipc.open_stream(source).read_all()
+    return table.select(_present(table.column_names, columns))
+
+def _present(names, columns):
+    # Requested columns the file has, in file order; all of them when columns is None
+    if columns is None:
+        return list(names)
+    wanted = set(columns)
+    return [name for name in names if name in wanted]
+
+def _usecols(columns):
+    # A callable usecols skips requested columns the CSV file lacks instead of failing
+    if columns is None:
+        return None
+    wanted = set(columns)
+    return lambda name: name in wanted
+
+def _to_pandas(table):
+    # split_blocks lets numeric columns without nulls share the Arrow buffers
+    return table.to_pandas(split_blocks=True)
+
+def load_data(file_path, columns=None, lean=False):
+    """
+    Load insurance claims data from a CSV, Parquet or Arrow IPC file.
     Args:
-        file_path (str): Path to the CSV file.
+        file_path (str): Path to the file; the format follows the extension.
+        columns (list): Optional columns to load. Others are skipped without
+            being parsed, and requested columns the file lacks are ignored.
+        lean (bool): Load with the smallest dtypes that hold the values
+            exactly (see shrink_dtypes). CSV files are then parsed in chunks
+            of LEAN_CHUNK_ROWS rows, so the full file is never held with
+            the default dtypes.
     Returns:
         pd.DataFrame: Loaded data as a pandas DataFrame.
     """
-    data = pd.read_csv(file_path)
+    with stage('load_data') as record:
+        if file_format(file_path) == 'csv':
+            if lean:
+                data = _read_csv_lean(file_path, columns)
+            else:
+                data = pd.read_csv(file_path, usecols=_usecols(columns))
+        elif lean:
+            table = _read_table(file_path, columns)
+            data = shrink_dtypes(table.to_pandas(split_blocks=True, strings_to_categorical=True))
+        else:
+            data = _to_pandas(_read_table(file_path, columns))
+        record.set_shape(data)
     return data
 
-def preprocess_data(df):
+def _read_csv_lean(file_path, columns):
+    usecols = _usecols(columns)
+    # Text columns of a small sample are read as text in every chunk, so a chunk
+    # where one is all missing or all digits is not parsed as numbers
+    sample = pd.read_csv(file_path, nrows=LEAN_SAMPLE_ROWS, usecols=usecols)
+    text = [col for col in sample.columns
+            if pd.api.types.is_object_dtype(sample[col]) or pd.api.types.is_string_dtype(sample[col])]
+    chunks, categorical = [], None
+    with pd.read_csv(file_path, chunksize=LEAN_CHUNK_ROWS, usecols=usecols, dtype={col: str for col in text}) as reader:
+        for chunk in reader:
+            if categorical is not None:
+                for col in categorical:
+                    # Text only after the sample: a later chunk may still have parsed it as numbers
+                    if not pd.api.types.is_string_dtype(chunk[col]):
+                        text_dtype = chunks[0][col].cat.categories.dtype
+                        chunk[col] = chunk[col].map(str, na_action='ignore').astype(text_dtype)
+            chunks.append(shrink_dtypes(chunk, categorical))
+            if categorical is None:
+                # The first chunk decides which text columns become categoricals
+                categorical = [col for col in chunk.columns if isinstance(chunk[col].dtype, pd.CategoricalDtype)]
+    if not chunks:
+        return shrink_dtypes(sample)
+    if len(chunks) == 1:
+        return chunks[0]
+    for col in categorical:
+        # Chunks must share their categories or concat falls back to object
+        categories = pd.api.types.union_categoricals([chunk[col] for chunk in chunks]).categories
+        for chunk in chunks:
+            chunk[col] = chunk[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+def shrink_dtypes(df, categorical=None):
+    """
+    Convert the columns of df in place to the smallest dtypes that hold their
+    values exactly: integers to the narrowest integer type, floats to float32
+    when no value changes, and repetitive text columns to categoricals.
+    Args:
+        df (pd.DataFrame): Data to shrink.
+        categorical (list): Text columns to make categorical. When None,
+            text columns with at most CATEGORY_MAX_SHARE distinct values are.
+    Returns:
+        pd.DataFrame: df itself.
+    """
+    for col in df.columns:
+        series = df[col]
+        dtype = series.dtype
+        if pd.api.types.is_bool_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_numeric_dtype(dtype):
+            if not isinstance(dtype, np.dtype):
+                continue
+            if pd.api.types.is_integer_dtype(dtype):
+                df[col] = pd.to_numeric(series, downcast='integer')
+            elif dtype.itemsize > 4:
+                values = series.to_numpy()
+                narrow = values.astype(np.float32)
+                if np.array_equal(narrow, values, equal_nan=True):
+                    df[col] = narrow
+        elif not pd.api.types.is_string_dtype(dtype):
+            continue
+        elif categorical is not None:
+            if col in categorical:
+                df[col] = series.astype('category')
+        elif series.nunique() <= CATEGORY_MAX_SHARE * len(series):
+            df[col] = series.astype('category')
+    return df
+
+def iter_chunks(file_path, chunksize, columns=None):
+    """
+    Read a CSV, Parquet or Arrow IPC file as a sequence of fixed-size DataFrames.
+    Args:
+        file_path (str): Path to the file; the format follows the extension.
+        chunksize (int): Maximum number of rows per chunk.
+        columns (list): Optional columns to load, as in load_data.
+    Returns:
+        iterator: pd.DataFrame chunks in file order.
+    """
+    fmt = file_format(file_path)
+    if fmt == 'csv':
+        with pd.read_csv(file_path, chunksize=chunksize, usecols=_usecols(columns)) as reader:
+            for chunk in reader:
+                yield chunk
+    elif fmt == 'parquet':
+        pa = _import_pyarrow()
+        parquet_file = pa.parquet.ParquetFile(file_path, memory_map=True)
+        columns = _present(parquet_file.schema_arrow.names, columns)
+        start = 0
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            chunk = _to_pandas(pa.Table.from_batches([batch]))
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+    else:
+        # Slices of a memory-mapped table are zero-copy views
+        table = _read_table(file_path, columns)
+        for start in range(0, table.num_rows, chunksize):
+            chunk = _to_pandas(table.slice(start, chunksize))
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            yield chunk
+
+class DataWriter:
+    """
+    Appends DataFrames to a CSV, Parquet or Arrow IPC file, the format
+    following the file extension. Columnar files take their schema from the
+    first frame written, except that a column with no values in it, which
+    pandas reads from CSV as float, is written as text; later frames are
+    cast to that schema. Use as a context manager or call close().
+    """
+    def __init__(self, file_path, fmt=None):
+        self.file_path = file_path
+        self.format = fmt or file_format(file_path)
+        self._writer = None
+        self._schema = None
+        self._rows = 0
+        if self.format != 'csv':
+            self._pa = _import_pyarrow()
+
+    def write(self, df):
+        if self.format == 'csv':
+            df.to_csv(self.file_path, mode='w' if self._rows == 0 else 'a', header=self._rows == 0, index=False)
+        else:
+            if self._writer is None:
+                table = self._pa.Table.from_pandas(df, preserve_index=False)
+                self._schema = _text_for_empty(self._pa, table)
+                table = table.cast(self._schema)
+                if self.format == 'parquet':
+                    self._writer = self._pa.parquet.ParquetWriter(self.file_path, self._schema)
+                else:
+                    self._writer = self._pa.ipc.new_file(self.file_path, self._schema)
+            else:
+                table = self._pa.Table.from_pandas(_as_text(self._pa, df, self._schema), schema=self._schema,
+                                                   preserve_index=False)
+            self._writer.write_table(table)
+        self._rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _text_for_empty(pa, table):
+    # Schema of the first frame, with its all-missing columns typed as text
+    schema = table.schema
+    if table.num_rows == 0:
+        return schema
+    for i, field in enumerate(schema):
+        text = pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+        if table.column(i).null_count == table.num_rows and not text and not pa.types.is_dictionary(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+def _as_text(pa, df, schema):
+    # Values of text schema columns that pandas parsed as numbers, as text
+    converted = {}
+    for field in schema:
+        if (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)) and field.name in df.columns:
+            values = df[field.name]
+            if not (pd.api.types.is_string_dtype(values) or pd.api.types.is_object_dtype(values)):
+                converted[field.name] = values.astype(str).where(values.notna(), None)
+    return df.assign(**converted) if converted else df
+
+def save_data(df, file_path):
+    """
+    Write a DataFrame as CSV, Parquet or Arrow IPC, following the extension.
+    """
+    with DataWriter(file_path) as writer:
+        writer.write(df)
+
+def compute_fill_values(df):
+    """
+    Compute the values used to fill missing data: median for numeric
+    columns and mode for categorical columns.
+    Args:
+        df (pd.DataFrame): Raw insurance claims data.
+    Returns:
+        dict: Mapping of column name to fill value.
+    """
+    fill_values = {}
+    for col in df.select_dtypes(include=['number']).columns:
+        fill_values[col] = df[col].median()
+    for col in df.select_dtypes(include=TEXT_DTYPES + ['category']).columns:
+        mode = df[col].mode()
+        fill_values[col] = mode[0] if len(mode) else ''
+    return fill_values
+
+def preprocess_data(df, fill_values=None, inplace=False):
     """
     Preprocess the insurance claims data for fraud detection.
     Args:
         df (pd.DataFrame): Raw insurance claims data.
+        fill_values (dict): Optional precomputed fill values (see
+            compute_fill_values). Computed from df when not provided.
+        inplace (bool): Fill the missing values of df itself rather than
+            of a copy, for callers that no longer need the raw data.
     Returns:
         pd.DataFrame: Preprocessed data ready for model input.
     """
-    df = df.copy()
+    if fill_values is None:
+        fill_values = compute_fill_values(df)
     
-    # Fill missing numeric values with median
+    # Fill missing numeric values with median and categorical values with mode
     numeric_cols = df.select_dtypes(include=['number']).columns
-    for col in numeric_cols:
-        median_val = df[col].median()
-        df[col] = df[col].fillna(median_val)
-    
-    # Fill missing categorical values with mode
-    categorical_cols = df.select_dtypes(include=['object']).columns
-    for col in categorical_cols:
-        mode_val = df[col].mode()[0]
-        df[col] = df[col].fillna(mode_val)
+    categorical_cols = df.select_dtypes(include=TEXT_DTYPES).columns
+    fills = {col: fill_values[col] for col in numeric_cols.append(categorical_cols) if col in fill_values}
+    if inplace:
+        df.fillna(fills, inplace=True)
+    else:
+        # The one copy of the raw data
+        df = df.fillna(fills)
     
     # Convert categorical columns to dummy variables
     df = pd.get_dummies(df, columns=categorical_cols, drop_first=True)
     
     return df
+
+class ClaimsPreprocessor:
+    """
+    Stateful replacement for preprocess_data. Fill values and the category
+    vocabulary are learned once in fit; transform then encodes any batch into
+    the same fixed-width matrix. Categories not seen during fit are mapped to
+    a reserved '<col>___unknown' column.
+
+    With encoding='auto' each text column gets an encoder suited to its
+    cardinality: columns with at most max_onehot distinct values are one-hot
+    encoded, wider ones (IDs, free text) use the high_cardinality encoder,
+    and columns holding dates become numeric day, month and day-of-week
+    features. encoding='onehot' one-hot encodes every text column.
+    """
+    UNKNOWN = '__unknown'
+    ENCODINGS = ('auto', 'onehot')
+    HIGH_CARDINALITY_ENCODERS = ('frequency', 'hash', 'target')
+    # Weight of the overall fraud rate in a target-encoded category mean, in rows
+    TARGET_SMOOTHING = 20.0
+    TARGET_FOLDS = 5
+    # Rows transform encodes at a time, bounding its per-column temporary arrays
+    BLOCK_ROWS = 65536
+
+    def __init__(self, exclude=None, encoding='auto', max_onehot=20, high_cardinality='frequency',
+                 hash_buckets=32, date_columns=None):
+        """
+        Args:
+            exclude (list): Columns to leave out, e.g. the target column.
+            encoding (str): 'auto' or 'onehot', see the class docstring.
+            max_onehot (int): Most distinct values a column may have to be
+                one-hot encoded in 'auto' mode.
+            high_cardinality (str): Encoder for wider columns: 'frequency'
+                (share of training rows with the value), 'hash' (one-hot
+                into hash_buckets columns) or 'target' (smoothed fraud rate
+                of the value; needs labels in fit, otherwise 'frequency').
+            hash_buckets (int): Output columns per hashed column.
+            date_columns (list): Text columns to treat as dates. Detected
+                from the values when None in 'auto' mode.
+        """
+        if encoding not in self.ENCODINGS:
+            raise ValueError(f"Unknown encoding '{encoding}'; expected one of {self.ENCODINGS}.")
+        if high_cardinality not in self.HIGH_CARDINALITY_ENCODERS:
+            raise ValueError(f"Unknown high-cardinality encoder '{high_cardinality}'; "
+                             f"expected one of {self.HIGH_CARDINALITY_ENCODERS}.")
+        self.exclude = list(exclude or [])
+        self.encoding = encoding
+        self.max_onehot = max_onehot
+        self.high_cardinality = high_cardinality
+        self.hash_buckets = hash_buckets
+        self.date_columns = date_columns
+        self.numeric_columns_ = None
+        self.date_columns_ = None
+        self.categorical_columns_ = None
+        self.encoders_ = None
+        self.fill_values_ = None
+        self.categories_ = None
+        self.value_tables_ = None
+        self.offsets_ = None
+        self.feature_names_ = None
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'encoders_' not in state:
+            # Saved before encoders were chosen per column: everything was one-hot
+            self.encoding = 'onehot'
+            self.max_onehot = None
+            self.high_cardinality = 'frequency'
+            self.hash_buckets = 32
+            self.date_columns = None
+            self.date_columns_ = []
+            self.encoders_ = {col: 'onehot' for col in self.categorical_columns_ or []}
+            self.value_tables_ = {}
+            if self.feature_names_ is not None:
+                self._build_lookup()
+
+    def fit(self, df, y=None):
+        """
+        Learn fill values, category vocabularies and the output layout.
+        Args:
+            df (pd.DataFrame): Raw insurance claims data.
+            y (array-like): Optional 0/1 fraud labels, used by target encoding.
+        Returns:
+            ClaimsPreprocessor: The fitted preprocessor.
+        """
+        columns = [col for col in df.columns if col not in self.exclude]
+        self.numeric_columns_ = [col for col in columns if pd.api.types.is_numeric_dtype(df[col])]
+        text_columns = [col for col in columns if col not in self.numeric_columns_]
+        if self.date_columns is not None:
+            self.date_columns_ = [col for col in text_columns if col in self.date_columns]
+        elif self.encoding == 'auto':
+            self.date_columns_ = [col for col in text_columns if is_date_column(df[col])]
+        else:
+            self.date_columns_ = []
+        self.categorical_columns_ = [col for col in text_columns if col not in self.date_columns_]
+        self.fill_values_ = compute_fill_values(df[self.numeric_columns_ + self.categorical_columns_])
+        for col in self.date_columns_:
+            days = to_claim_days(df[col])
+            self.fill_values_[col] = float(np.nanmedian(days)) if np.isfinite(days).any() else 0.0
+
+        target = None if y is None else np.asarray(y, dtype=float)
+        self.categories_ = {}
+        self.encoders_ = {}
+        self.value_tables_ = {}
+        for col in self.categorical_columns_:
+            counts = df[col].dropna().astype(str).value_counts(sort=False)
+            vocab = sorted(counts.index)
+            if col not in self.fill_values_ or pd.isna(self.fill_values_[col]):
+                self.fill_values_[col] = vocab[0] if vocab else ''
+            self.fill_values_[col] = str(self.fill_values_[col])
+
+            encoder = self._choose_encoder(len(vocab), target)
+            self.encoders_[col] = encoder
+            self.categories_[col] = [] if encoder == 'hash' else vocab
+            if encoder == 'frequency':
+                # Unseen values get 0, i.e. never seen in training
+                table = counts.reindex(vocab).to_numpy(dtype=float) / max(len(df), 1)
+                self.value_tables_[col] = np.append(table, 0.0)
+            elif encoder == 'target':
+                codes = pd.Index(vocab, dtype=object).get_indexer(self._filled_strings(df, col))
+                self.value_tables_[col] = _target_table(codes, target, len(vocab), self.TARGET_SMOOTHING)
+
+        self.feature_names_ = list(self.numeric_columns_)
+        for col in self.date_columns_:
+            self.feature_names_.extend(f"{col}_{part}" for part in DATE_FEATURES)
+        self.offsets_ = {}
+        for col in self.categorical_columns_:
+            self.offsets_[col] = len(self.feature_names_)
+            encoder = self.encoders_[col]
+            if encoder == 'onehot':
+                self.feature_names_.extend(f"{col}_{value}" for value in self.categories_[col])
+                self.feature_names_.append(f"{col}_{self.UNKNOWN}")
+            elif encoder == 'hash':
+                self.feature_names_.extend(f"{col}_hash_{i}" for i in range(self.hash_buckets))
+            else:
+                self.feature_names_.append(f"{col}_{encoder}")
+        self._build_lookup()
+        return self
+
+    def _choose_encoder(self, n_values, target):
+        if self.encoding == 'onehot' or n_values <= self.max_onehot:
+            return 'onehot'
+        if self.high_cardinality == 'target' and target is None:
+            return 'frequency'
+        return self.high_cardinality
+
+    def _build_lookup(self):
+        # Vocabulary indexes, kept so their hash tables are built once rather
+        # than per batch, and value -> output column index for single records
+        self.value_index_ = {}
+        self.category_index_ = {}
+        self.fill_index_ = {}
+        for col in self.categorical_columns_:
+            self.value_index_[col] = pd.Index(self.categories_[col], dtype=object)
+            if self.encoders_[col] != 'onehot':
+                continue
+            offset = self.offsets_[col]
+            vocab = self.categories_[col]
+            self.category_index_[col] = {value: offset + code for code, value in enumerate(vocab)}
+            self.fill_index_[col] = self.category_index_[col].get(self.fill_values_[col], offset + len(vocab))
+
+    def _filled_strings(self, df, col):
+        # Column values as strings with missing values replaced by the fill value
+        if col not in df.columns:
+            return np.full(len(df), self.fill_values_[col], dtype=object)
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Each category is converted once; code -1 (missing) takes the appended fill value
+            values = np.append(series.cat.categories.astype(str).to_numpy(dtype=object), self.fill_values_[col])
+            return values[series.cat.codes.to_numpy()]
+        strings = series.astype(str).to_numpy(dtype=object)
+        strings[series.isna().to_numpy()] = self.fill_values_[col]
+        return strings
+
+    def numeric_values(self, df, col):
+        """
+        A numeric column of df as float64 with missing values filled, exactly
+        as transform encodes it.
+        """
+        fill = self.fill_values_.get(col, 0)
+        if col not in df.columns:
+            return np.full(len(df), fill, dtype=np.float64)
+        values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        return np.where(np.isnan(values), fill, values)
+
+    def _encode_dates(self, X, col, days):
+        offset = self.feature_names_.index(f"{col}_{DATE_FEATURES[0]}")
+        days = np.where(np.isnan(days), self.fill_values_[col], days)
+        X[:, offset] = days
+        X[:, offset + 1], X[:, offset + 2] = date_parts(days)
+
+    def _encode_strings(self, X, col, strings):
+        # Encoders other than one-hot, given the filled string values
+        offset = self.offsets_[col]
+        if self.encoders_[col] == 'hash':
+            X[np.arange(len(strings)), offset + hash_codes(strings, self.hash_buckets)] = 1.0
+        else:
+            # get_indexer gives -1 for unseen values, the last table entry
+            X[:, offset] = self.value_tables_[col][self.value_index_[col].get_indexer(strings)]
+
+    def transform(self, df, dtype=np.float64, extra_columns=0):
+        """
+        Encode a batch of claims into the fitted layout.
+        Args:
+            df (pd.DataFrame): Raw insurance claims data. Columns missing from
+                the batch are treated as entirely missing values.
+            dtype (np.dtype): Dtype of the matrix. Values are computed in
+                float64 and rounded once when stored.
+            extra_columns (int): Zero columns appended after the encoded
+                features, so callers can add features without a copy.
+        Returns:
+            np.ndarray: Matrix of shape (len(df), len(feature_names_) + extra_columns).
+        """
+        if self.feature_names_ is None:
+            raise ValueError("ClaimsPreprocessor must be fitted before transform.")
+        X = np.zeros((len(df), len(self.feature_names_) + extra_columns), dtype=dtype)
+        for start in range(0, len(df), self.BLOCK_ROWS):
+            # Row slices of df and X are views, so each block is encoded in place
+            self._encode_block(df.iloc[start:start + self.BLOCK_ROWS], X[start:start + self.BLOCK_ROWS])
+        return X
+
+    def _encode_block(self, df, X):
+        n_rows = len(df)
+        for j, col in enumerate(self.numeric_columns_):
+            X[:, j] = self.numeric_values(df, col)
+
+        for col in self.date_columns_:
+            days = to_claim_days(df[col]) if col in df.columns else np.full(n_rows, np.nan)
+            self._encode_dates(X, col, days)
+
+        rows = np.arange(n_rows)
+        for col in self.categorical_columns_:
+            if self.encoders_[col] != 'onehot':
+                self._encode_strings(X, col, self._filled_strings(df, col))
+                continue
+            # Missing values are already the fill value; -1 means unseen, the reserved bucket
+            codes = self.value_index_[col].get_indexer(self._filled_strings(df, col))
+            codes[codes == -1] = len(self.categories_[col])
+            X[rows, self.offsets_[col] + codes] = 1.0
+
+    def transform_records(self, records):
+        """
+        Encode claims given as dicts into the fitted layout without building
+        a DataFrame. Intended for scoring one or a few claims at a time.
+        Args:
+            records (list): Claims as dicts of column name to value.
+        Returns:
+            np.ndarray: Float matrix of shape (len(records), len(feature_names_)).
+        """
+        if self.feature_names_ is None:
+            raise ValueError("ClaimsPreprocessor must be fitted before transform.")
+        X = np.zeros((len(records), len(self.feature_names_)))
+        numeric_fills = [self.fill_values_.get(col, 0) for col in self.numeric_columns_]
+        onehot_columns = [col for col in self.categorical_columns_ if self.encoders_[col] == 'onehot']
+        for i, record in enumerate(records):
+            row = X[i]
+            for j, col in enumerate(self.numeric_columns_):
+                row[j] = _to_float(record.get(col), numeric_fills[j])
+            for col in onehot_columns:
+                value = record.get(col)
+                if value is None or value != value:
+                    row[self.fill_index_[col]] = 1.0
+                else:
+                    index = self.category_index_[col].get(str(value))
+                    row[index if index is not None else self.offsets_[col] + len(self.categories_[col])] = 1.0
+        for col in self.date_columns_:
+            self._encode_dates(X, col, np.array([record_claim_day(record.get(col)) for record in records], dtype=float))
+        for col in self.categorical_columns_:
+            if self.encoders_[col] != 'onehot':
+                fill = self.fill_values_[col]
+                values = (record.get(col) for record in records)
+                strings = np.array([fill if v is None or v != v else str(v) for v in values], dtype=object)
+                self._encode_strings(X, col, strings)
+        return X
+
+    def fit_transform(self, df, y=None, dtype=np.float64, extra_columns=0):
+        """
+        Fit on df and encode it. Target-encoded columns of the training rows
+        are computed out of fold, from the other rows' labels only, so the
+        models cannot read each row's own label back from its encoding.
+        """
+        X = self.fit(df, y).transform(df, dtype, extra_columns)
+        self.encode_out_of_fold(X, df, y)
+        return X
+
+    def encode_out_of_fold(self, X, df, y):
+        """
+        Overwrite the target-encoded columns of X, the encoded training rows
+        df, with their out-of-fold encodings. Does nothing without labels.
+        """
+        if y is None:
+            return
+        target = np.asarray(y, dtype=float)
+        folds = np.random.default_rng(0).permutation(len(df)) % self.TARGET_FOLDS
+        for col in self.categorical_columns_:
+            if self.encoders_[col] != 'target':
+                continue
+            codes = self.value_index_[col].get_indexer(self._filled_strings(df, col))
+            n_values = len(self.categories_[col])
+            for fold in range(self.TARGET_FOLDS):
+                in_fold = folds == fold
+                table = _target_table(codes[~in_fold], target[~in_fold], n_values, self.TARGET_SMOOTHING)
+                X[in_fold, self.offsets_[col]] = table[codes[in_fold]]
+
+def is_date_column(series, sample_size=1000, min_share=0.9):
+    """
+    Whether a text column holds dates, judged from its first sample_size
+    values: most present values must look like and parse as dates.
+    """
+    sample = series.iloc[:sample_size].dropna().astype(str)
+    if sample.empty or sample.str.match(_DATE_PATTERN).mean() < min_share:
+        return False
+    return np.isfinite(to_claim_days(sample)).mean() >= min_share
+
+def date_parts(days):
+    """
+    Month (1-12) and day of week (Monday is 0) of float days since 1970-01-01.
+    """
+    whole_days = np.floor(days).astype(np.int64)
+    months = whole_days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    # 1970-01-01 was a Thursday
+    return months % 12 + 1, (whole_days + 3) % 7
+
+def hash_codes(strings, n_buckets):
+    """
+    Stable bucket numbers for string values; the same value always lands in
+    the same bucket, across processes and runs.
+    """
+    return (pd.util.hash_array(np.asarray(strings, dtype=object)) % np.uint64(n_buckets)).astype(np.int64)
+
+def _target_table(codes, target, n_values, smoothing):
+    # Smoothed fraud rate per value code, with the overall rate appended for unseen values
+    labeled = (codes >= 0) & ~np.isnan(target)
+    prior = float(target[labeled].mean()) if labeled.any() else 0.0
+    sums = np.bincount(codes[labeled], weights=target[labeled], minlength=n_values)
+    counts = np.bincount(codes[labeled], minlength=n_values)
+    return np.append((sums + prior * smoothing) / (counts + smoothing), prior)
+
+def _to_float(value, fill):
+    # Mirrors pd.to_numeric(errors='coerce') followed by fillna(fill)
+    if value is None:
+        return fill
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return fill
+    return fill if value != value else value
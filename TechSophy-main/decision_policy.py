@@ -0,0 +1,127 @@
+import math
+import numpy as np
+
+# Batches smaller than this are flagged by the policy's thresholds even in
+# budget mode; a share of a handful of claims is mostly rounding
+BUDGET_MIN_ROWS = 100
+
+class DecisionPolicy:
+    """
+    Turns the fraud model's probabilities and the anomaly detector's scores
+    into fraud flags in one vectorized pass. A claim's risk is
+
+        fraud_weight * fraud_probability + anomaly_weight * anomaly_risk
+
+    where anomaly_risk is minus the IsolationForest score_samples value:
+    between 0 and 1, about 0.5 for ordinary claims and higher for isolated
+    ones. A claim is flagged when its risk reaches threshold, its fraud
+    probability reaches fraud_threshold or its anomaly risk reaches
+    anomaly_threshold; unset thresholds flag nothing. With a budget, exactly
+    that share of each scored batch is flagged instead, the claims with the
+    highest risk, found by partial selection rather than a full sort.
+    """
+    def __init__(self, fraud_weight=1.0, anomaly_weight=0.0, threshold=None, fraud_threshold=None,
+                 anomaly_threshold=None, budget=None, calibration=None):
+        """
+        Args:
+            fraud_weight (float): Weight of the fraud probability in the risk.
+            anomaly_weight (float): Weight of the anomaly risk in the risk.
+            threshold (float): Risk at and above which claims are flagged.
+            fraud_threshold (float): Fraud probability at and above which
+                claims are flagged whatever their risk.
+            anomaly_threshold (float): Anomaly risk at and above which
+                claims are flagged whatever their risk.
+            budget (float): Share of each batch to flag, between 0 and 1.
+                Batches under BUDGET_MIN_ROWS use the thresholds instead.
+            calibration (dict): Precision, recall and flagged share the
+                policy reached on the data it was calibrated on, if any.
+        """
+        if budget is not None and not 0 <= budget <= 1:
+            raise ValueError("The flag budget must be a share between 0 and 1.")
+        self.fraud_weight = fraud_weight
+        self.anomaly_weight = anomaly_weight
+        self.threshold = threshold
+        self.fraud_threshold = fraud_threshold
+        self.anomaly_threshold = anomaly_threshold
+        self.budget = budget
+        self.calibration = calibration
+
+    @classmethod
+    def default(cls, anomaly_offset):
+        """
+        The policy that flags exactly what the models' own predict methods
+        flag: fraud probability above 0.5, or a score_samples value below
+        the anomaly detector's offset_.
+        Args:
+            anomaly_offset (float): The fitted IsolationForest's offset_.
+        """
+        # Strict inequalities expressed as inclusive thresholds one float above
+        return cls(fraud_threshold=float(np.nextafter(0.5, 1.0)),
+                   anomaly_threshold=float(np.nextafter(-anomaly_offset, np.inf)))
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+    def to_dict(self):
+        return {
+            'fraud_weight': self.fraud_weight,
+            'anomaly_weight': self.anomaly_weight,
+            'threshold': self.threshold,
+            'fraud_threshold': self.fraud_threshold,
+            'anomaly_threshold': self.anomaly_threshold,
+            'budget': self.budget,
+            'calibration': self.calibration,
+        }
+
+    def with_budget(self, budget):
+        """
+        A copy of the policy flagging the given share of each batch.
+        """
+        values = self.to_dict()
+        values.update(budget=budget, calibration=None)
+        return DecisionPolicy.from_dict(values)
+
+    def risk(self, fraud_proba, anomaly_scores):
+        """
+        Args:
+            fraud_proba (np.ndarray): Fraud probabilities.
+            anomaly_scores (np.ndarray): score_samples values.
+        Returns:
+            np.ndarray: The weighted risk of each claim.
+        """
+        return (self.fraud_weight * np.asarray(fraud_proba, dtype=float)
+                - self.anomaly_weight * np.asarray(anomaly_scores, dtype=float))
+
+    def flag(self, fraud_proba, anomaly_scores):
+        """
+        Args:
+            fraud_proba (np.ndarray): Fraud probabilities.
+            anomaly_scores (np.ndarray): score_samples values.
+        Returns:
+            np.ndarray: 1 for flagged claims, 0 otherwise.
+        """
+        fraud_proba = np.asarray(fraud_proba, dtype=float)
+        anomaly_scores = np.asarray(anomaly_scores, dtype=float)
+        n = len(fraud_proba)
+        if self.budget is not None and n >= BUDGET_MIN_ROWS:
+            flags = np.zeros(n, dtype=int)
+            n_flagged = budget_count(n, self.budget)
+            if n_flagged:
+                risk = self.risk(fraud_proba, anomaly_scores)
+                flags[np.argpartition(-risk, n_flagged - 1)[:n_flagged]] = 1
+            return flags
+        flags = np.zeros(n, dtype=bool)
+        if self.threshold is not None:
+            flags |= self.risk(fraud_proba, anomaly_scores) >= self.threshold
+        if self.fraud_threshold is not None:
+            flags |= fraud_proba >= self.fraud_threshold
+        if self.anomaly_threshold is not None:
+            flags |= -anomaly_scores >= self.anomaly_threshold
+        return flags.astype(int)
+
+def budget_count(n, budget):
+    """
+    Number of claims a budget flags in a batch of n, rounded half up.
+    """
+    return min(n, int(math.floor(budget * n + 0.5)))
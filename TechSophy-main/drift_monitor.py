@@ -0,0 +1,262 @@
+import numpy as np
+import pandas as pd
+from claimant_store import to_claim_days
+from instrumentation import stage
+
+# Numeric and date columns are bucketed on this many reference quantiles
+QUANTILE_BINS = 10
+# Most frequent training values of a categorical column kept as buckets;
+# the rest share one 'other' bucket
+MAX_CATEGORIES = 50
+# Values outside a complete vocabulary remembered as examples, per column
+MAX_UNSEEN_EXAMPLES = 10
+# Population stability index at and above which a column is reported as
+# drifting; the usual rule of thumb for binned distributions
+PSI_WARN = 0.1
+PSI_DRIFT = 0.25
+# Rise in a column's null rate over training at and above which it is
+# reported; unparseable values count as nulls, as preprocessing fills both
+NULL_RATE_WARN = 0.05
+NULL_RATE_DRIFT = 0.2
+# Columns seen in fewer rows are not judged; their shares are mostly noise
+MIN_DRIFT_ROWS = 100
+# Floor of bucket shares in the PSI, so empty buckets stay finite
+PSI_FLOOR = 1e-4
+
+OK, WARN, DRIFT, MISSING, TOO_FEW_ROWS = 'ok', 'warn', 'drift', 'missing', 'too_few_rows'
+
+class DriftProfile:
+    """
+    Reference distribution of every raw column the feature pipeline reads,
+    as seen in the training claims: per numeric or date column, the shares
+    of values between its training quantiles; per categorical column, the
+    shares of its most frequent values; and the null rates of both. Stored
+    with the artifact so scoring can tell when incoming claims stop looking
+    like the training claims, which preprocessing would otherwise hide by
+    filling in whatever is missing or unknown.
+    """
+    def __init__(self, columns, rows=0):
+        """
+        Args:
+            columns (dict): Column name -> reference dict with 'kind'
+                ('numeric', 'date' or 'categorical'), 'edges' (bucket
+                boundaries) or 'categories' (bucket values), 'shares' (per
+                bucket, of the non-null values) and 'null_rate'.
+                Categorical columns also have 'complete': whether every
+                training value has its own bucket.
+            rows (int): Training claims the profile was built from.
+        """
+        self.columns = columns
+        self.rows = rows
+
+    @classmethod
+    def fit(cls, df, pipeline):
+        """
+        Profile the raw training claims of a fitted feature pipeline.
+        Args:
+            df (pd.DataFrame): Raw training claims.
+            pipeline (FeaturePipeline): The pipeline fitted on them.
+        Returns:
+            DriftProfile: The reference profile.
+        """
+        p = pipeline.preprocessor
+        columns = {}
+        for kind, names in (('numeric', p.numeric_columns_), ('date', p.date_columns_),
+                            ('categorical', p.categorical_columns_)):
+            for col in names:
+                if col in df.columns:
+                    columns[col] = _reference_buckets(df[col], kind)
+        # Bucket the training claims like any scored batch to get the shares
+        monitor = DriftMonitor(cls(columns))
+        monitor.update(df)
+        for col, reference in columns.items():
+            sketch = monitor.sketches[col]
+            reference['shares'] = (sketch.counts / max(sketch.counts.sum(), 1)).tolist()
+            reference['null_rate'] = sketch.nulls / max(sketch.rows, 1)
+            if reference['kind'] == 'categorical':
+                reference['complete'] = bool(sketch.counts[-1] == 0)
+        return cls(columns, len(df))
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+    def to_dict(self):
+        return {'columns': self.columns, 'rows': self.rows}
+
+    def monitor(self):
+        """
+        A new DriftMonitor comparing batches with this profile.
+        """
+        return DriftMonitor(self)
+
+class DriftMonitor:
+    """
+    Streaming sketches of scored batches, compared with a DriftProfile. Each
+    batch only adds to fixed-size count arrays per column, so memory stays
+    constant however many claims pass through, and a column costs one
+    vectorized bucketing pass per batch. Categorical and date columns are
+    bucketed per distinct value rather than per row.
+    """
+    def __init__(self, profile):
+        """
+        Args:
+            profile (DriftProfile): Reference to compare with.
+        """
+        self.profile = profile
+        self.sketches = {col: ColumnSketch(reference) for col, reference in profile.columns.items()}
+        self.rows = 0
+
+    def update(self, df):
+        """
+        Add a batch of raw claims. Columns the profile does not know are
+        ignored; columns missing from the batch are counted as absent.
+        """
+        with stage('drift_monitor', df):
+            self.rows += len(df)
+            for col, sketch in self.sketches.items():
+                if col in df.columns:
+                    sketch.update(df[col])
+
+    def report(self):
+        """
+        Drift of every profiled column over all batches seen so far.
+        Returns:
+            dict: 'rows', 'columns' (column -> 'kind', 'rows', 'null_rate',
+                'reference_null_rate', 'psi', 'status' and, for categorical
+                columns with a complete vocabulary, 'unseen_values') and
+                'drifted' (columns whose status is 'drift' or 'missing').
+                status is 'ok', 'warn', 'drift', 'missing' (in no batch) or
+                'too_few_rows'.
+        """
+        columns = {col: sketch.report(self.rows) for col, sketch in self.sketches.items()}
+        return {
+            'rows': self.rows,
+            'columns': columns,
+            'drifted': [col for col, column in columns.items() if column['status'] in (DRIFT, MISSING)],
+        }
+
+class ColumnSketch:
+    """
+    Bucket counts, null count and row count of one column; see DriftMonitor.
+    """
+    def __init__(self, reference):
+        self.reference = reference
+        self.kind = reference['kind']
+        if self.kind == 'categorical':
+            # One bucket per reference category plus 'other'
+            self.index = pd.Index(reference['categories'], dtype=object)
+            self.counts = np.zeros(len(self.index) + 1, dtype=np.int64)
+            self.unseen = {}
+        else:
+            # Below the training minimum, between each pair of edges, above the maximum
+            self.edges = np.asarray(reference['edges'], dtype=float)
+            self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.rows = 0
+        self.nulls = 0
+
+    def update(self, series):
+        self.rows += len(series)
+        if self.kind == 'numeric':
+            values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+            present = values[~np.isnan(values)]
+            self.nulls += len(values) - len(present)
+            self.counts += np.bincount(self._buckets(present), minlength=len(self.counts))
+            return
+        counts = series.value_counts(dropna=True)
+        self.nulls += len(series) - int(counts.sum())
+        if self.kind == 'date':
+            days = to_claim_days(counts.index)
+            parsed = ~np.isnan(days)
+            self.nulls += int(counts.to_numpy()[~parsed].sum())
+            self.counts += np.bincount(self._buckets(days[parsed]), weights=counts.to_numpy()[parsed],
+                                       minlength=len(self.counts)).astype(np.int64)
+            return
+        codes = self.index.get_indexer(counts.index.astype(str))
+        codes[codes == -1] = len(self.index)
+        self.counts += np.bincount(codes, weights=counts.to_numpy(), minlength=len(self.counts)).astype(np.int64)
+        if self.reference.get('complete'):
+            # Counts are sorted, so these are the batch's most frequent unseen
+            # values; only the overall most frequent are kept
+            unseen = codes == len(self.index)
+            values = counts.index[unseen][:MAX_UNSEEN_EXAMPLES].astype(str)
+            for value, count in zip(values, counts.to_numpy()[unseen][:MAX_UNSEEN_EXAMPLES].tolist()):
+                self.unseen[value] = self.unseen.get(value, 0) + count
+            self.unseen = dict(sorted(self.unseen.items(), key=lambda item: -item[1])[:MAX_UNSEEN_EXAMPLES])
+
+    def _buckets(self, values):
+        buckets = np.searchsorted(self.edges, values, side='right')
+        # The training maximum belongs to the last bucket inside the range
+        buckets[values == self.edges[-1]] -= 1
+        return buckets
+
+    def report(self, batch_rows):
+        reference_null_rate = self.reference['null_rate']
+        column = {
+            'kind': self.kind,
+            'rows': self.rows,
+            'null_rate': self.nulls / self.rows if self.rows else None,
+            'reference_null_rate': reference_null_rate,
+            'psi': None,
+            'status': MISSING if batch_rows and not self.rows else TOO_FEW_ROWS,
+        }
+        if self.kind == 'categorical' and self.reference.get('complete'):
+            column['unseen_values'] = dict(self.unseen)
+        if self.rows:
+            present = self.counts.sum()
+            column['psi'] = psi(self.reference['shares'], self.counts / present) if present else None
+        if self.rows >= MIN_DRIFT_ROWS:
+            null_rise = column['null_rate'] - reference_null_rate
+            score = column['psi'] or 0.0
+            if score >= PSI_DRIFT or null_rise >= NULL_RATE_DRIFT:
+                column['status'] = DRIFT
+            elif score >= PSI_WARN or null_rise >= NULL_RATE_WARN:
+                column['status'] = WARN
+            else:
+                column['status'] = OK
+        return column
+
+def psi(expected, actual):
+    """
+    Population stability index between two sets of bucket shares:
+    sum((actual - expected) * ln(actual / expected)), with shares floored
+    at PSI_FLOOR.
+    """
+    expected = np.maximum(np.asarray(expected, dtype=float), PSI_FLOOR)
+    actual = np.maximum(np.asarray(actual, dtype=float), PSI_FLOOR)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+def _reference_buckets(series, kind):
+    # Bucket layout of a training column; its shares are filled in by fit
+    if kind == 'categorical':
+        counts = series.value_counts(dropna=True)
+        categories = pd.unique(counts.index.astype(str).to_numpy(dtype=object))[:MAX_CATEGORIES]
+        return {'kind': kind, 'categories': [str(value) for value in categories]}
+    if kind == 'date':
+        values = to_claim_days(series)
+    else:
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    values = values[~np.isnan(values)]
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, QUANTILE_BINS + 1))) if len(values) else np.zeros(1)
+    if len(edges) == 1:
+        # A constant column still gets a bucket for its one value
+        edges = np.repeat(edges, 2)
+    return {'kind': kind, 'edges': edges.tolist()}
+
+def print_drift(report):
+    """
+    Print the columns of a drift report that drift or warn.
+    """
+    noted = {col: column for col, column in report['columns'].items() if column['status'] in (WARN, DRIFT, MISSING)}
+    if not noted:
+        print(f"No input drift from the training claims across {report['rows']} claims.")
+        return
+    print(f"Input drift from the training claims across {report['rows']} claims:")
+    for col, column in noted.items():
+        if column['status'] == MISSING:
+            print(f"  {col}: missing from every batch")
+            continue
+        print(f"  {col}: {column['status']} (PSI {column['psi'] or 0:.3f}, null rate {column['null_rate']:.1%} "
+              f"vs {column['reference_null_rate']:.1%} in training)")
+        if column.get('unseen_values'):
+            print(f"    unseen values: {', '.join(column['unseen_values'])}")
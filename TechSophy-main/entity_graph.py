@@ -0,0 +1,213 @@
+import numpy as np
+import pandas as pd
+
+# Identifier columns linking claims whenever they are present
+DEFAULT_LINK_COLUMNS = ('claimant_id', 'policy_id', 'policy_number')
+# Per-claim features, in the order the pipeline appends them
+GRAPH_FEATURES = ['ring_size', 'entity_degree']
+# Batches up to this many claims are factorized in plain Python, which beats
+# pandas' setup cost on the single-claim scoring path
+SMALL_BATCH_ROWS = 64
+
+class EntityGraph:
+    """
+    Claims linked through the entities they share: claimants, policies and
+    any other identifier columns. Claims and entities form a bipartite
+    graph, stored as a union-find forest over integer entity ids held in
+    flat NumPy arrays. A claim's ring is the connected component it falls
+    in. Every batch is merged in one connected-components pass over its
+    own links, so building the graph takes time roughly linear in the
+    number of claims, and a claim's features are found from a few array
+    lookups without walking the graph.
+    """
+    def __init__(self, link_columns=DEFAULT_LINK_COLUMNS):
+        """
+        Args:
+            link_columns (list): Columns whose equal values link claims.
+                Values of different columns never link.
+        """
+        self.link_columns = list(link_columns)
+        # Per link column: value -> entity id
+        self._ids = [{} for _ in self.link_columns]
+        self._n_entities = 0
+        self._parent = np.zeros(0, dtype=np.int64)
+        # Claims holding each entity, and claims in each ring (valid at roots)
+        self._entity_claims = np.zeros(0, dtype=np.int64)
+        self._ring_claims = np.zeros(0, dtype=np.int64)
+        self.n_claims = 0
+
+    def __len__(self):
+        return self._n_entities
+
+    def features(self, columns, n_rows):
+        """
+        Graph features for a batch from the stored graph plus the batch
+        itself. The graph is not modified.
+        Args:
+            columns (dict): Values of the link columns, one array-like per
+                column; missing columns and missing values link nothing.
+            n_rows (int): Number of claims in the batch.
+        Returns:
+            dict: Arrays 'ring_size' (claims in the claim's ring, itself
+                included) and 'entity_degree' (links to other claims, one
+                per other claim per shared entity).
+        """
+        return self._merge(columns, n_rows, commit=False)
+
+    def update(self, columns, n_rows):
+        """
+        Add a batch of claims to the graph.
+        Args:
+            columns (dict): See features.
+            n_rows (int): Number of claims in the batch.
+        """
+        self._merge(columns, n_rows, commit=True)
+
+    def _merge(self, columns, n_rows, commit):
+        # cells holds, per claim and link column, an index into entities
+        # (the batch's distinct entity ids), -1 when missing
+        cells, entities, new_values, n_entities = self._entity_ids(columns, n_rows, commit)
+        stored = entities < self._n_entities
+        entity_roots = entities.copy()
+        entity_roots[stored] = self._find(entities[stored])
+        # Rings touched by the batch, as indices into nodes
+        nodes, entity_nodes = np.unique(entity_roots, return_inverse=True)
+
+        # Each claim links its first entity, its anchor, to its others
+        anchors = cells[:, 0].copy()
+        edges = []
+        for column in cells.T[1:]:
+            missing = anchors < 0
+            anchors[missing] = column[missing]
+        for column in cells.T[1:]:
+            link = (column >= 0) & (column != anchors)
+            edges.append((anchors[link], column[link]))
+        has_links = anchors >= 0
+        if n_rows == 1:
+            # One claim links all of its entities into one ring
+            labels = np.zeros(len(nodes), dtype=np.int64)
+        elif any(len(a) for a, _ in edges):
+            # Only batches linking claims through two columns need scipy
+            from scipy.sparse import coo_matrix
+            from scipy.sparse.csgraph import connected_components
+            sources = entity_nodes[np.concatenate([a for a, _ in edges])]
+            targets = entity_nodes[np.concatenate([b for _, b in edges])]
+            adjacency = coo_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)),
+                                   shape=(len(nodes), len(nodes)))
+            _, labels = connected_components(adjacency, directed=False)
+        else:
+            labels = np.arange(len(nodes))
+
+        # Claims per ring: stored ones at the merged roots plus the batch's own
+        stored_claims = np.zeros(len(nodes), dtype=np.int64)
+        stored_nodes = nodes < self._n_entities
+        stored_claims[stored_nodes] = self._ring_claims[nodes[stored_nodes]]
+        entity_labels = labels[entity_nodes]
+        anchored = np.bincount(anchors[has_links], minlength=len(entities))
+        n_rings = labels.max(initial=-1) + 1
+        ring_claims = (np.bincount(labels, weights=stored_claims, minlength=n_rings)
+                       + np.bincount(entity_labels, weights=anchored, minlength=n_rings)).astype(np.int64)
+        ring_size = np.ones(n_rows)
+        ring_size[has_links] = ring_claims[entity_labels][anchors[has_links]]
+
+        # Claims per entity, stored plus batch; each claim links to the others
+        batch_counts = np.zeros(len(entities), dtype=np.int64)
+        for column in cells.T:
+            batch_counts += np.bincount(column[column >= 0], minlength=len(entities))
+        entity_claims = batch_counts.copy()
+        entity_claims[stored] += self._entity_claims[entities[stored]]
+        degree = np.zeros(n_rows)
+        for column in cells.T:
+            present = column >= 0
+            degree[present] += entity_claims[column[present]] - 1
+
+        if commit:
+            self._commit(new_values, n_entities, entities, batch_counts, nodes, entity_labels, labels,
+                         stored_claims, ring_claims)
+            self.n_claims += n_rows
+        return {'ring_size': ring_size, 'entity_degree': degree}
+
+    def _entity_ids(self, columns, n_rows, keep_new):
+        # Values not yet stored get ids from _n_entities upwards, returned
+        # with them when keep_new
+        cells = np.full((n_rows, len(self.link_columns)), -1, dtype=np.int64)
+        entities, new_values = [], []
+        next_id, offset = self._n_entities, 0
+        for j, col in enumerate(self.link_columns):
+            if col not in columns:
+                continue
+            codes, uniques = _factorize(columns[col], n_rows)
+            known = self._ids[j]
+            mapped = np.empty(len(uniques), dtype=np.int64)
+            for i, value in enumerate(uniques.tolist()):
+                entity = known.get(value)
+                if entity is None:
+                    entity = next_id
+                    next_id += 1
+                    if keep_new:
+                        new_values.append((j, value))
+                mapped[i] = entity
+            # Values are distinct within a column and columns never share entities
+            codes[codes >= 0] += offset
+            cells[:, j] = codes
+            offset += len(mapped)
+            entities.append(mapped)
+        entities = np.concatenate(entities) if entities else np.zeros(0, dtype=np.int64)
+        return cells, entities, new_values, next_id
+
+    def _find(self, entities):
+        # Vectorized find; union by size keeps the trees shallow
+        roots = self._parent[entities]
+        while True:
+            up = self._parent[roots]
+            if np.array_equal(up, roots):
+                return roots
+            roots = up
+
+    def _commit(self, new_values, n_entities, entities, batch_counts, nodes, entity_labels, labels, stored_claims,
+                ring_claims):
+        for entity, (j, value) in enumerate(new_values, start=self._n_entities):
+            self._ids[j][value] = entity
+        self._reserve(n_entities)
+        first_new = self._n_entities
+        self._parent[first_new:n_entities] = np.arange(first_new, n_entities)
+        self._n_entities = n_entities
+        self._entity_claims[entities] += batch_counts
+
+        # Union by size: each ring's root is its largest stored root
+        order = np.lexsort((-stored_claims, labels))
+        is_first = np.append(True, labels[order][1:] != labels[order][:-1])
+        ring_roots = np.empty(len(ring_claims), dtype=np.int64)
+        ring_roots[labels[order][is_first]] = nodes[order][is_first]
+        self._parent[nodes] = ring_roots[labels]
+        self._ring_claims[ring_roots] = ring_claims
+        # The batch's entities now point straight at their roots
+        self._parent[entities] = ring_roots[entity_labels]
+
+    def _reserve(self, n_entities):
+        # Grow the arrays geometrically so appends stay amortized O(1)
+        capacity = len(self._parent)
+        if n_entities <= capacity:
+            return
+        capacity = max(n_entities, 2 * capacity, 1024)
+        for name in ('_parent', '_entity_claims', '_ring_claims'):
+            grown = np.zeros(capacity, dtype=np.int64)
+            old = getattr(self, name)
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+def _factorize(values, n_rows):
+    # (codes, uniques) as from pd.factorize, with -1 for missing values
+    if n_rows > SMALL_BATCH_ROWS:
+        return pd.factorize(pd.Series(values))
+    codes, positions, uniques = np.empty(n_rows, dtype=np.int64), {}, []
+    for i, value in enumerate(values):
+        if pd.api.types.is_scalar(value) and pd.isna(value):
+            codes[i] = -1
+            continue
+        code = positions.get(value)
+        if code is None:
+            code = positions[value] = len(uniques)
+            uniques.append(value)
+        codes[i] = code
+    return codes, pd.Index(uniques, dtype=object)
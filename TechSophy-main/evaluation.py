@@ -0,0 +1,218 @@
+import numpy as np
+from joblib import Parallel, delayed
+from feature_extraction import FeaturePipeline
+from anomaly_detection import AnomalyDetection
+from fraud_detection import FraudDetectionModel
+from decision_policy import DecisionPolicy, budget_count
+from instrumentation import stage
+
+DEFAULT_FOLDS = 5
+# Fraud probability thresholds the precision/recall sweep is computed at
+SWEEP_THRESHOLDS = tuple(round(t, 2) for t in np.arange(0.05, 1.0, 0.05))
+# Anomaly weights calibrate_policy chooses from; the fraud weight is one minus it
+ANOMALY_WEIGHTS = (0.0, 0.1, 0.25, 0.5)
+
+def out_of_fold_predictions(data, target_col='fraud_reported', n_splits=DEFAULT_FOLDS, n_jobs=None,
+                            n_estimators=100, random_state=42):
+    """
+    Cross-validate the whole training procedure: for each of n_splits
+    stratified folds, fit a fresh feature pipeline, anomaly detector and
+    fraud model on the other folds and score the fold with them. Every
+    labeled claim is then scored by models that never saw it.
+    Args:
+        data (pd.DataFrame): Raw claims data including the target column.
+            Claims without a label are left out.
+        target_col (str): Name of the 'Y'/'N' fraud label column.
+        n_splits (int): Number of folds. Lowered to the number of claims
+            in the smaller class when there are fewer; see usable_folds.
+        n_jobs (int): Folds fitted at the same time; -1 uses all cores.
+            Defaults to one. The predictions do not depend on it.
+        n_estimators (int): Trees in each forest.
+        random_state (int): Seed of the fold assignment and the models.
+    Returns:
+        dict: Arrays aligned with the labeled claims: 'labels' (0/1),
+            'fraud_proba', 'anomaly_scores', 'anomaly_flags' and 'folds'.
+    """
+    from sklearn.model_selection import StratifiedKFold
+    if target_col not in data.columns:
+        raise ValueError(f"The dataset must contain a '{target_col}' column as the target.")
+    y = data[target_col].map({'Y': 1, 'N': 0}).to_numpy(dtype=float, na_value=np.nan)
+    labeled = np.flatnonzero(~np.isnan(y))
+    data = data.iloc[labeled]
+    labels = y[labeled].astype(int)
+    n_splits = usable_folds(labels, n_splits)
+    if n_splits < 2:
+        raise ValueError("Cross-validation needs at least 2 fraudulent and 2 legitimate claims.")
+
+    splits = list(StratifiedKFold(n_splits, shuffle=True, random_state=random_state).split(labels, labels))
+    with stage('cross_validate', data):
+        fold_results = Parallel(n_jobs=n_jobs or 1)(
+            delayed(_score_fold)(data, target_col, train_rows, test_rows, n_estimators, random_state)
+            for train_rows, test_rows in splits)
+
+    predictions = {
+        'labels': labels,
+        'fraud_proba': np.zeros(len(labels)),
+        'anomaly_scores': np.zeros(len(labels)),
+        'anomaly_flags': np.zeros(len(labels), dtype=int),
+        'folds': np.zeros(len(labels), dtype=int),
+    }
+    for fold, ((_, test_rows), (fraud_proba, anomaly_scores, anomaly_flags)) in enumerate(zip(splits, fold_results)):
+        predictions['fraud_proba'][test_rows] = fraud_proba
+        predictions['anomaly_scores'][test_rows] = anomaly_scores
+        predictions['anomaly_flags'][test_rows] = anomaly_flags
+        predictions['folds'][test_rows] = fold
+    return predictions
+
+def usable_folds(labels, n_splits=DEFAULT_FOLDS):
+    """
+    Stratified folds possible on 0/1 labels: n_splits, or fewer when the
+    smaller class cannot put a claim in every fold. Below 2 the labels
+    cannot be cross-validated.
+    """
+    return min(n_splits, int(np.bincount(np.asarray(labels, dtype=int), minlength=2).min()))
+
+def _score_fold(data, target_col, train_rows, test_rows, n_estimators, random_state):
+    # Runs in a joblib worker; the nested forests use one core each
+    train = data.iloc[train_rows]
+    pipeline = FeaturePipeline(target_col=target_col)
+    X_train = pipeline.fit_transform(train)
+    anomaly_detector = AnomalyDetection(n_estimators=n_estimators, n_jobs=1, random_state=random_state)
+    anomaly_detector.fit(X_train)
+    fraud_model = FraudDetectionModel(n_estimators=n_estimators, n_jobs=1, random_state=random_state)
+    fraud_model.fit(X_train, train[target_col].map({'Y': 1, 'N': 0}).astype(int))
+
+    X_test = pipeline.transform(data.iloc[test_rows])
+    anomaly_preds, anomaly_scores = anomaly_detector.score(X_test)
+    _, fraud_proba = fraud_model.predict(X_test)
+    return fraud_proba, anomaly_scores, (anomaly_preds == -1).astype(int)
+
+def evaluation_metrics(predictions, thresholds=SWEEP_THRESHOLDS):
+    """
+    Summarize out-of-fold predictions into the metrics stored with an artifact.
+    Args:
+        predictions (dict): Output of out_of_fold_predictions.
+        thresholds (tuple): Fraud probability thresholds for the sweep.
+    Returns:
+        dict: JSON-serializable metrics: 'report' (classification report of
+            the classifier's own decisions), 'pr_auc', 'combined' (precision
+            and recall of flagging what either model's predict flags, the
+            policy of artifacts without a calibrated one),
+            'threshold_sweep' and 'per_fold' figures.
+    """
+    from sklearn.metrics import classification_report, average_precision_score
+    labels = predictions['labels']
+    fraud_proba = predictions['fraud_proba']
+    folds = predictions['folds']
+    # The forest predicts the class with the higher probability; ties go to legitimate
+    fraud_preds = (fraud_proba > 0.5).astype(int)
+    combined = (fraud_preds == 1) | (predictions['anomaly_flags'] == 1)
+
+    per_fold = []
+    for fold in range(int(folds.max()) + 1):
+        in_fold = folds == fold
+        per_fold.append({
+            'rows': int(in_fold.sum()),
+            'pr_auc': float(average_precision_score(labels[in_fold], fraud_proba[in_fold])),
+            **precision_recall(labels[in_fold], fraud_preds[in_fold] == 1),
+        })
+    return {
+        'method': f"{len(per_fold)}-fold cross-validation",
+        'rows': int(len(labels)),
+        'fraud_rate': float(labels.mean()),
+        'report': classification_report(labels, fraud_preds, labels=[0, 1], output_dict=True, zero_division=0),
+        'pr_auc': float(average_precision_score(labels, fraud_proba)),
+        'pr_auc_std': float(np.std([fold['pr_auc'] for fold in per_fold])),
+        'combined': precision_recall(labels, combined),
+        'threshold_sweep': threshold_sweep(labels, fraud_proba, thresholds),
+        'per_fold': per_fold,
+    }
+
+def cross_validate(data, target_col='fraud_reported', n_splits=DEFAULT_FOLDS, n_jobs=None, n_estimators=100,
+                   random_state=42):
+    """
+    evaluation_metrics of out_of_fold_predictions; see both.
+    """
+    return evaluation_metrics(out_of_fold_predictions(data, target_col, n_splits, n_jobs, n_estimators, random_state))
+
+def precision_recall(labels, flagged):
+    """
+    Precision, recall and F1 of boolean fraud flags against 0/1 labels.
+    """
+    true_positives = int(np.count_nonzero(flagged & (labels == 1)))
+    n_flagged = int(np.count_nonzero(flagged))
+    n_fraud = int(np.count_nonzero(labels == 1))
+    precision = true_positives / n_flagged if n_flagged else 0.0
+    recall = true_positives / n_fraud if n_fraud else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1, 'flagged_share': n_flagged / max(len(labels), 1)}
+
+def threshold_sweep(labels, fraud_proba, thresholds=SWEEP_THRESHOLDS):
+    """
+    precision_recall of flagging claims with fraud_proba >= threshold, for
+    each threshold.
+    Returns:
+        list: One dict per threshold, with a 'threshold' key.
+    """
+    return [{'threshold': float(threshold), **precision_recall(labels, fraud_proba >= threshold)}
+            for threshold in thresholds]
+
+def calibrate_policy(predictions, budget=None, target_precision=None, anomaly_weights=ANOMALY_WEIGHTS):
+    """
+    Choose a DecisionPolicy's weights and risk threshold from out-of-fold
+    predictions, so the flag volume is set by measured precision and recall
+    rather than by the models' fixed 0.5 and contamination cut-offs.
+    For each candidate anomaly weight the risk threshold is chosen by:
+        - budget: the risk of the last claim within the budget, so batches
+          too small for the budget flag about the same share;
+        - target_precision: the lowest threshold whose precision reaches
+          the target, flagging as many frauds as that allows;
+        - neither: the threshold with the best F1.
+    The weight scoring best on the same criterion (precision at the budget,
+    recall at the target, or F1) is kept.
+    Args:
+        predictions (dict): Output of out_of_fold_predictions.
+        budget (float): Share of each batch to flag, between 0 and 1.
+        target_precision (float): Precision the threshold must reach.
+            When no threshold reaches it, the best F1 is used instead.
+        anomaly_weights (tuple): Anomaly weights to choose from.
+    Returns:
+        DecisionPolicy: The calibrated policy. Its calibration dict holds
+            the precision_recall it reached on the predictions.
+    """
+    labels = predictions['labels']
+    n_fraud = max(int(np.count_nonzero(labels == 1)), 1)
+    metric = 'precision' if budget is not None else 'recall' if target_precision is not None else 'f1'
+    best, best_key = None, None
+    for anomaly_weight in anomaly_weights:
+        policy = DecisionPolicy(1.0 - anomaly_weight, anomaly_weight, budget=budget)
+        risk = policy.risk(predictions['fraud_proba'], predictions['anomaly_scores'])
+        thresholds, n_flagged, true_positives = _cutoffs(labels, risk)
+        if budget is not None:
+            # The last cut-off flagging no more than the budget
+            cutoff = max(int(np.searchsorted(n_flagged, budget_count(len(labels), budget), side='right')) - 1, 0)
+        elif target_precision is not None and (true_positives >= target_precision * n_flagged).any():
+            cutoff = int(np.flatnonzero(true_positives >= target_precision * n_flagged)[-1])
+        else:
+            cutoff = int(np.argmax(2 * true_positives / (n_flagged + n_fraud)))
+        policy.threshold = float(thresholds[cutoff])
+        flagged = policy.flag(predictions['fraud_proba'], predictions['anomaly_scores']) == 1
+        policy.calibration = {'rows': int(len(labels)), **precision_recall(labels, flagged)}
+        met = metric != 'recall' or policy.calibration['precision'] >= target_precision
+        key = (met, policy.calibration[metric] if met else policy.calibration['f1'])
+        if best_key is None or key > best_key:
+            best, best_key = policy, key
+    return best
+
+def _cutoffs(labels, risk):
+    # Every distinct risk as a threshold, highest first, with the number of
+    # claims and of frauds at or above it; thresholds sit halfway to the
+    # next lower risk so they do not hinge on one claim's exact value
+    order = np.argsort(-risk, kind='stable')
+    sorted_risk = risk[order]
+    true_positives = np.cumsum(labels[order] == 1)
+    last = np.append(sorted_risk[1:] != sorted_risk[:-1], True)
+    ends = np.flatnonzero(last)
+    values = sorted_risk[ends]
+    thresholds = np.append((values[:-1] + values[1:]) / 2, values[-1:])
+    return thresholds, ends + 1, true_positives[ends]
@@ -1,4 +1,9 @@
+import numpy as np
 import pandas as pd
+from data_processing import ClaimsPreprocessor
+from claimant_store import ClaimantAggregateStore, to_claim_days, record_claim_day, text_claimant_ids, claim_counts
+from entity_graph import EntityGraph, DEFAULT_LINK_COLUMNS, GRAPH_FEATURES
+from instrumentation import stage
 
 def extract_features(df):
     """
@@ -14,8 +19,7 @@ def extract_features(df):
     if 'claim_amount' in df.columns and 'policy_amount' in df.columns:
         df['claim_policy_ratio'] = df['claim_amount'] / (df['policy_amount'] + 1e-5)
     
-    # Placeholder for network analysis features
-    # For example, count of claims per claimant or linked entities
+    # Network features across batches (fraud rings) come from FeaturePipeline's EntityGraph
     if 'claimant_id' in df.columns:
         claim_counts = df.groupby('claimant_id').size()
         df['claimant_claim_count'] = df['claimant_id'].map(claim_counts)
@@ -24,3 +28,302 @@ def extract_features(df):
     df.fillna(0, inplace=True)
     
     return df
+
+def derived_feature_names(feature_names, claimant_history=False, claim_dates=False, entity_graph=False,
+                          text_claimant_ids=False):
+    """
+    Names of the features add_derived_features appends for a given layout.
+    text_claimant_ids means claimant IDs are given as a column rather than
+    encoded in feature_names.
+    """
+    names = []
+    if 'claim_amount' in feature_names and 'policy_amount' in feature_names:
+        names.append('claim_policy_ratio')
+    if 'claimant_id' in feature_names or text_claimant_ids:
+        names.append('claimant_claim_count')
+        if claimant_history:
+            names.append('claimant_total_amount')
+            if claim_dates:
+                names.append('claimant_days_since_last_claim')
+    if entity_graph:
+        names.extend(GRAPH_FEATURES)
+    return names
+
+def add_derived_features(X, feature_names, claimant_store=None, claim_days=None, out=None, columns=None,
+                         graph_features=None):
+    """
+    Array counterpart of extract_features for an encoded feature matrix.
+    Args:
+        X (np.ndarray): Encoded claims, one column per entry of feature_names.
+        feature_names (list): Column names of X.
+        claimant_store (ClaimantAggregateStore): Optional claimant history.
+            When given, claimant features combine the stored history with
+            the batch instead of counting within the batch only.
+        claim_days (np.ndarray): Optional claim dates as days since epoch,
+            used for the days-since-last-claim history feature.
+        out (np.ndarray): Optional matrix whose leading columns are X. The
+            derived features are written into its remaining columns instead
+            of being stacked onto a copy of X.
+        columns (dict): Optional float64 values of the claim_amount,
+            policy_amount and claimant_id columns, used instead of the
+            columns of X when X is stored in a narrower dtype. Claimant
+            IDs are best passed here with missing IDs left missing, NaN
+            or '' for text IDs, which are not encoded in X: X holds them
+            filled, as a real claimant's ID. Claims without one get no
+            claimant history.
+        graph_features (dict): Optional EntityGraph.features of the batch,
+            appended as the ring_size and entity_degree features.
+    Returns:
+        np.ndarray: X with the derived_feature_names(...) columns appended,
+            or out when given.
+    """
+    def column(name):
+        if columns is not None and name in columns:
+            return columns[name]
+        return X[:, feature_names.index(name)]
+
+    derived = []
+
+    def emit(values):
+        # Written into out straight away, so its temporary can be freed
+        if out is not None:
+            out[:, len(feature_names) + len(derived)] = values
+            values = None
+        derived.append(values)
+
+    if 'claim_amount' in feature_names and 'policy_amount' in feature_names:
+        emit(column('claim_amount') / (column('policy_amount') + 1e-5))
+    if 'claimant_id' in feature_names or (columns is not None and 'claimant_id' in columns):
+        claimant_ids = column('claimant_id')
+        if claimant_store is None:
+            emit(claim_counts(claimant_ids))
+        else:
+            amounts = column('claim_amount') if 'claim_amount' in feature_names else None
+            history = claimant_store.history_features(claimant_ids, amounts, claim_days)
+            for name in ('claimant_claim_count', 'claimant_total_amount', 'claimant_days_since_last_claim'):
+                if name in history:
+                    emit(history.pop(name))
+    if graph_features is not None:
+        for name in GRAPH_FEATURES:
+            emit(graph_features.pop(name))
+    if out is not None:
+        return out
+    if not derived:
+        return X
+    return np.column_stack([X] + derived)
+
+class FeaturePipeline:
+    """
+    Preprocessing and feature extraction fitted once on training data so that
+    new batches are encoded into the same column layout. With claimant_history
+    enabled, claimant features come from a ClaimantAggregateStore that holds
+    every claim the pipeline has been fitted on or told to remember. With
+    link_graph enabled, an EntityGraph over the same claims links them
+    through shared claimants, policies and link_columns into rings.
+    Text claimant IDs are not encoded as a category; they only key the
+    claimant features.
+    """
+    # Pipelines saved before the entity graph existed unpickle without one
+    entity_graph = None
+    link_columns = ()
+    # Pipelines saved before text claimant IDs were kept out of the encoding
+    text_claimant_ids_ = False
+
+    def __init__(self, target_col='fraud_reported', claimant_history=True, date_col='claim_date',
+                 encoding='auto', high_cardinality='frequency', link_graph=True, link_columns=()):
+        """
+        Args:
+            link_graph (bool): Add ring_size and entity_degree features from
+                an EntityGraph, when the training claims have a link column.
+            link_columns (list): Identifier columns linking claims, such as
+                phone numbers or bank accounts, besides DEFAULT_LINK_COLUMNS.
+        """
+        self.target_col = target_col
+        self.claimant_history = claimant_history
+        self.date_col = date_col
+        self.preprocessor = ClaimsPreprocessor(exclude=[target_col], encoding=encoding,
+                                               high_cardinality=high_cardinality)
+        self.link_graph = link_graph
+        self.link_columns = list(link_columns)
+        self.claimant_store = None
+        self.entity_graph = None
+        self.uses_dates_ = False
+        self.text_claimant_ids_ = False
+        self.feature_names_ = None
+
+    def fit(self, df):
+        """
+        Learn fill values, category encoders and the output column layout.
+        The claimant history starts out empty; fit_transform fills it with
+        the training claims.
+        Args:
+            df (pd.DataFrame): Raw training claims data.
+        Returns:
+            FeaturePipeline: The fitted pipeline.
+        """
+        self._exclude_text_ids(df)
+        self.preprocessor.fit(df, self._labels(df))
+        self._fit_layout(df)
+        return self
+
+    def _exclude_text_ids(self, df):
+        # One-hot or frequency encoding an ID would drop the claimant features
+        self.text_claimant_ids_ = 'claimant_id' in df.columns and not pd.api.types.is_numeric_dtype(df['claimant_id'])
+        exclude = [col for col in self.preprocessor.exclude if col != 'claimant_id']
+        self.preprocessor.exclude = exclude + ['claimant_id'] if self.text_claimant_ids_ else exclude
+
+    def _labels(self, df):
+        if self.target_col not in df.columns:
+            return None
+        return df[self.target_col].map({'Y': 1, 'N': 0}).to_numpy(dtype=float, na_value=np.nan)
+
+    def _fit_layout(self, df):
+        self.claimant_store = ClaimantAggregateStore() if self.claimant_history else None
+        self.uses_dates_ = self.claimant_history and self.date_col in df.columns
+        self.entity_graph = None
+        if getattr(self, 'link_graph', False):
+            candidates = list(DEFAULT_LINK_COLUMNS) + [col for col in self.link_columns if col not in DEFAULT_LINK_COLUMNS]
+            present = [col for col in candidates if col in df.columns and col != self.target_col]
+            if present:
+                self.entity_graph = EntityGraph(present)
+        base_names = self.preprocessor.feature_names_
+        self.feature_names_ = base_names + derived_feature_names(base_names, self.claimant_history, self.uses_dates_,
+                                                                 self.entity_graph is not None, self.text_claimant_ids_)
+
+    def input_columns(self):
+        """
+        Raw columns transform reads, plus the target column, so loaders can
+        skip every other column of a file.
+        """
+        if self.feature_names_ is None:
+            raise ValueError("FeaturePipeline must be fitted before input_columns.")
+        p = self.preprocessor
+        columns = p.numeric_columns_ + p.date_columns_ + p.categorical_columns_ + [self.target_col]
+        if self.uses_dates_ and self.date_col not in columns:
+            columns.append(self.date_col)
+        if self.text_claimant_ids_ and 'claimant_id' not in columns:
+            columns.append('claimant_id')
+        if self.entity_graph is not None:
+            columns += [col for col in self.entity_graph.link_columns if col not in columns]
+        return columns
+
+    def transform(self, df, update_history=False, dtype=np.float64):
+        """
+        Encode a batch of claims into the fitted column layout.
+        Args:
+            df (pd.DataFrame): Raw claims data, with or without the target column.
+            update_history (bool): Add the batch to the claimant history
+                after computing its features.
+            dtype (np.dtype): Dtype of the feature matrix. np.float32 halves
+                its size and gives the models the same inputs, since both
+                forests compare features as float32.
+        Returns:
+            np.ndarray: Feature matrix with one column per entry of feature_names_.
+        """
+        if self.feature_names_ is None:
+            raise ValueError("FeaturePipeline must be fitted before transform.")
+        # Graph features first, so their temporaries are freed before X is allocated
+        links, graph_features = self._graph_features(df)
+        with stage('preprocess') as record:
+            X = self.preprocessor.transform(df, dtype, self._n_derived())
+            record.set_shape(X)
+        return self._add_features(df, X, update_history, links, graph_features)
+
+    def _n_derived(self):
+        return len(self.feature_names_) - len(self.preprocessor.feature_names_)
+
+    def _add_features(self, df, X, update_history, links, graph_features):
+        # X already has the derived columns, still zero, after the encoded ones
+        base_names = self.preprocessor.feature_names_
+        with stage('extract_features') as record:
+            claim_days = None
+            if self.uses_dates_:
+                claim_days = to_claim_days(df[self.date_col]) if self.date_col in df.columns else np.full(len(df), np.nan)
+            columns = self._exact_columns(df, X)
+            features = add_derived_features(X[:, :len(base_names)], base_names, self.claimant_store, claim_days,
+                                            out=X, columns=columns, graph_features=graph_features)
+            record.set_shape(features)
+        if update_history and self.claimant_store is not None and 'claimant_id' in columns:
+            self.claimant_store.update(columns['claimant_id'], columns.get('claim_amount'), claim_days)
+        if update_history and self.entity_graph is not None:
+            self.entity_graph.update(links, len(df))
+        return features
+
+    def _graph_features(self, df):
+        # Raw link column values, numeric IDs as floats with missing values
+        # kept missing, and the graph features they give the batch
+        if self.entity_graph is None:
+            return None, None
+        numeric = self.preprocessor.numeric_columns_
+        links = {col: pd.to_numeric(df[col], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+                 if col in numeric else df[col]
+                 for col in self.entity_graph.link_columns if col in df.columns}
+        with stage('entity_graph', df):
+            return links, self.entity_graph.features(links, len(df))
+
+    def _exact_columns(self, df, X):
+        # Amounts as float64, read back from df when X is narrower, and
+        # claimant IDs unfilled, so claims without one share no history
+        base_names = self.preprocessor.feature_names_
+        names = [name for name in ('claim_amount', 'policy_amount') if name in base_names]
+        if X.dtype == np.float64:
+            columns = {name: X[:, base_names.index(name)] for name in names}
+        else:
+            columns = {name: self.preprocessor.numeric_values(df, name) for name in names}
+        if 'claimant_id' in base_names:
+            columns['claimant_id'] = (pd.to_numeric(df['claimant_id'], errors='coerce').to_numpy(
+                dtype='float64', na_value=np.nan) if 'claimant_id' in df.columns else np.full(len(df), np.nan))
+        if self.text_claimant_ids_:
+            ids = df['claimant_id'] if 'claimant_id' in df.columns else np.full(len(df), None)
+            columns['claimant_id'] = text_claimant_ids(ids)
+        return columns
+
+    def transform_records(self, records):
+        """
+        Encode claims given as dicts into the fitted column layout without a
+        pandas round trip. The claimant history is read but not updated.
+        Args:
+            records (list): Claims as dicts of column name to value.
+        Returns:
+            np.ndarray: Feature matrix with one column per entry of feature_names_.
+        """
+        if self.feature_names_ is None:
+            raise ValueError("FeaturePipeline must be fitted before transform.")
+        X = self.preprocessor.transform_records(records)
+        claim_days = None
+        if self.uses_dates_:
+            claim_days = np.array([record_claim_day(record.get(self.date_col)) for record in records], dtype=float)
+        graph_features = None
+        if self.entity_graph is not None:
+            numeric = self.preprocessor.numeric_columns_
+            links = {col: [_numeric_link(record.get(col)) if col in numeric else record.get(col) for record in records]
+                     for col in self.entity_graph.link_columns}
+            graph_features = self.entity_graph.features(links, len(records))
+        columns = None
+        if 'claimant_id' in self.preprocessor.feature_names_:
+            columns = {'claimant_id': np.array([_numeric_link(record.get('claimant_id')) for record in records])}
+        elif self.text_claimant_ids_:
+            columns = {'claimant_id': text_claimant_ids([record.get('claimant_id') for record in records])}
+        return add_derived_features(X, self.preprocessor.feature_names_, self.claimant_store, claim_days,
+                                    columns=columns, graph_features=graph_features)
+
+    def fit_transform(self, df, dtype=np.float64):
+        labels = self._labels(df)
+        with stage('preprocess') as record:
+            self._exclude_text_ids(df)
+            self.preprocessor.fit(df, labels)
+            self._fit_layout(df)
+        links, graph_features = self._graph_features(df)
+        with stage('preprocess') as record:
+            X = self.preprocessor.transform(df, dtype, self._n_derived())
+            # Out-of-fold target encoding, as in the preprocessor's own fit_transform
+            self.preprocessor.encode_out_of_fold(X, df, labels)
+            record.set_shape(X)
+        return self._add_features(df, X, True, links, graph_features)
+
+def _numeric_link(value):
+    # A record's numeric ID as the float transform reads it, NaN when unparseable
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
@@ -0,0 +1,227 @@
+import warnings
+import numpy as np
+from instrumentation import stage
+
+# (tree, row) pairs traversed at once; bounds the engine's scratch memory
+BLOCK_PAIRS = 1 << 20
+# scikit-learn releases, as (major, minor), whose private IsolationForest
+# attributes the isolation forest is flattened from; keep in step with
+# requirements.txt. Other releases score anomalies through sklearn.
+SKLEARN_SUPPORTED = ((1, 3), (1, 9))
+
+class FlatForest:
+    """
+    The fitted trees of a forest concatenated into contiguous node arrays,
+    with child indices pointing into the concatenated arrays. Traversal
+    follows sklearn exactly: features are cast to float32 and compared with
+    the float64 thresholds, and missing values follow missing_go_to_left.
+    """
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots):
+        self.is_leaf = left < 0
+        # Leaves point to themselves so a finished pair can be traversed no further
+        nodes = np.arange(len(feature), dtype=left.dtype)
+        self.feature = np.where(self.is_leaf, 0, feature)
+        self.threshold = threshold
+        self.left = np.where(self.is_leaf, nodes, left)
+        self.right = np.where(self.is_leaf, nodes, right)
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+
+    @classmethod
+    def from_trees(cls, trees, node_values, tree_features=None):
+        """
+        Args:
+            trees (list): sklearn Tree objects (estimator.tree_).
+            node_values (list): Per tree, an array with one value or row of
+                values per node, read at the leaves.
+            tree_features (list): Per tree, the input columns it was fitted
+                on, when trees saw a subset of the features.
+        """
+        feature, threshold, left, right, missing_left, value, roots = [], [], [], [], [], [], []
+        offset = 0
+        for i, tree in enumerate(trees):
+            tree_feature = tree.feature.astype(np.int64)
+            if tree_features is not None:
+                columns = np.asarray(tree_features[i], dtype=np.int64)
+                tree_feature = np.where(tree_feature >= 0, columns[np.maximum(tree_feature, 0)], tree_feature)
+            children_left = tree.children_left.astype(np.int64)
+            children_right = tree.children_right.astype(np.int64)
+            roots.append(offset)
+            feature.append(tree_feature)
+            threshold.append(tree.threshold)
+            left.append(np.where(children_left >= 0, children_left + offset, -1))
+            right.append(np.where(children_right >= 0, children_right + offset, -1))
+            missing_left.append(tree.missing_go_to_left.astype(bool))
+            value.append(node_values[i])
+            offset += tree.node_count
+        return cls(np.concatenate(feature), np.concatenate(threshold).astype(np.float64),
+                   np.concatenate(left), np.concatenate(right), np.concatenate(missing_left),
+                   np.concatenate(value), np.array(roots, dtype=np.int64))
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def apply(self, X):
+        """
+        Leaf reached in every tree by every row, all trees at once.
+        Args:
+            X (np.ndarray): float32 features, C-contiguous.
+        Returns:
+            np.ndarray: Node indices of shape (n_trees, n_rows).
+        """
+        n_rows, n_cols = X.shape
+        flat_X = X.ravel()
+        nodes = np.repeat(self.roots, n_rows)
+        row_offsets = np.tile(np.arange(n_rows, dtype=np.int64) * n_cols, self.n_trees)
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        check_missing = self.missing_left.any() and np.isnan(flat_X).any()
+        while active.size:
+            current = nodes[active]
+            x = flat_X[row_offsets[active] + self.feature[current]]
+            go_left = x <= self.threshold[current]
+            if check_missing:
+                missing = np.isnan(x)
+                go_left[missing] = self.missing_left[current[missing]]
+            current = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = current
+            active = active[~self.is_leaf[current]]
+        return nodes.reshape(self.n_trees, n_rows)
+
+    def sum_leaf_values(self, X):
+        """
+        Sum of the leaf values over all trees, added tree by tree in tree
+        order as sklearn does.
+        """
+        total = np.zeros((len(X),) + self.value.shape[1:])
+        block_rows = max(1, BLOCK_PAIRS // max(self.n_trees, 1))
+        for start in range(0, len(X), block_rows):
+            leaves = self.apply(X[start:start + block_rows])
+            block = total[start:start + block_rows]
+            for tree_leaves in leaves:
+                block += self.value[tree_leaves]
+        return total
+
+class ForestEngine:
+    """
+    Flat-array inference for a fitted RandomForestClassifier and
+    IsolationForest, giving the same predictions, probabilities and anomaly
+    scores as the sklearn models without their per-call validation overhead.
+    Holds only NumPy arrays, so it loads quickly and needs no sklearn.
+
+    Flattening the isolation forest reads private IsolationForest
+    attributes. With a scikit-learn release outside SKLEARN_SUPPORTED, or
+    one without those attributes, the engine keeps the IsolationForest
+    instead and scores anomalies with its score_samples.
+    """
+    # Engines saved before the fallback existed always flattened both forests
+    isolation_forest = None
+    sklearn_version = None
+
+    def __init__(self, classifier, classes, isolation, anomaly_offset, path_length_norm, isolation_forest=None,
+                 sklearn_version=None):
+        self.classifier = classifier
+        self.classes = classes
+        self.isolation = isolation
+        self.anomaly_offset = anomaly_offset
+        self.path_length_norm = path_length_norm
+        self.isolation_forest = isolation_forest
+        self.sklearn_version = sklearn_version
+
+    @classmethod
+    def from_models(cls, anomaly_detector, fraud_model):
+        """
+        Flatten the fitted forests of an AnomalyDetection and a
+        FraudDetectionModel.
+        """
+        import sklearn
+        forest = fraud_model.model
+        n_classes = len(forest.classes_)
+        classifier = FlatForest.from_trees(
+            [tree.tree_ for tree in forest.estimators_],
+            [tree.tree_.value[:, 0, :n_classes] for tree in forest.estimators_])
+
+        iforest = anomaly_detector.model
+        isolation, path_length_norm, isolation_forest = None, 0.0, None
+        try:
+            isolation, path_length_norm = _flatten_isolation(iforest, sklearn.__version__)
+        except (ImportError, AttributeError, ValueError) as e:
+            warnings.warn(f"Anomalies are scored with IsolationForest.score_samples, not the flat engine: {e}")
+            isolation_forest = iforest
+        return cls(classifier, np.asarray(forest.classes_), isolation, float(iforest.offset_), path_length_norm,
+                   isolation_forest, sklearn.__version__)
+
+    def predict_fraud(self, X):
+        """
+        Same as FraudDetectionModel.predict.
+        Returns:
+            tuple: (predictions, confidence_scores)
+        """
+        with stage('fraud_predict', X):
+            proba = self.classifier.sum_leaf_values(_as_float32(X))
+            proba /= self.classifier.n_trees
+            preds = np.asarray(self.classes).take(np.argmax(proba, axis=1))
+            confidence = _fraud_probability(proba, self.classes)
+        return preds, confidence
+
+    def score_anomaly(self, X):
+        """
+        Same as AnomalyDetection.score.
+        Returns:
+            tuple: (labels, scores)
+        """
+        with stage('anomaly_predict', X):
+            if self.isolation is None:
+                scores = self.isolation_forest.score_samples(_as_float32(X))
+                return np.where(scores - self.anomaly_offset < 0, -1, 1), scores
+            depths = self.isolation.sum_leaf_values(_as_float32(X))
+            # A forest fitted on one sample has a zero norm; sklearn then takes the ratio as 1
+            if self.path_length_norm != 0:
+                scores = -(2 ** -(depths / self.path_length_norm))
+            else:
+                scores = -np.full(len(depths), 0.5)
+            labels = np.where(scores - self.anomaly_offset < 0, -1, 1)
+        return labels, scores
+
+    def score(self, X):
+        """
+        Returns:
+            tuple: (fraud_predictions, fraud_confidence, anomaly_flags, anomaly_scores)
+        """
+        X = _as_float32(X)
+        anomaly_preds, anomaly_scores = self.score_anomaly(X)
+        fraud_preds, fraud_confidence = self.predict_fraud(X)
+        return fraud_preds, fraud_confidence, (anomaly_preds == -1).astype(int), anomaly_scores
+
+def _flatten_isolation(iforest, version):
+    # (FlatForest, path length norm) of a fitted IsolationForest, from its private attributes
+    release = tuple(int(part) for part in version.split('.')[:2])
+    if not SKLEARN_SUPPORTED[0] <= release <= SKLEARN_SUPPORTED[1]:
+        raise ValueError(f"scikit-learn {version} is outside the supported releases")
+    from sklearn.ensemble._iforest import _average_path_length
+    # Same per-leaf expression as IsolationForest._compute_score_samples
+    path_lengths = [
+        depths + average_lengths - 1.0
+        for depths, average_lengths in zip(iforest._decision_path_lengths, iforest._average_path_length_per_tree)
+    ]
+    subsampled = iforest._max_features != iforest.n_features_in_
+    isolation = FlatForest.from_trees(
+        [tree.tree_ for tree in iforest.estimators_], path_lengths,
+        iforest.estimators_features_ if subsampled else None)
+    return isolation, len(iforest.estimators_) * float(_average_path_length([iforest._max_samples])[0])
+
+def installed_sklearn_version():
+    """
+    Version of the installed scikit-learn, importing it.
+    """
+    import sklearn
+    return sklearn.__version__
+
+def _as_float32(X):
+    return np.ascontiguousarray(X, dtype=np.float32)
+
+def _fraud_probability(proba, classes):
+    # Probability of class 1; a forest that never saw a fraud gives zero
+    fraud = np.flatnonzero(np.asarray(classes) == 1)
+    return proba[:, fraud[0]] if len(fraud) else np.zeros(len(proba))
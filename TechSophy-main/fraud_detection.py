@@ -1,24 +1,82 @@
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report
+from instrumentation import stage
 
 class FraudDetectionModel:
-    def __init__(self):
-        self.model = RandomForestClassifier(random_state=42)
+    # Trees added by update() so far; seeds each update's new trees differently
+    trees_added_ = 0
+
+    def __init__(self, n_estimators=100, n_jobs=None, random_state=42):
+        """
+        Args:
+            n_estimators (int): Number of trees in the forest.
+            n_jobs (int): Cores used for fitting and prediction; -1 uses all
+                cores. Results do not depend on it.
+            random_state (int): Random seed.
+        """
+        from sklearn.ensemble import RandomForestClassifier
+        self.model = RandomForestClassifier(n_estimators=n_estimators, n_jobs=n_jobs, random_state=random_state)
 
     def train(self, X, y):
         """
-        Train the fraud detection model.
+        Train the fraud detection model on 80% of the claims and evaluate it
+        on the other 20%.
         Args:
             X (pd.DataFrame): Features.
             y (pd.Series): Target labels (fraud or not).
+        Returns:
+            dict: Classification report on the held-out claims.
         """
+        from sklearn.model_selection import train_test_split
+        from sklearn.metrics import classification_report
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        self.model.fit(X_train, y_train)
-        y_pred = self.model.predict(X_test)
-        print("Model Evaluation:")
-        print(classification_report(y_test, y_pred))
+        self.fit(X_train, y_train)
+        return classification_report(y_test, self.predict(X_test)[0], labels=[0, 1], output_dict=True, zero_division=0)
+
+    def fit(self, X, y):
+        """
+        Train on every given claim, without holding any out.
+        Returns:
+            FraudDetectionModel: The fitted model.
+        """
+        with stage('fraud_train', X):
+            self.model.fit(X, y)
+        return self
+
+    def update(self, X, y, n_new_trees=10, max_estimators=None):
+        """
+        Incrementally refresh the forest with a batch of newly labeled claims:
+        n_new_trees trees are fitted on the batch alone and added to the
+        forest, then the oldest trees are retired while more than
+        max_estimators remain. Costs time proportional to the batch.
+        Args:
+            X (np.ndarray): Features of the new claims.
+            y (array-like): Their 0/1 fraud labels; both classes must occur.
+            n_new_trees (int): Trees to fit on the batch.
+            max_estimators (int): Optional cap on the forest size.
+        Returns:
+            dict: Classification report of the forest before the update on
+                the new batch, which it has not seen.
+        """
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.metrics import classification_report
+        y = np.asarray(y)
+        if len(np.unique(y)) != len(self.model.classes_):
+            raise ValueError("The update batch must contain both fraudulent and legitimate claims.")
+        report = classification_report(y, self.predict(X)[0], labels=self.model.classes_, output_dict=True, zero_division=0)
+
+        params = self.model.get_params()
+        params.update(n_estimators=n_new_trees, warm_start=False,
+                      random_state=(params['random_state'] or 0) + 1 + self.trees_added_)
+        with stage('fraud_update', X):
+            batch_forest = RandomForestClassifier(**params).fit(X, y)
+        self.trees_added_ += n_new_trees
+
+        estimators = self.model.estimators_ + batch_forest.estimators_
+        if max_estimators is not None and len(estimators) > max_estimators:
+            estimators = estimators[len(estimators) - max_estimators:]
+        self.model.estimators_ = estimators
+        self.model.n_estimators = len(estimators)
+        return report
 
     def predict(self, X):
         """
@@ -28,13 +86,15 @@ class FraudDetectionModel:
         Returns:
             tuple: (predictions, confidence_scores)
         """
-        preds = self.model.predict(X)
-        if hasattr(self.model, "predict_proba"):
-            proba = self.model.predict_proba(X)
-            if proba.shape[1] > 1:
-                confidence = proba[:, 1]
+        with stage('fraud_predict', X):
+            if hasattr(self.model, "predict_proba"):
+                # One pass over the forest: predict is the argmax of predict_proba
+                proba = self.model.predict_proba(X)
+                preds = self.model.classes_.take(np.argmax(proba, axis=1))
+                # Probability of fraud; a model that never saw a fraud gives zero
+                fraud = np.flatnonzero(self.model.classes_ == 1)
+                confidence = proba[:, fraud[0]] if len(fraud) else np.zeros(len(preds))
             else:
-                confidence = proba[:, 0]
-        else:
-            confidence = np.zeros(len(preds))
+                preds = self.model.predict(X)
+                confidence = np.zeros(len(preds))
         return preds, confidence
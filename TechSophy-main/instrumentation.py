@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import logging
+import atexit
+import threading
+import contextvars
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger('fraud_detection.pipeline')
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+_current_run = contextvars.ContextVar('pipeline_run', default=None)
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process so far, or 0 where unavailable.
+    """
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+class StageRecord:
+    """
+    Measurements of one pipeline stage. rows and cols may be filled in inside
+    the stage once the output shape is known. process_peak_rss_bytes is the
+    process's peak RSS since it started, as of the end of the stage;
+    peak_rss_growth_bytes is how far the stage raised it, 0 when the stage
+    stayed below an earlier peak.
+    """
+    __slots__ = ('stage', 'rows', 'cols', 'wall_seconds', 'cpu_seconds', 'process_peak_rss_bytes',
+                 'peak_rss_growth_bytes')
+
+    def __init__(self, stage, rows=None, cols=None):
+        self.stage = stage
+        self.rows = rows
+        self.cols = cols
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.process_peak_rss_bytes = 0
+        self.peak_rss_growth_bytes = 0
+
+    def set_shape(self, data):
+        """
+        Take rows and cols from a DataFrame or array.
+        """
+        shape = getattr(data, 'shape', None)
+        if shape is not None:
+            self.rows = int(shape[0])
+            self.cols = int(shape[1]) if len(shape) > 1 else 1
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class PipelineRun:
+    """
+    Stage records collected during one run of a pipeline entry point.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.wall_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            'pipeline': self.name,
+            'wall_seconds': self.wall_seconds,
+            'stages': [record.as_dict() for record in self.stages],
+        }
+
+class MetricsRegistry:
+    """
+    In-process totals per stage and per pipeline, rendered in the Prometheus
+    text format. When multiprocess_dir is set, every process also writes its
+    totals to <multiprocess_dir>/<pid>.json after each update, and rendering
+    sums the files of all processes, so worker process metrics are visible
+    from the web process. Snapshot files are written at most once per
+    snapshot_interval seconds and again at exit. Files left by processes
+    that no longer run are removed by remove_stale_snapshots.
+    """
+    def __init__(self, multiprocess_dir=None, snapshot_interval=1.0):
+        self.multiprocess_dir = multiprocess_dir
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._last_snapshot = 0.0
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all totals, e.g. in a freshly forked child that must not
+        report its parent's totals as its own.
+        """
+        self._stages = {}
+        self._pipelines = {}
+
+    def record_stage(self, record):
+        with self._lock:
+            totals = self._stages.setdefault(record.stage, _stage_totals())
+            totals['runs'] += 1
+            totals['wall_seconds'] += record.wall_seconds
+            totals['cpu_seconds'] += record.cpu_seconds
+            totals['rows'] += record.rows or 0
+            totals['process_peak_rss_bytes'] = max(totals['process_peak_rss_bytes'], record.process_peak_rss_bytes)
+            totals['peak_rss_growth_bytes'] = max(totals['peak_rss_growth_bytes'], record.peak_rss_growth_bytes)
+
+    def record_run(self, run):
+        with self._lock:
+            totals = self._pipelines.setdefault(run.name, {'runs': 0, 'wall_seconds': 0.0})
+            totals['runs'] += 1
+            totals['wall_seconds'] += run.wall_seconds
+        if time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+            self.write_snapshot()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'stages': {stage: dict(totals) for stage, totals in self._stages.items()},
+                'pipelines': {name: dict(totals) for name, totals in self._pipelines.items()},
+            }
+
+    def write_snapshot(self):
+        if not self.multiprocess_dir or not self._pipelines:
+            return
+        self._last_snapshot = time.monotonic()
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+        path = os.path.join(self.multiprocess_dir, f"{os.getpid()}.json")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def remove_stale_snapshots(self):
+        """
+        Delete the snapshot files of processes that have exited, so a
+        restarted server does not keep adding a previous run's totals.
+        Call at startup, before worker processes are started.
+        """
+        if not self.multiprocess_dir or not os.path.isdir(self.multiprocess_dir):
+            return
+        for name in os.listdir(self.multiprocess_dir):
+            pid = name.split('.', 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and not process_running(int(pid)):
+                try:
+                    os.remove(os.path.join(self.multiprocess_dir, name))
+                except OSError:
+                    continue
+
+    def _combined(self):
+        if not self.multiprocess_dir or not os.path.isdir(self.multiprocess_dir):
+            return [self.snapshot()]
+        snapshots = [self.snapshot()]
+        own_file = f"{os.getpid()}.json"
+        for name in os.listdir(self.multiprocess_dir):
+            if not name.endswith('.json') or name == own_file:
+                continue
+            try:
+                with open(os.path.join(self.multiprocess_dir, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render_prometheus(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format.
+        """
+        stages = {}
+        pipelines = {}
+        for snapshot in self._combined():
+            for stage, totals in snapshot['stages'].items():
+                merged = stages.setdefault(stage, _stage_totals())
+                for key in ('runs', 'wall_seconds', 'cpu_seconds', 'rows'):
+                    merged[key] += totals[key]
+                for key in ('process_peak_rss_bytes', 'peak_rss_growth_bytes'):
+                    merged[key] = max(merged[key], totals.get(key, 0))
+            for name, totals in snapshot['pipelines'].items():
+                merged = pipelines.setdefault(name, {'runs': 0, 'wall_seconds': 0.0})
+                merged['runs'] += totals['runs']
+                merged['wall_seconds'] += totals['wall_seconds']
+
+        lines = []
+        stage_metrics = [
+            ('fraud_pipeline_stage_runs_total', 'counter', 'Number of times each pipeline stage ran.', 'runs'),
+            ('fraud_pipeline_stage_wall_seconds_total', 'counter', 'Wall-clock seconds spent in each pipeline stage.', 'wall_seconds'),
+            ('fraud_pipeline_stage_cpu_seconds_total', 'counter', 'Process CPU seconds spent in each pipeline stage.', 'cpu_seconds'),
+            ('fraud_pipeline_stage_rows_total', 'counter', 'Rows processed by each pipeline stage.', 'rows'),
+            ('fraud_pipeline_stage_process_peak_rss_bytes', 'gauge', 'Highest process lifetime peak RSS observed at the end of each stage.', 'process_peak_rss_bytes'),
+            ('fraud_pipeline_stage_peak_rss_growth_bytes', 'gauge', 'Largest rise of the process peak RSS during one run of each stage.', 'peak_rss_growth_bytes'),
+        ]
+        for metric, kind, help_text, key in stage_metrics:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for stage in sorted(stages):
+                lines.append(f'{metric}{{stage="{stage}"}} {stages[stage][key]}')
+        pipeline_metrics = [
+            ('fraud_pipeline_runs_total', 'Number of completed pipeline runs.', 'runs'),
+            ('fraud_pipeline_wall_seconds_total', 'Wall-clock seconds spent in completed pipeline runs.', 'wall_seconds'),
+        ]
+        for metric, help_text, key in pipeline_metrics:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name in sorted(pipelines):
+                lines.append(f'{metric}{{pipeline="{name}"}} {pipelines[name][key]}')
+        return '\n'.join(lines) + '\n'
+
+def _stage_totals():
+    return {'runs': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows': 0, 'process_peak_rss_bytes': 0,
+            'peak_rss_growth_bytes': 0}
+
+def process_running(pid):
+    """
+    Whether a process with this pid exists. Always true on Windows, where
+    probing with os.kill would end the process.
+    """
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+METRICS = MetricsRegistry(os.environ.get('FRAUD_METRICS_DIR'))
+atexit.register(METRICS.write_snapshot)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=METRICS.reset)
+
+@contextmanager
+def pipeline_run(name):
+    """
+    Group the stages executed inside the block into one run, log the run as
+    a single JSON line and add it to METRICS.
+    Args:
+        name (str): Pipeline entry point name, e.g. 'score_claims'.
+    Returns:
+        PipelineRun: The run being recorded.
+    """
+    run = PipelineRun(name)
+    parent = _current_run.get()
+    token = _current_run.set(run)
+    start = time.perf_counter()
+    try:
+        yield run
+    finally:
+        run.wall_seconds = time.perf_counter() - start
+        _current_run.reset(token)
+        if parent is not None:
+            # A nested run's stages also belong to the run that contains it
+            parent.stages.extend(run.stages)
+        METRICS.record_run(run)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({'event': 'pipeline_run', **run.as_dict()}))
+
+@contextmanager
+def stage(name, data=None):
+    """
+    Measure wall time, CPU time and peak memory growth of a pipeline stage. The
+    record is added to METRICS, to the enclosing pipeline_run if any, and
+    logged as a JSON line at DEBUG level. Costs a few microseconds.
+    Args:
+        name (str): Stage name, e.g. 'preprocess'.
+        data: Optional DataFrame or array whose shape gives rows and cols.
+    Returns:
+        StageRecord: The record, whose shape can be set inside the block.
+    """
+    record = StageRecord(name)
+    if data is not None:
+        record.set_shape(data)
+    rss_before = peak_rss_bytes()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record.wall_seconds = time.perf_counter() - wall_start
+        record.cpu_seconds = time.process_time() - cpu_start
+        record.process_peak_rss_bytes = peak_rss_bytes()
+        record.peak_rss_growth_bytes = record.process_peak_rss_bytes - rss_before
+        METRICS.record_stage(record)
+        run = _current_run.get()
+        if run is not None:
+            run.stages.append(record)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({'event': 'pipeline_stage', **record.as_dict()}))
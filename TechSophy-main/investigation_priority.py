@@ -1,27 +1,203 @@
+import heapq
+import numpy as np
 import pandas as pd
+from instrumentation import stage
 
-def prioritize_investigations(df, confidence_col='fraud_confidence', risk_factors=None):
+def investigation_scores(df, confidence_col='fraud_confidence', risk_factors=None, rows=None, rules=None,
+                         claimant_store=None):
+    """
+    Investigation priority score of every claim: the confidence score plus
+    the weighted sum of the risk factor columns, in one matrix product,
+    then adjusted by the risk rules.
+    Args:
+        df (pd.DataFrame): Claims with confidence scores.
+        confidence_col (str): Column name for fraud confidence scores.
+        risk_factors (dict): Optional risk factor columns and their weights.
+            Factors missing from df are ignored.
+        rows (np.ndarray): Optional positions of the claims to score. Only
+            their values are gathered, column by column.
+        rules (RuleSet): Optional risk rules; see risk_rules.
+        claimant_store (ClaimantAggregateStore): Optional claimant history
+            for rules on claimant_claim_count.
+    Returns:
+        np.ndarray: Float scores aligned with the rows of df, or with rows.
+    """
+    scores = _base_scores(df, confidence_col, risk_factors, rows)
+    if rules is not None and len(rules):
+        scores = rules.score(df, scores, rows, claimant_store)
+    return scores
+
+def _base_scores(df, confidence_col, risk_factors, rows):
+    scores = _column_values(df, confidence_col, rows)
+    factors = [factor for factor in (risk_factors or {}) if factor in df.columns]
+    if factors:
+        weights = np.array([risk_factors[factor] for factor in factors], dtype=float)
+        if rows is None:
+            values = df[factors].to_numpy(dtype=float, na_value=np.nan)
+        else:
+            values = np.column_stack([_column_values(df, factor, rows) for factor in factors])
+        scores = scores + values @ weights
+    return scores
+
+def _column_values(df, col, rows):
+    values = df[col].to_numpy(dtype=float, na_value=np.nan)
+    return values if rows is None else values[rows]
+
+def top_k_order(scores, k=None):
+    """
+    Positions of the k highest scores, highest first, found with a partial
+    partition instead of a full sort. Ties keep their original order and
+    NaN scores rank last.
+    Args:
+        scores (np.ndarray): Scores to rank.
+        k (int): Number of positions to return. All of them when None.
+    Returns:
+        np.ndarray: Integer positions into scores.
+    """
+    key = np.where(np.isnan(scores), -np.inf, scores)
+    if k is None or k >= len(key):
+        return np.argsort(-key, kind='stable')
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    threshold = np.partition(key, len(key) - k)[len(key) - k]
+    above = np.flatnonzero(key > threshold)
+    ties = np.flatnonzero(key == threshold)[:k - len(above)]
+    candidates = np.concatenate([above, ties])
+    return candidates[np.argsort(-key[candidates], kind='stable')]
+
+def prioritize_investigations(df, confidence_col='fraud_confidence', risk_factors=None, top_k=None, rows=None,
+                              rules=None, claimant_store=None):
     """
     Score and prioritize flagged claims for investigation.
     Args:
         df (pd.DataFrame): DataFrame containing flagged claims with confidence scores.
         confidence_col (str): Column name for fraud confidence scores.
         risk_factors (dict): Optional dictionary of additional risk factors and their weights.
+        top_k (int): Only return the top_k highest priority claims. The rest
+            are never sorted or copied.
+        rows (np.ndarray): Optional positions of the flagged claims in df,
+            which then holds every claim. Saves copying the flagged claims
+            out of df before prioritizing them.
+        rules (RuleSet): Optional risk rules adjusting the scores; see
+            risk_rules. The result then has a rule_contributions column
+            naming the rules that changed each claim's score and by how much.
+        claimant_store (ClaimantAggregateStore): Optional claimant history
+            for rules on claimant_claim_count.
     Returns:
         pd.DataFrame: DataFrame sorted by investigation priority score (descending).
     """
-    df = df.copy()
-    
-    # Base score is the confidence score
-    df['investigation_score'] = df[confidence_col]
-    
-    # Add weighted risk factors if provided
-    if risk_factors:
-        for factor, weight in risk_factors.items():
-            if factor in df.columns:
-                df['investigation_score'] += weight * df[factor]
-    
-    
-    df_sorted = df.sort_values(by='investigation_score', ascending=False)
-    
+    with stage('prioritize', df if rows is None else rows):
+        base = _base_scores(df, confidence_col, risk_factors, rows)
+        use_rules = rules is not None and len(rules) > 0
+        scores = rules.score(df, base, rows, claimant_store) if use_rules else base
+        order = top_k_order(scores, top_k)
+        # take copies the selected rows once, in priority order
+        selected = order if rows is None else rows[order]
+        df_sorted = df.take(selected)
+        df_sorted['investigation_score'] = scores[order]
+        if use_rules:
+            # Per-rule contributions are expanded for the selected claims only
+            _, contributions = rules.contributions(df, base[order], selected, claimant_store)
+            df_sorted['rule_contributions'] = rules.explain(contributions)
+
     return df_sorted
+
+class InvestigationQueue:
+    """
+    The k highest priority claims seen so far, kept in a bounded min-heap so
+    scored claims can be pushed batch by batch, e.g. chunk by chunk while
+    streaming, without keeping or re-sorting every flagged claim. Each batch
+    costs O(n + k log k) and the queue is read back in O(k log k).
+    Ties are won by the claim that arrived first.
+    """
+    def __init__(self, k, confidence_col='fraud_confidence', risk_factors=None, rules=None, claimant_store=None):
+        """
+        Args:
+            k (int): Number of claims to keep.
+            confidence_col (str): Column name for fraud confidence scores.
+            risk_factors (dict): Optional risk factor columns and their weights.
+            rules (RuleSet): Optional risk rules, as in
+                prioritize_investigations. Derived columns such as
+                claimant_claim_count are computed over each pushed batch.
+            claimant_store (ClaimantAggregateStore): Optional claimant history
+                for rules on claimant_claim_count, normally the artifact's, so
+                claims are counted as the feature pipeline counted them. It
+                should not yet hold the batches pushed.
+        """
+        self.k = k
+        self.confidence_col = confidence_col
+        self.risk_factors = risk_factors
+        self.rules = rules if rules is not None and len(rules) else None
+        self.claimant_store = claimant_store
+        # (score, -arrival, row) tuples; the root is the claim evicted next
+        self._heap = []
+        self._arrivals = 0
+        self._columns = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def min_score(self):
+        """
+        Score a new claim must beat to enter a full queue, or None while
+        the queue is not full.
+        """
+        return self._heap[0][0] if len(self._heap) >= self.k else None
+
+    def push_batch(self, df, rows=None):
+        """
+        Offer a batch of scored claims to the queue.
+        Args:
+            df (pd.DataFrame): Claims with the confidence and risk factor columns.
+            rows (np.ndarray): Optional positions of the claims to offer, e.g.
+                the flagged ones; df then holds the whole batch, which the
+                rules' derived columns are computed over.
+        Returns:
+            int: Number of claims from the batch that entered the queue.
+        """
+        first_arrival = self._arrivals
+        self._arrivals += len(df) if rows is None else len(rows)
+        if self.k <= 0 or df.empty or (rows is not None and len(rows) == 0):
+            return 0
+        base = _base_scores(df, self.confidence_col, self.risk_factors, rows)
+        scores = self.rules.score(df, base, rows, self.claimant_store) if self.rules is not None else base
+        # Only the batch's own top k can enter, and only by beating the current minimum
+        candidates = top_k_order(scores, self.k)
+        candidates = candidates[~np.isnan(scores[candidates])]
+        floor = self.min_score()
+        if floor is not None:
+            candidates = candidates[scores[candidates] > floor]
+        if len(candidates) == 0:
+            return 0
+        selected = candidates if rows is None else rows[candidates]
+        records = df.iloc[selected].to_dict('records')
+        if self.rules is not None:
+            _, contributions = self.rules.contributions(df, base[candidates], selected, self.claimant_store)
+            for record, explained in zip(records, self.rules.explain(contributions)):
+                record['rule_contributions'] = explained
+        for col in records[0]:
+            if col not in self._columns:
+                self._columns.append(col)
+        entered = 0
+        for position, row in zip(candidates, records):
+            item = (float(scores[position]), -(first_arrival + int(position)), row)
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+                entered += 1
+            elif item[:2] > self._heap[0][:2]:
+                heapq.heapreplace(self._heap, item)
+                entered += 1
+        return entered
+
+    def top(self, n=None):
+        """
+        The queued claims in priority order.
+        Args:
+            n (int): Return only the first n claims.
+        Returns:
+            pd.DataFrame: Claims with an investigation_score column, highest first.
+        """
+        items = heapq.nlargest(n if n is not None else len(self._heap), self._heap, key=lambda item: item[:2])
+        result = pd.DataFrame([row for _, _, row in items], columns=self._columns)
+        result['investigation_score'] = [score for score, _, _ in items]
+        return result
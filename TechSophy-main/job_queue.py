@@ -0,0 +1,196 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from result_store import ResultStore, build_eval_metrics
+from model_registry import get_artifact
+from result_cache import ResultCache
+from main import process_claims, combine_and_prioritize
+from streaming import score_chunks, DEFAULT_CHUNKSIZE
+from instrumentation import METRICS, pipeline_run, process_running
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+class JobQueue:
+    """
+    Runs uploaded claim files through the scoring pipeline in a pool of
+    worker processes. Each job reports its state, the stage it has reached
+    and the number of rows read to a status file next to its results, so
+    any web worker can answer status polls, together with the pid of the
+    process responsible for it: the submitting process while the job is
+    queued, the worker once it runs. A job whose process has exited is
+    reported as failed instead of waiting forever.
+    """
+    def __init__(self, results_dir=None, max_workers=None, chunksize=DEFAULT_CHUNKSIZE, cache=None):
+        self.store = ResultStore(results_dir)
+        self.max_workers = max_workers or os.cpu_count()
+        self.chunksize = chunksize
+        self.cache = cache
+        self._executor = None
+
+    def submit(self, file_path, job_id=None, model_version=None, content_hash=None, remove_file=False):
+        """
+        Queue a claims file for scoring. When a result cache is configured
+        and holds results for the same file content and model version, the
+        job is completed from the cache immediately instead.
+        Args:
+            file_path (str): Path to the uploaded claims CSV file.
+            job_id (str): Optional job ID; a new one is generated if omitted.
+            model_version (str): Artifact version to score with. Defaults to
+                the latest version when the job runs.
+            content_hash (str): Hex digest of the file's content, used as
+                part of the cache key. The cache is skipped without it.
+            remove_file (bool): Delete the file once the job has finished
+                with it, e.g. an upload that is not needed afterwards.
+        Returns:
+            str: The job ID.
+        """
+        job_id = job_id or self.store.new_job_id()
+        submitted_at = time.time()
+        cache_key = None
+        if self.cache is not None and content_hash is not None:
+            cache_key = ResultCache.make_key(content_hash, model_version)
+            summary = self.cache.restore(cache_key, self.store, job_id)
+            if summary is not None:
+                write_status(self.store, job_id, state=DONE, stage='done', cached=True,
+                             rows_read=summary['total_claims'], total_claims=summary['total_claims'],
+                             num_flagged=summary['num_flagged'], submitted_at=submitted_at, finished_at=time.time())
+                if remove_file:
+                    os.remove(file_path)
+                return job_id
+        write_status(self.store, job_id, state=QUEUED, stage='queued', rows_read=0, submitted_at=submitted_at,
+                     pid=os.getpid())
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        future = self._executor.submit(run_job, self.store.results_dir, job_id, file_path, self.chunksize,
+                                       model_version, self.cache if cache_key else None, cache_key, remove_file)
+        future.add_done_callback(lambda done: self._job_exited(done, job_id, file_path, remove_file))
+        return job_id
+
+    def _job_exited(self, future, job_id, file_path, remove_file):
+        # run_job records its own errors; an exception here means the pool
+        # broke, e.g. a worker was killed, and the job never finished
+        if future.cancelled() or future.exception() is None:
+            return
+        self._executor = None
+        _fail_orphan(self.store, job_id, f"The worker process scoring this job exited: {future.exception()!r}")
+        if remove_file and os.path.exists(file_path):
+            os.remove(file_path)
+
+    def status(self, job_id):
+        """
+        Returns:
+            dict: The job's latest status, or None for an unknown job. A
+                queued or running job whose process has exited is marked
+                failed first.
+        """
+        status = read_status(self.store, job_id)
+        if status is not None and status['state'] in (QUEUED, RUNNING) and 'pid' in status \
+                and not process_running(status['pid']):
+            status = _fail_orphan(self.store, job_id, "The process scoring this job exited before it finished.")
+        return status
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+def status_path(store, job_id):
+    return os.path.join(store.job_dir(job_id), 'status.json')
+
+def read_status(store, job_id):
+    try:
+        with open(status_path(store, job_id)) as f:
+            return json.load(f)
+    except (KeyError, FileNotFoundError):
+        return None
+
+def write_status(store, job_id, **fields):
+    """
+    Merge fields into the job's status file. The file is replaced atomically
+    so pollers never read a partial write.
+    """
+    os.makedirs(store.job_dir(job_id), exist_ok=True)
+    status = read_status(store, job_id) or {'job_id': job_id}
+    status.update(fields)
+    status['updated_at'] = time.time()
+    path = status_path(store, job_id)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, path)
+    return status
+
+def _fail_orphan(store, job_id, error):
+    status = read_status(store, job_id)
+    if status['state'] in (DONE, FAILED):
+        # The job finished in the meantime
+        return status
+    return write_status(store, job_id, state=FAILED, stage='failed', error=error, finished_at=time.time())
+
+def run_job(results_dir, job_id, file_path, chunksize=DEFAULT_CHUNKSIZE, model_version=None, cache=None, cache_key=None,
+            remove_file=False):
+    """
+    Score one file and store its results. Runs inside a worker process.
+    Finished results are also added to cache under cache_key when given.
+    With remove_file, the file is deleted afterwards, whatever the outcome.
+    """
+    store = ResultStore(results_dir)
+    write_status(store, job_id, state=RUNNING, stage='loading_model', started_at=time.time(), pid=os.getpid())
+    try:
+        with pipeline_run('upload_job') as run:
+            data, prioritized, report, num_flagged, drift = _run_pipeline(store, job_id, file_path, chunksize,
+                                                                          model_version)
+        write_status(store, job_id, stage='saving', metrics=run.as_dict())
+        store.save(job_id, data, prioritized, build_eval_metrics(report, num_flagged, len(data)), drift)
+        if cache is not None:
+            cache.put(cache_key, store.job_dir(job_id))
+        write_status(store, job_id, state=DONE, stage='done', finished_at=time.time(),
+                     total_claims=len(data), num_flagged=num_flagged)
+    except Exception as e:
+        write_status(store, job_id, state=FAILED, stage='failed', error=str(e), finished_at=time.time())
+    finally:
+        if remove_file and os.path.exists(file_path):
+            os.remove(file_path)
+    # Pool workers exit without running atexit handlers, so publish metrics now
+    METRICS.write_snapshot()
+
+def _run_pipeline(store, job_id, file_path, chunksize, model_version):
+    artifact = get_artifact(model_version)
+    if artifact is not None:
+        return _score_with_artifact(store, job_id, file_path, artifact, chunksize)
+    # No registered model: train on the uploaded file as process_claims does
+    write_status(store, job_id, stage='training')
+    data, prioritized, report, num_flagged = process_claims(file_path)
+    write_status(store, job_id, rows_read=len(data))
+    # A model trained on the file itself has nothing to drift from
+    return data, prioritized, report, num_flagged, None
+
+def _score_with_artifact(store, job_id, file_path, artifact, chunksize):
+    write_status(store, job_id, stage='scoring')
+    chunks, anomaly_scores = [], []
+    rows_read = 0
+    monitor = artifact.drift_monitor()
+    for chunk in score_chunks(file_path, artifact, chunksize, columns=artifact.pipeline.input_columns(),
+                              monitor=monitor, anomaly_col='anomaly_score'):
+        anomaly_scores.append(chunk.pop('anomaly_score').to_numpy())
+        chunks.append(chunk)
+        rows_read += len(chunk)
+        write_status(store, job_id, rows_read=rows_read)
+    if not chunks:
+        raise ValueError("The uploaded file contains no claims.")
+    data = pd.concat(chunks, ignore_index=True)
+    # Metrics were computed once at training time; uploads only read them
+    report = artifact.evaluation_report()
+
+    write_status(store, job_id, stage='prioritizing')
+    # The policy is applied again over the whole file, so a flag budget covers the file rather than each chunk
+    prioritized, num_flagged = combine_and_prioritize(data, data['fraud_confidence'].to_numpy(),
+                                                      np.concatenate(anomaly_scores), artifact.decision_policy(),
+                                                      claimant_store=artifact.pipeline.claimant_store)
+    return data, prioritized, report, num_flagged, monitor.report() if monitor is not None else None
@@ -1,65 +1,152 @@
 import sys
+import argparse
+import numpy as np
 import pandas as pd
-from data_processing import load_data, preprocess_data
-from feature_extraction import extract_features
+from data_processing import load_data
+from feature_extraction import FeaturePipeline
 from anomaly_detection import AnomalyDetection
 from fraud_detection import FraudDetectionModel
+from decision_policy import DecisionPolicy
 from investigation_priority import prioritize_investigations
+from risk_rules import load_rules
+from model_registry import get_artifact
+from parallel_scoring import ScoringPool
+from instrumentation import pipeline_run
 
-def process_claims(file_path):
-    # Load data
-    data = load_data(file_path)
+@pipeline_run('process_claims')
+def process_claims(file_path, n_jobs=None, lean=False, budget=None, rules=None):
+    # Load data; lean mode narrows the dtypes and builds float32 features
+    data = load_data(file_path, lean=lean)
     
     # Check for target column
     if 'fraud_reported' not in data.columns:
         raise ValueError("The dataset must contain a 'fraud_reported' column as the target.")
     
-    data_processed = preprocess_data(data)
-    
-    data_features = extract_features(data_processed)
-    
-    # Separate features and target
-    X = data_features.drop(columns=['fraud_reported_Y', 'fraud_reported_N'], errors='ignore')
+    # Fit the preprocessing layout on this batch and encode it in one pass
+    X = FeaturePipeline(target_col='fraud_reported').fit_transform(data, dtype=np.float32 if lean else np.float64)
     y = data['fraud_reported'].map({'Y': 1, 'N': 0})
     
-    anomaly_detector = AnomalyDetection()
+    anomaly_detector = AnomalyDetection(n_jobs=n_jobs)
     anomaly_detector.fit(X)
-    anomaly_preds = anomaly_detector.predict(X)
-    # Convert anomaly predictions: -1 (anomaly) to 1, 1 (normal) to 0
-    anomaly_flags = (anomaly_preds == -1).astype(int)
+    _, anomaly_scores = anomaly_detector.score(X)
+    
+    model = FraudDetectionModel(n_jobs=n_jobs)
+    # Evaluated on the claims held out of training, not on rows it has seen
+    report = model.train(X, y)
+    _, fraud_confidence = model.predict(X)
+    
+    # Without calibration data, flag what either model flags, or the budget's share of claims
+    policy = DecisionPolicy.default(anomaly_detector.model.offset_)
+    if budget is not None:
+        policy = policy.with_budget(budget)
+    # No claimant history is kept here, so rules count repeat claims within this file
+    prioritized, num_flagged = combine_and_prioritize(data, fraud_confidence, anomaly_scores, policy, rules=rules)
+    
+    return data, prioritized, report, num_flagged
+
+@pipeline_run('score_claims')
+def score_claims(file_path, artifact=None, n_workers=None, lean=False, budget=None, rules=None):
+    """
+    Score claims against a previously trained model artifact, without training.
+    Args:
+        file_path (str): Path to the claims CSV file. The 'fraud_reported'
+            column is optional.
+        artifact (ModelArtifact): Artifact to score with. Defaults to the
+            latest artifact in the model registry.
+        n_workers (int): When above 1, large files are scored in a pool of
+            this many worker processes. Results are the same either way.
+        lean (bool): Load with narrowed dtypes and build float32 features,
+            for a several times smaller peak memory on large files.
+        budget (float): Flag this share of the claims, the highest risk
+            ones, instead of applying the artifact's policy thresholds.
+        rules (RuleSet): Risk rules for the investigation scores. Defaults
+            to the rule file configured by FRAUD_RISK_RULES, if any.
+    Returns:
+        tuple: (data, prioritized, report, num_flagged). report is the
+            evaluation stored in the artifact at training time.
+    """
+    if artifact is None:
+        artifact = get_artifact()
+        if artifact is None:
+            raise ValueError("No trained model artifact found. Run 'python model_registry.py train <csv>' first.")
+    # Only the columns the fitted pipeline reads are loaded
+    data = load_data(file_path, columns=artifact.pipeline.input_columns(), lean=lean)
+    dtype = np.float32 if lean else np.float64
     
-    model = FraudDetectionModel()
-    model.train(X, y)
-    fraud_preds, fraud_confidence = model.predict(X)
+    if n_workers and n_workers > 1:
+        with ScoringPool(artifact, n_workers) as pool:
+            _, fraud_confidence, _, anomaly_scores = pool.score(data, dtype=dtype)
+    else:
+        _, fraud_confidence, _, anomaly_scores = artifact.score(data, dtype=dtype)
     
-    from sklearn.metrics import classification_report
-    report = classification_report(y, fraud_preds, output_dict=True)
+    report = artifact.evaluation_report()
     
-    # Combine results: flag if either model flags fraud
-    combined_flag = ((fraud_preds == 1) | (anomaly_flags == 1)).astype(int)
+    policy = artifact.decision_policy()
+    if budget is not None:
+        policy = policy.with_budget(budget)
+    prioritized, num_flagged = combine_and_prioritize(data, fraud_confidence, anomaly_scores, policy, rules=rules,
+                                                      claimant_store=artifact.pipeline.claimant_store)
     
-    data['fraud_predicted'] = combined_flag
+    return data, prioritized, report, num_flagged
+
+def combine_and_prioritize(data, fraud_confidence, anomaly_scores, policy, top_k=None, rules=None,
+                           claimant_store=None):
+    """
+    Add the combined prediction columns to data and prioritize the claims
+    the DecisionPolicy flags.
+    With top_k, only the top_k highest priority flagged claims are returned;
+    num_flagged still counts all of them.
+    rules are the risk rules adjusting the investigation scores, by default
+    those configured by FRAUD_RISK_RULES; claimant_store is the claimant
+    history their repeat-claim counts include.
+    Returns:
+        tuple: (prioritized, num_flagged)
+    """
+    data['fraud_predicted'] = combine_predictions(fraud_confidence, anomaly_scores, policy)
     data['fraud_confidence'] = fraud_confidence
     
-    flagged = data[data['fraud_predicted'] == 1]
+    # Flagged claims are addressed by position, so only the prioritized rows are copied
+    flagged_rows = np.flatnonzero(data['fraud_predicted'].to_numpy() == 1)
     
-    num_flagged = len(flagged)
+    num_flagged = len(flagged_rows)
     
-    prioritized = prioritize_investigations(flagged, confidence_col='fraud_confidence')
+    prioritized = prioritize_investigations(data, confidence_col='fraud_confidence', top_k=top_k, rows=flagged_rows,
+                                            rules=rules if rules is not None else load_rules(),
+                                            claimant_store=claimant_store)
     
-    return data, prioritized, report, num_flagged
+    return prioritized, num_flagged
 
-def main(file_path):
+def combine_predictions(fraud_confidence, anomaly_scores, policy):
+    # Combine results: one vectorized pass of the policy over both models' scores
+    return policy.flag(fraud_confidence, anomaly_scores)
+
+def main(file_path, score_only=False, n_jobs=None, lean=False, budget=None, rules_path=None):
     try:
-        data, prioritized, report, num_flagged = process_claims(file_path)
+        rules = load_rules(rules_path)
+        if score_only:
+            data, prioritized, report, num_flagged = score_claims(file_path, n_workers=n_jobs, lean=lean,
+                                                                  budget=budget, rules=rules)
+        else:
+            data, prioritized, report, num_flagged = process_claims(file_path, n_jobs=n_jobs, lean=lean,
+                                                                    budget=budget, rules=rules)
         print(f"\\nFlagged {num_flagged} potentially fraudulent claims after combining models.")
         print("\\nTop claims prioritized for investigation:")
         print(prioritized.head(10))
     except Exception as e:
         print(f"Error: {e}")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Detect and prioritize potentially fraudulent insurance claims.")
+    parser.add_argument('file', help="Claims CSV, Parquet or Arrow file.")
+    parser.add_argument('--score', action='store_true',
+                        help="Score with the registered model instead of training on the file.")
+    parser.add_argument('--n-jobs', type=int, default=None, help="Cores used for fitting and scoring (-1: all).")
+    parser.add_argument('--lean', action='store_true', help="Load and score with the smallest dtypes.")
+    parser.add_argument('--budget', type=float, default=None, help="Flag this share of the file's claims.")
+    parser.add_argument('--rules', default=None, help="Risk rule JSON file adjusting the investigation scores.")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <path_to_insurance_claims_csv>")
-    else:
-        main(sys.argv[1])
+    args = parse_args(sys.argv[1:])
+    main(args.file, score_only=args.score, n_jobs=args.n_jobs, lean=args.lean, budget=args.budget,
+         rules_path=args.rules)
@@ -0,0 +1,468 @@
+import os
+import sys
+import copy
+import argparse
+import warnings
+from datetime import datetime, timezone
+import joblib
+import numpy as np
+from data_processing import load_data
+from feature_extraction import FeaturePipeline
+from anomaly_detection import AnomalyDetection
+from fraud_detection import FraudDetectionModel
+from forest_engine import ForestEngine, installed_sklearn_version
+from decision_policy import DecisionPolicy
+from drift_monitor import DriftProfile
+from evaluation import out_of_fold_predictions, evaluation_metrics, calibrate_policy, usable_folds, DEFAULT_FOLDS
+
+REGISTRY_DIR = os.environ.get('FRAUD_MODEL_DIR', 'models')
+ARTIFACT_PREFIX = 'fraud_model_'
+ARTIFACT_SUFFIX = '.joblib'
+# Scoring-only copy of each artifact: the feature pipeline plus the flat
+# forest engine, without the sklearn models
+SERVING_SUFFIX = '.serving.joblib'
+# Batches up to this many rows are scored with the flat engine, larger ones
+# with sklearn, which traverses trees faster once its overhead is amortized
+ENGINE_MAX_ROWS = 500
+# Cores used to fit the forests; -1 uses all cores. Unset uses one core.
+N_JOBS = int(os.environ['FRAUD_N_JOBS']) if os.environ.get('FRAUD_N_JOBS') else None
+
+# Artifacts already loaded by this process, keyed by (registry_dir, version)
+_artifact_cache = {}
+
+class ModelArtifact:
+    """
+    A fitted feature pipeline together with both detection models, saved and
+    loaded as a single versioned unit. engine holds the same forests as flat
+    arrays for fast small-batch scoring; a serving artifact carries only the
+    engine and has no sklearn models.
+    """
+    # Artifacts saved before the flat engine existed unpickle without one
+    engine = None
+
+    def __init__(self, pipeline, anomaly_detector, fraud_model, version=None, metadata=None, engine=None):
+        self.pipeline = pipeline
+        self.anomaly_detector = anomaly_detector
+        self.fraud_model = fraud_model
+        self.version = version or new_version()
+        self.metadata = metadata or {}
+        self.engine = engine
+
+    def compile(self):
+        """
+        Build the flat-array engine from the fitted models.
+        Returns:
+            ModelArtifact: This artifact.
+        """
+        self.engine = ForestEngine.from_models(self.anomaly_detector, self.fraud_model)
+        return self
+
+    def serving_copy(self):
+        """
+        The artifact without its sklearn models, scoring through the engine.
+        """
+        if self.engine is None:
+            self.compile()
+        return ModelArtifact(self.pipeline, None, None, self.version, self.metadata, self.engine)
+
+    def score(self, df, update_history=False, dtype=np.float64):
+        """
+        Score a batch of raw claims without any training.
+        Args:
+            df (pd.DataFrame): Raw claims data, with or without the target column.
+            update_history (bool): Remember the batch in the pipeline's
+                claimant history so later batches see it.
+            dtype (np.dtype): Dtype of the feature matrix, see FeaturePipeline.transform.
+        Returns:
+            tuple: (fraud_predictions, fraud_confidence, anomaly_flags,
+                anomaly_scores); see decision_policy for combining them.
+        """
+        return self._score_matrix(self.pipeline.transform(df, update_history=update_history, dtype=dtype))
+
+    def score_records(self, records):
+        """
+        Score claims given as dicts, skipping DataFrame construction. Used by
+        the single-claim JSON endpoint.
+        Args:
+            records (list): Claims as dicts of column name to value.
+        Returns:
+            tuple: (fraud_predictions, fraud_confidence, anomaly_flags, anomaly_scores)
+        """
+        return self._score_matrix(self.pipeline.transform_records(records))
+
+    def evaluation_report(self):
+        """
+        Classification report stored when the artifact was trained: the
+        cross-validated one when available, else the hold-out one, else None.
+        """
+        evaluation = self.metadata.get('evaluation')
+        if evaluation is not None:
+            return evaluation['report']
+        return self.metadata.get('holdout_report')
+
+    def decision_policy(self):
+        """
+        DecisionPolicy turning this artifact's scores into fraud flags: the
+        one calibrated at training time when available, else the policy
+        matching the models' own predict methods.
+        """
+        policy = self.metadata.get('decision_policy')
+        if policy is not None:
+            return DecisionPolicy.from_dict(policy)
+        offset = self.engine.anomaly_offset if self.fraud_model is None else self.anomaly_detector.model.offset_
+        return DecisionPolicy.default(offset)
+
+    def drift_monitor(self):
+        """
+        A new DriftMonitor comparing scored batches with the training claims'
+        profile, or None for artifacts saved without one.
+        """
+        profile = self.metadata.get('drift_profile')
+        return DriftProfile.from_dict(profile).monitor() if profile is not None else None
+
+    def _score_matrix(self, X):
+        if self.engine is not None and (self.fraud_model is None or len(X) <= ENGINE_MAX_ROWS):
+            return self.engine.score(X)
+        return score_features(self.anomaly_detector, self.fraud_model, X)
+
+def new_version():
+    # UTC timestamps sort in creation order, so the newest version sorts last
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+
+def score_features(anomaly_detector, fraud_model, X):
+    """
+    Run both models over a feature matrix, one pass over each forest.
+    Returns:
+        tuple: (fraud_predictions, fraud_confidence, anomaly_flags, anomaly_scores)
+    """
+    anomaly_preds, anomaly_scores = anomaly_detector.score(X)
+    # Convert anomaly predictions: -1 (anomaly) to 1, 1 (normal) to 0
+    anomaly_flags = (anomaly_preds == -1).astype(int)
+    fraud_preds, fraud_confidence = fraud_model.predict(X)
+    return fraud_preds, fraud_confidence, anomaly_flags, anomaly_scores
+
+def train_artifact(data, target_col='fraud_reported', n_jobs=None, n_estimators=100, cv_folds=0, budget=None,
+                   target_precision=None):
+    """
+    Fit the feature pipeline and both models on labeled claims.
+    Args:
+        data (pd.DataFrame): Raw claims data including the target column.
+        target_col (str): Name of the 'Y'/'N' fraud label column.
+        n_jobs (int): Cores used to fit and score the forests; -1 uses all
+            cores. Defaults to N_JOBS. The fitted models do not depend on it.
+        n_estimators (int): Trees in each forest.
+        cv_folds (int): When at least 2, also cross-validate the training
+            procedure over this many folds and store the metrics in
+            metadata['evaluation'] (see evaluation.evaluation_metrics), and
+            calibrate the decision policy on the out-of-fold predictions.
+            Small files use fewer folds (see evaluation.usable_folds);
+            with fewer than 2 claims of either class, cross-validation is
+            skipped with a warning and only the hold-out report is kept.
+        budget (float): Calibrate the policy to flag this share of each
+            batch; see evaluation.calibrate_policy.
+        target_precision (float): Calibrate the policy's threshold to reach
+            this precision; see evaluation.calibrate_policy.
+    Returns:
+        ModelArtifact: The fitted, unsaved artifact. metadata['holdout_report']
+            holds the fraud model's classification report on the claims
+            held out of its training, metadata['drift_profile'] the
+            reference profile of the training claims (see drift_monitor).
+    """
+    if target_col not in data.columns:
+        raise ValueError(f"The dataset must contain a '{target_col}' column as the target.")
+    pipeline = FeaturePipeline(target_col=target_col)
+    X = pipeline.fit_transform(data)
+    y = data[target_col].map({'Y': 1, 'N': 0})
+
+    n_jobs = n_jobs if n_jobs is not None else N_JOBS
+    anomaly_detector = AnomalyDetection(n_estimators=n_estimators, n_jobs=n_jobs)
+    anomaly_detector.fit(X)
+
+    fraud_model = FraudDetectionModel(n_estimators=n_estimators, n_jobs=n_jobs)
+    holdout_report = fraud_model.train(X, y)
+
+    metadata = {
+        'training_rows': len(data),
+        'n_estimators': n_estimators,
+        'feature_columns': list(pipeline.feature_names_),
+        'holdout_report': holdout_report,
+        'drift_profile': DriftProfile.fit(data, pipeline).to_dict(),
+    }
+    if cv_folds and cv_folds >= 2 and usable_folds(y.dropna(), cv_folds) < 2:
+        warnings.warn("Too few fraudulent or legitimate claims to cross-validate; the stored metrics are "
+                      "from the hold-out split and the decision policy is not calibrated.")
+    elif cv_folds and cv_folds >= 2:
+        metadata.update(cross_validated_metadata(data, target_col, cv_folds, n_jobs, n_estimators, budget,
+                                                 target_precision))
+    return ModelArtifact(pipeline, anomaly_detector, fraud_model, metadata=metadata).compile()
+
+def cross_validated_metadata(data, target_col, cv_folds, n_jobs, n_estimators, budget=None, target_precision=None):
+    """
+    The 'evaluation' and 'decision_policy' metadata entries, both from one
+    set of out-of-fold predictions.
+    """
+    predictions = out_of_fold_predictions(data, target_col, cv_folds, n_jobs, n_estimators)
+    return {
+        'evaluation': evaluation_metrics(predictions),
+        'decision_policy': calibrate_policy(predictions, budget, target_precision).to_dict(),
+    }
+
+def artifact_path(version, registry_dir=None):
+    registry_dir = registry_dir or REGISTRY_DIR
+    return os.path.join(registry_dir, f"{ARTIFACT_PREFIX}{version}{ARTIFACT_SUFFIX}")
+
+def serving_path(version, registry_dir=None):
+    registry_dir = registry_dir or REGISTRY_DIR
+    return os.path.join(registry_dir, f"{ARTIFACT_PREFIX}{version}{SERVING_SUFFIX}")
+
+def save_artifact(artifact, registry_dir=None):
+    """
+    Write an artifact to the registry under its version, followed by its
+    scoring-only serving copy.
+    Args:
+        artifact (ModelArtifact): The artifact to save.
+        registry_dir (str): Registry directory. Defaults to REGISTRY_DIR.
+    Returns:
+        str: Path of the saved artifact file.
+    """
+    registry_dir = registry_dir or REGISTRY_DIR
+    os.makedirs(registry_dir, exist_ok=True)
+    path = artifact_path(artifact.version, registry_dir)
+    # Write to temporary files first so readers never see a partial artifact
+    for target, obj in ((path, artifact), (serving_path(artifact.version, registry_dir), artifact.serving_copy())):
+        tmp_path = target + '.tmp'
+        joblib.dump(obj, tmp_path)
+        os.replace(tmp_path, target)
+    return path
+
+def list_versions(registry_dir=None):
+    """
+    List the artifact versions in the registry, oldest first.
+    """
+    registry_dir = registry_dir or REGISTRY_DIR
+    if not os.path.isdir(registry_dir):
+        return []
+    versions = [
+        name[len(ARTIFACT_PREFIX):-len(ARTIFACT_SUFFIX)]
+        for name in os.listdir(registry_dir)
+        if name.startswith(ARTIFACT_PREFIX) and name.endswith(ARTIFACT_SUFFIX) and not name.endswith(SERVING_SUFFIX)
+    ]
+    return sorted(versions)
+
+def latest_version(registry_dir=None):
+    """
+    Version of the newest artifact in the registry, or None if it is empty.
+    """
+    versions = list_versions(registry_dir)
+    return versions[-1] if versions else None
+
+def load_artifact(version=None, registry_dir=None, serving=False):
+    """
+    Load an artifact from disk.
+    Args:
+        version (str): Version to load. Defaults to the latest version.
+        registry_dir (str): Registry directory. Defaults to REGISTRY_DIR.
+        serving (bool): Load the scoring-only serving copy instead, with its
+            arrays memory-mapped rather than read. Falls back to the full
+            artifact for versions saved without a serving copy.
+    Returns:
+        ModelArtifact: The loaded artifact. A full artifact whose engine
+            was built under another scikit-learn release gets its engine
+            rebuilt, so it agrees with the installed release's models.
+    """
+    if version is None:
+        versions = list_versions(registry_dir)
+        if not versions:
+            raise FileNotFoundError(f"No model artifacts found in '{registry_dir or REGISTRY_DIR}'.")
+        version = versions[-1]
+    if serving and os.path.exists(serving_path(version, registry_dir)):
+        return joblib.load(serving_path(version, registry_dir), mmap_mode='r')
+    artifact = joblib.load(artifact_path(version, registry_dir))
+    if artifact.engine is not None and artifact.engine.sklearn_version != installed_sklearn_version():
+        artifact.compile()
+    return artifact
+
+def get_artifact(version=None, registry_dir=None, serving=False):
+    """
+    Return an artifact, loading it from disk at most once per process.
+    Returns None if the registry holds no artifacts. See load_artifact for
+    serving.
+    """
+    registry_dir = registry_dir or REGISTRY_DIR
+    if version is None:
+        versions = list_versions(registry_dir)
+        if not versions:
+            return None
+        version = versions[-1]
+    key = (os.path.abspath(registry_dir), version, serving)
+    if key not in _artifact_cache:
+        _artifact_cache[key] = load_artifact(version, registry_dir, serving)
+    return _artifact_cache[key]
+
+def update_artifact(artifact, data, n_new_trees=10, max_estimators=None):
+    """
+    Refresh an artifact with newly labeled claims without retraining on the
+    full history: the claims are added to the claimant history, the fraud
+    forest gains n_new_trees trees fitted on them (retiring the oldest
+    beyond max_estimators) and the anomaly detector's reference window
+    slides forward over them.
+    Args:
+        artifact (ModelArtifact): Full artifact to update; it is not modified.
+        data (pd.DataFrame): Raw newly labeled claims including the target column.
+        n_new_trees (int): Trees to fit on the new claims.
+        max_estimators (int): Optional cap on the fraud forest size.
+    Returns:
+        ModelArtifact: The updated, unsaved artifact under a new version.
+            metadata['update_report'] holds the previous version's
+            classification report on the new claims. A calibrated decision
+            policy is dropped for the default one, and
+            metadata['decision_policy_reset'] records whether it was;
+            'evaluate' calibrates a new one.
+    """
+    if artifact.fraud_model is None:
+        raise ValueError("Serving artifacts hold no sklearn models and cannot be updated; load the full artifact.")
+    target_col = artifact.pipeline.target_col
+    if target_col not in data.columns:
+        raise ValueError(f"The dataset must contain a '{target_col}' column as the target.")
+    # Work on a copy: the original may be cached and serving requests
+    updated = copy.deepcopy(artifact)
+    X = updated.pipeline.transform(data, update_history=True)
+    y = data[target_col].map({'Y': 1, 'N': 0})
+    labeled = y.notna().to_numpy()
+
+    report = updated.fraud_model.update(X[labeled], y[labeled].astype(int), n_new_trees, max_estimators)
+    updated.anomaly_detector.update(X)
+
+    updated.version = new_version()
+    updated.metadata = dict(artifact.metadata)
+    # The parent's evaluation does not describe the updated forests; re-run it with 'evaluate'.
+    # Nor does its calibrated policy: its anomaly threshold was set on the old reference window's
+    # scores, so flagging falls back to the default policy until 'evaluate' recalibrates it.
+    # The drift profile is kept: the parent's training claims remain the reference.
+    updated.metadata.pop('evaluation', None)
+    updated.metadata.pop('holdout_report', None)
+    updated.metadata.update({
+        'decision_policy_reset': updated.metadata.pop('decision_policy', None) is not None,
+        'parent_version': artifact.version,
+        'training_rows': artifact.metadata.get('training_rows', 0) + len(data),
+        'update_rows': len(data),
+        'n_estimators': updated.fraud_model.model.n_estimators,
+        'update_report': report,
+    })
+    return updated.compile()
+
+def train_and_save(file_path, registry_dir=None, n_jobs=None, n_estimators=100, cv_folds=0, budget=None,
+                   target_precision=None):
+    """
+    Train an artifact on a labeled claims file and save it to the registry.
+    Returns:
+        tuple: (path of the new artifact, the trained ModelArtifact)
+    """
+    artifact = train_artifact(load_data(file_path), n_jobs=n_jobs, n_estimators=n_estimators, cv_folds=cv_folds,
+                              budget=budget, target_precision=target_precision)
+    return save_artifact(artifact, registry_dir), artifact
+
+def evaluate_and_save(file_path, version=None, registry_dir=None, cv_folds=DEFAULT_FOLDS, n_jobs=None, budget=None,
+                      target_precision=None):
+    """
+    Cross-validate an artifact's training procedure on a labeled file,
+    normally the one it was trained on, and store the metrics and a
+    recalibrated decision policy in the artifact under the same version.
+    Meant to run offline, so serving only ever reads what is stored.
+    Returns:
+        tuple: (path of the artifact, the evaluated ModelArtifact)
+    """
+    artifact = load_artifact(version, registry_dir)
+    n_jobs = n_jobs if n_jobs is not None else N_JOBS
+    artifact.metadata.update(cross_validated_metadata(
+        load_data(file_path), artifact.pipeline.target_col, cv_folds, n_jobs,
+        artifact.metadata.get('n_estimators', 100), budget, target_precision))
+    return save_artifact(artifact, registry_dir), artifact
+
+def update_and_save(file_path, registry_dir=None, n_new_trees=10, max_estimators=None):
+    """
+    Update the latest artifact in the registry with a file of newly labeled
+    claims and save the result as a new version.
+    Returns:
+        tuple: (path of the new artifact, the updated ModelArtifact)
+    """
+    artifact = update_artifact(load_artifact(registry_dir=registry_dir), load_data(file_path),
+                               n_new_trees, max_estimators)
+    return save_artifact(artifact, registry_dir), artifact
+
+def print_evaluation(artifact):
+    evaluation = artifact.metadata.get('evaluation')
+    report = artifact.evaluation_report()
+    if report is None:
+        return
+    method = evaluation['method'] if evaluation else 'hold-out split'
+    print(f"Fraud model ({method}): precision {report['1']['precision']:.2f}, "
+          f"recall {report['1']['recall']:.2f}, accuracy {report['accuracy']:.2f}")
+    if evaluation:
+        combined = evaluation['combined']
+        print(f"PR-AUC {evaluation['pr_auc']:.3f} (+/- {evaluation['pr_auc_std']:.3f} across folds); "
+              f"combined with anomalies: precision {combined['precision']:.2f}, recall {combined['recall']:.2f}")
+    policy = artifact.metadata.get('decision_policy')
+    if policy and policy['calibration']:
+        calibration = policy['calibration']
+        rule = f"top {policy['budget']:.1%} of each batch" if policy['budget'] is not None else \
+            f"risk >= {policy['threshold']:.3f}"
+        print(f"Calibrated policy ({rule}, anomaly weight {policy['anomaly_weight']:.2f}): "
+              f"precision {calibration['precision']:.2f}, recall {calibration['recall']:.2f}, "
+              f"flags {calibration['flagged_share']:.1%} of claims")
+
+def add_policy_arguments(parser):
+    parser.add_argument('--budget', type=float, default=None,
+                        help="Calibrate the policy to flag this share of each batch, e.g. 0.02.")
+    parser.add_argument('--target-precision', type=float, default=None,
+                        help="Calibrate the policy's threshold to reach this precision (default: best F1).")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train, update and list fraud model artifacts.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    train = commands.add_parser('train', help="Train a new artifact on a labeled claims file.")
+    train.add_argument('file', help="Labeled claims file.")
+    train.add_argument('--n-jobs', type=int, default=None, help="Cores used to fit the forests (-1 for all).")
+    train.add_argument('--cv-folds', type=int, default=DEFAULT_FOLDS,
+                       help="Cross-validation folds for the stored metrics and policy (0 to skip).")
+    add_policy_arguments(train)
+    evaluate = commands.add_parser('evaluate', help="Cross-validate an artifact and store the metrics in it.")
+    evaluate.add_argument('file', help="Labeled claims file, normally the training file.")
+    evaluate.add_argument('--version', default=None, help="Artifact version (default: latest).")
+    evaluate.add_argument('--cv-folds', type=int, default=DEFAULT_FOLDS, help="Cross-validation folds.")
+    evaluate.add_argument('--n-jobs', type=int, default=None, help="Folds fitted at the same time (-1 for all).")
+    add_policy_arguments(evaluate)
+    update = commands.add_parser('update', help="Update the latest artifact with newly labeled claims.")
+    update.add_argument('file', help="Newly labeled claims file.")
+    update.add_argument('--new-trees', type=int, default=10, help="Trees fitted on the new claims.")
+    update.add_argument('--max-estimators', type=int, default=None, help="Retire the oldest trees beyond this many.")
+    commands.add_parser('list', help="List artifact versions, oldest first.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        path, artifact = train_and_save(args.file, n_jobs=args.n_jobs, cv_folds=args.cv_folds, budget=args.budget,
+                                        target_precision=args.target_precision)
+        print_evaluation(artifact)
+        print(f"Saved model artifact to {path}")
+    elif args.command == 'evaluate':
+        path, artifact = evaluate_and_save(args.file, args.version, cv_folds=args.cv_folds, n_jobs=args.n_jobs,
+                                           budget=args.budget, target_precision=args.target_precision)
+        print_evaluation(artifact)
+        print(f"Stored the metrics in {path}")
+    elif args.command == 'update':
+        path, artifact = update_and_save(args.file, n_new_trees=args.new_trees, max_estimators=args.max_estimators)
+        report = artifact.metadata['update_report']
+        print(f"Previous model on the new claims: accuracy {report['accuracy']:.2f}, "
+              f"fraud recall {report['1']['recall']:.2f}, fraud precision {report['1']['precision']:.2f}")
+        print(f"Saved model artifact with {artifact.metadata['n_estimators']} trees to {path}")
+        if artifact.metadata['decision_policy_reset']:
+            print("The calibrated decision policy was reset to the default; run 'evaluate' to recalibrate it.")
+    else:
+        for v in list_versions():
+            print(v)
+
+if __name__ == "__main__":
+    # Import through the module name so pickled artifacts reference
+    # model_registry.ModelArtifact rather than __main__.ModelArtifact
+    from model_registry import main
+    main(sys.argv[1:])
@@ -0,0 +1,82 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from instrumentation import stage
+
+# Batches smaller than this are scored in-process; shipping rows to workers
+# costs more than it saves
+PARALLEL_MIN_ROWS = 20000
+
+# Artifact a worker process scores with, set once per worker. ScoringPool
+# sends it without its feature pipeline; batch_score sends it whole.
+_worker_artifact = None
+
+def _init_worker(artifact):
+    global _worker_artifact
+    if artifact.fraud_model is not None:
+        # The pool already uses every core; nested joblib threads would only compete
+        artifact.anomaly_detector.model.set_params(n_jobs=1)
+        artifact.fraud_model.model.set_params(n_jobs=1)
+    _worker_artifact = artifact
+
+def _score_block(X):
+    return _worker_artifact._score_matrix(X)
+
+class ScoringPool:
+    """
+    Scores large batches with an artifact by splitting the feature matrix
+    into contiguous row blocks and scoring the blocks in worker processes.
+    Features are built in the calling process, so claimant history is read
+    and updated exactly as in ModelArtifact.score, and the blocks are joined
+    back in row order, so the results are identical to serial scoring.
+    Workers receive the models once, when the pool starts; the feature
+    pipeline and claimant history stay in the calling process.
+    """
+    def __init__(self, artifact, n_workers=None, min_rows=PARALLEL_MIN_ROWS):
+        """
+        Args:
+            artifact (ModelArtifact): Artifact to score with.
+            n_workers (int): Worker processes. Defaults to the CPU count.
+            min_rows (int): Smaller batches are scored without the pool.
+        """
+        self.artifact = artifact
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.min_rows = min_rows
+        self._executor = None
+
+    def score(self, df, update_history=False, dtype=np.float64):
+        """
+        Same as ModelArtifact.score, with the models run in the pool.
+        Returns:
+            tuple: (fraud_predictions, fraud_confidence, anomaly_flags, anomaly_scores)
+        """
+        return self.score_matrix(self.artifact.pipeline.transform(df, update_history=update_history, dtype=dtype))
+
+    def score_matrix(self, X):
+        if self.n_workers <= 1 or len(X) < self.min_rows:
+            return self.artifact._score_matrix(X)
+        if self._executor is None:
+            from model_registry import ModelArtifact
+            models = ModelArtifact(None, self.artifact.anomaly_detector, self.artifact.fraud_model,
+                                   self.artifact.version, engine=self.artifact.engine)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.n_workers, initializer=_init_worker, initargs=(models,))
+        with stage('parallel_score', X):
+            blocks = np.array_split(X, min(self.n_workers, len(X)))
+            # map returns results in submission order, keeping rows aligned
+            results = list(self._executor.map(_score_block, blocks))
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+
+    def decision_policy(self):
+        return self.artifact.decision_policy()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,127 @@
+import os
+import json
+import shutil
+import hashlib
+import uuid
+
+CACHE_DIR = os.environ.get('FRAUD_CACHE_DIR', 'cache')
+CACHE_MAX_BYTES = int(os.environ.get('FRAUD_CACHE_MAX_BYTES', 1024 ** 3))
+# Result files copied from a job directory into a cache entry
+CACHED_FILES = ('claims.pkl', 'flagged.pkl', 'summary.json')
+# Version recorded for results produced by training on the upload itself
+UNTRAINED_VERSION = 'train-on-upload'
+
+class ResultCache:
+    """
+    On-disk cache of finished scoring results keyed by the uploaded file's
+    content hash and the model version that scored it. Entries are evicted
+    least recently used first once their total size exceeds max_bytes.
+    """
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    @staticmethod
+    def make_key(content_hash, model_version):
+        """
+        Args:
+            content_hash (str): Hex digest of the uploaded file's content.
+            model_version (str): Artifact version, or None when results come
+                from training on the upload.
+        Returns:
+            str: Cache key.
+        """
+        return hashlib.sha256(f"{content_hash}:{model_version or UNTRAINED_VERSION}".encode()).hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """
+        Returns:
+            str: Directory holding the cached result files, or None on a miss.
+                A hit marks the entry as most recently used.
+        """
+        entry = self.entry_dir(key)
+        if not os.path.exists(os.path.join(entry, 'summary.json')):
+            return None
+        os.utime(entry)
+        return entry
+
+    def put(self, key, job_dir):
+        """
+        Copy a finished job's result files into the cache, then evict least
+        recently used entries until the cache fits in max_bytes.
+        """
+        entry = self.entry_dir(key)
+        if os.path.exists(entry):
+            os.utime(entry)
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Build the entry under a temporary name so readers never see it half written
+        tmp_entry = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_entry)
+        try:
+            for name in CACHED_FILES:
+                _link_or_copy(os.path.join(job_dir, name), os.path.join(tmp_entry, name))
+            os.rename(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            if not os.path.exists(entry):
+                raise
+        self.evict()
+
+    def restore(self, key, store, job_id):
+        """
+        Materialize a cached result as the results of a new job.
+        Args:
+            key (str): Cache key.
+            store (ResultStore): Store to restore the results into.
+            job_id (str): The new job's ID.
+        Returns:
+            dict: The restored job summary, or None on a cache miss.
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        job_dir = store.job_dir(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        for name in CACHED_FILES:
+            if name != 'summary.json':
+                _link_or_copy(os.path.join(entry, name), os.path.join(job_dir, name))
+        with open(os.path.join(entry, 'summary.json')) as f:
+            summary = json.load(f)
+        summary['job_id'] = job_id
+        # summary.json is written last; its presence marks the job as complete
+        tmp_path = os.path.join(job_dir, 'summary.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f)
+        os.replace(tmp_path, os.path.join(job_dir, 'summary.json'))
+        store.cleanup(keep=job_id)
+        return summary
+
+    def evict(self):
+        """
+        Delete least recently used entries until the total size fits.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith('.tmp-') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+            total += size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+def _link_or_copy(src, dst):
+    # Hard links share storage when cache and results live on the same filesystem
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
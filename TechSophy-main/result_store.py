@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+RESULTS_DIR = os.environ.get('FRAUD_RESULTS_DIR', 'results')
+# Finished jobs' results are deleted after this many hours, and beyond this
+# many jobs, oldest first; 0 turns either limit off
+RESULTS_MAX_AGE_HOURS = float(os.environ.get('FRAUD_RESULTS_MAX_AGE_HOURS', 24 * 7))
+RESULTS_MAX_JOBS = int(os.environ.get('FRAUD_RESULTS_MAX_JOBS', 1000))
+TABLES = ('claims', 'flagged')
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+# Number of equal-width bins for the fraud confidence histogram
+CONFIDENCE_BINS = 10
+
+_JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+class ResultStore:
+    """
+    Keeps scoring results on disk under a job ID and serves them a page at a
+    time. Summary figures and chart aggregates are computed once when the
+    results are saved. The most recently used jobs stay loaded in memory
+    together with any sort orders requested for them. Each save deletes
+    results older than max_age_hours and the oldest beyond max_jobs, so the
+    results directory of a long-running server stays bounded.
+    """
+    def __init__(self, results_dir=None, cache_size=4, max_age_hours=None, max_jobs=None):
+        self.results_dir = results_dir or RESULTS_DIR
+        self.cache_size = cache_size
+        self.max_age_hours = RESULTS_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+        self.max_jobs = RESULTS_MAX_JOBS if max_jobs is None else max_jobs
+        # job_id -> {'claims': DataFrame, 'flagged': DataFrame, 'orders': {}}
+        self._loaded = OrderedDict()
+
+    @staticmethod
+    def new_job_id():
+        return uuid.uuid4().hex
+
+    def job_dir(self, job_id):
+        if not _JOB_ID_PATTERN.fullmatch(job_id or ''):
+            raise KeyError(f"Invalid job ID '{job_id}'.")
+        return os.path.join(self.results_dir, job_id)
+
+    def exists(self, job_id):
+        try:
+            return os.path.exists(os.path.join(self.job_dir(job_id), 'summary.json'))
+        except KeyError:
+            return False
+
+    def save(self, job_id, data, prioritized, eval_metrics=None, drift=None):
+        """
+        Store the scored claims and the prioritized flagged claims of a job.
+        Args:
+            job_id (str): Job ID from new_job_id().
+            data (pd.DataFrame): All claims with fraud_predicted and
+                fraud_confidence columns.
+            prioritized (pd.DataFrame): Flagged claims in priority order.
+            eval_metrics (dict): Optional evaluation metrics to show with the results.
+            drift (dict): Optional drift report of the scored claims; see
+                drift_monitor.DriftMonitor.report.
+        Returns:
+            dict: The job summary.
+        """
+        job_dir = self.job_dir(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        data.to_pickle(os.path.join(job_dir, 'claims.pkl'))
+        prioritized.to_pickle(os.path.join(job_dir, 'flagged.pkl'))
+        summary = build_summary(job_id, data, prioritized, eval_metrics, drift)
+        # summary.json is written last; its presence marks the job as complete
+        tmp_path = os.path.join(job_dir, 'summary.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f)
+        os.replace(tmp_path, os.path.join(job_dir, 'summary.json'))
+        self._loaded.pop(job_id, None)
+        self.cleanup(keep=job_id)
+        return summary
+
+    def cleanup(self, keep=None):
+        """
+        Delete expired results: finished jobs older than max_age_hours, the
+        oldest finished jobs beyond max_jobs, and unfinished jobs whose files
+        have not changed for max_age_hours, i.e. failed or abandoned ones.
+        Args:
+            keep (str): Optional job ID never to delete, e.g. the one just saved.
+        Returns:
+            list: IDs of the deleted jobs.
+        """
+        if not os.path.isdir(self.results_dir):
+            return []
+        max_age = self.max_age_hours * 3600
+        now = time.time()
+        finished, expired = [], []
+        for job_id in os.listdir(self.results_dir):
+            if job_id == keep or not _JOB_ID_PATTERN.fullmatch(job_id):
+                continue
+            job_dir = os.path.join(self.results_dir, job_id)
+            try:
+                summary_path = os.path.join(job_dir, 'summary.json')
+                if os.path.exists(summary_path):
+                    finished.append((os.path.getmtime(summary_path), job_id))
+                    continue
+                changed = max([entry.stat().st_mtime for entry in os.scandir(job_dir)] + [os.path.getmtime(job_dir)])
+            except OSError:
+                # Deleted meanwhile, e.g. by another process's cleanup
+                continue
+            if max_age and now - changed > max_age:
+                expired.append(job_id)
+        # Newest first; keep counts towards max_jobs
+        finished.sort(reverse=True)
+        n_kept = self.max_jobs - (keep is not None) if self.max_jobs else len(finished)
+        for i, (finished_at, job_id) in enumerate(finished):
+            if i >= n_kept or (max_age and now - finished_at > max_age):
+                expired.append(job_id)
+        for job_id in expired:
+            shutil.rmtree(os.path.join(self.results_dir, job_id), ignore_errors=True)
+            self._loaded.pop(job_id, None)
+        return expired
+
+    def summary(self, job_id):
+        with open(os.path.join(self.job_dir(job_id), 'summary.json')) as f:
+            return json.load(f)
+
+    def page(self, job_id, table='flagged', page=1, per_page=DEFAULT_PER_PAGE, sort=None, ascending=True):
+        """
+        Fetch one page of a stored results table.
+        Args:
+            job_id (str): Job ID.
+            table (str): 'claims' for all scored claims or 'flagged' for the
+                prioritized flagged claims.
+            page (int): 1-based page number.
+            per_page (int): Rows per page, capped at MAX_PER_PAGE.
+            sort (str): Optional column to sort by. Without it rows keep their
+                stored order (priority order for 'flagged').
+            ascending (bool): Sort direction.
+        Returns:
+            dict: 'rows' (list of dicts), 'columns', 'page', 'per_page',
+                'total_rows' and 'total_pages'.
+        """
+        if table not in TABLES:
+            raise KeyError(f"Unknown results table '{table}'.")
+        entry = self._load(job_id)
+        frame = entry[table]
+        if sort is not None and sort not in frame.columns:
+            raise KeyError(f"Unknown sort column '{sort}'.")
+        per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+        total_rows = len(frame)
+        total_pages = max(1, -(-total_rows // per_page))
+        page = max(1, min(int(page), total_pages))
+        start = (page - 1) * per_page
+        if sort is None:
+            rows = frame.iloc[start:start + per_page]
+        else:
+            order = self._sort_order(entry, table, sort, ascending)
+            rows = frame.iloc[order[start:start + per_page]]
+        return {
+            # to_json turns NaN into null and NumPy scalars into plain JSON values
+            'rows': json.loads(rows.to_json(orient='records')),
+            'columns': frame.columns.tolist(),
+            'page': page,
+            'per_page': per_page,
+            'total_rows': total_rows,
+            'total_pages': total_pages,
+        }
+
+    def _sort_order(self, entry, table, sort, ascending):
+        key = (table, sort, ascending)
+        if key not in entry['orders']:
+            column = entry[table][sort].reset_index(drop=True)
+            entry['orders'][key] = column.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+        return entry['orders'][key]
+
+    def _load(self, job_id):
+        if job_id in self._loaded:
+            self._loaded.move_to_end(job_id)
+            return self._loaded[job_id]
+        if not self.exists(job_id):
+            raise KeyError(f"No results for job '{job_id}'.")
+        job_dir = self.job_dir(job_id)
+        entry = {table: pd.read_pickle(os.path.join(job_dir, f"{table}.pkl")) for table in TABLES}
+        entry['orders'] = {}
+        self._loaded[job_id] = entry
+        while len(self._loaded) > self.cache_size:
+            self._loaded.popitem(last=False)
+        return entry
+
+def build_summary(job_id, data, prioritized, eval_metrics=None, drift=None):
+    """
+    Precompute the figures shown above the results tables.
+    """
+    total_claims = len(data)
+    num_flagged = len(prioritized)
+    histogram = [0] * CONFIDENCE_BINS
+    if 'fraud_confidence' in data.columns and total_claims:
+        counts, _ = np.histogram(data['fraud_confidence'].to_numpy(dtype=float), bins=CONFIDENCE_BINS, range=(0.0, 1.0))
+        histogram = counts.tolist()
+    return {
+        'job_id': job_id,
+        'total_claims': total_claims,
+        'num_flagged': num_flagged,
+        'not_flagged': total_claims - num_flagged,
+        'confidence_histogram': histogram,
+        'claims_columns': data.columns.tolist(),
+        'flagged_columns': prioritized.columns.tolist(),
+        'eval_metrics': eval_metrics,
+        'drift': drift,
+    }
+
+def build_eval_metrics(report, num_flagged, total_claims):
+    """
+    Flatten a classification report dict into the figures shown on the
+    results page. report may be None for unlabeled data.
+    """
+    eval_metrics = {
+        'has_report': report is not None,
+        'num_flagged': num_flagged,
+        'total_claims': total_claims
+    }
+    if report is not None:
+        eval_metrics.update({
+            'precision_0': round(report['0']['precision'], 2),
+            'recall_0': round(report['0']['recall'], 2),
+            'f1_0': round(report['0']['f1-score'], 2),
+            'support_0': report['0']['support'],
+            'precision_1': round(report['1']['precision'], 2),
+            'recall_1': round(report['1']['recall'], 2),
+            'f1_1': round(report['1']['f1-score'], 2),
+            'support_1': report['1']['support'],
+            'accuracy': round(report['accuracy'], 2),
+        })
+    return eval_metrics
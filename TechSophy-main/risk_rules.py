@@ -0,0 +1,400 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from claimant_store import text_claimant_ids, claim_counts
+
+# JSON rule file used wherever claims are prioritized; unset applies no rules
+RISK_RULES_FILE = os.environ.get('FRAUD_RISK_RULES')
+OPERATORS = {'>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal,
+             '==': np.equal, '!=': np.not_equal}
+# Claims evaluated at a time, bounding the (rows x rules) effect matrix
+BLOCK_ROWS = 65536
+
+# Rule set loaded from RISK_RULES_FILE by this process, keyed by path
+_rules_cache = {}
+
+class RuleSet:
+    """
+    Investigator risk rules, compiled once into vectorized NumPy operations.
+    Each rule has a condition on one column and an effect on the claims
+    matching it, either adding to the investigation score or multiplying it:
+
+        {"name": "high_ratio", "column": "claim_policy_ratio", "op": ">=", "value": 0.9, "add": 0.2}
+        {"name": "theft", "column": "claim_type", "in": ["Theft", "Burglary"], "multiply": 1.3}
+        {"name": "type_weight", "column": "claim_type", "multipliers": {"Theft": 1.3, "Fire": 1.1}}
+        {"name": "type_bonus", "column": "claim_type", "adds": {"Theft": 0.1}}
+
+    op is one of >, >=, <, <=, == and !=; == and != also compare text
+    values. A claim's score is (base + sum of matching adds) times the
+    product of matching multipliers, with multipliers applied in rule order;
+    a rule's contribution is the amount it changed the score by, so a
+    claim's contributions add up to its score minus its base. Missing
+    values and columns match no rule.
+
+    Rules may also read the derived columns claim_policy_ratio and
+    claimant_claim_count, computed as the feature pipeline computes them
+    when the claims do not already have them. Comparisons on the same
+    column and operator are evaluated together in one broadcast, and every
+    categorical rule on a column shares one lookup table, so the cost grows
+    with the number of columns read rather than the number of rules:
+    scores come from cumulative sums and products over each group's sorted
+    thresholds, found by binary search, and per-rule effects are only
+    expanded when contributions are asked for.
+    """
+    def __init__(self, rules):
+        """
+        Args:
+            rules (list): Rule dicts, as in the class docstring.
+        """
+        self.rules = list(rules)
+        self.names = []
+        # Neutral effect of each rule: 0 for adds, 1 for multipliers
+        neutral = []
+        # (column, op) -> (rule positions, thresholds, effects)
+        comparisons = {}
+        # column -> {category: {rule position: effect}}, plus rules matching unlisted values
+        categories, negated = {}, {}
+        for position, rule in enumerate(self.rules):
+            name, column, multiply, effect = _parse(rule, self.names)
+            self.names.append(name)
+            neutral.append(1.0 if multiply else 0.0)
+            if 'op' in rule and not isinstance(rule['value'], str):
+                positions, thresholds, effects = comparisons.setdefault((column, rule['op']), ([], [], []))
+                positions.append(position)
+                thresholds.append(float(rule['value']))
+                effects.append(effect)
+                continue
+            table = categories.setdefault(column, {})
+            if 'multipliers' in rule or 'adds' in rule:
+                for value, rule_effect in (rule.get('multipliers') or rule.get('adds')).items():
+                    table.setdefault(_category_key(value), {})[position] = float(rule_effect)
+            elif 'in' in rule:
+                for value in rule['in']:
+                    table.setdefault(_category_key(value), {})[position] = effect
+            else:
+                if rule['op'] not in ('==', '!='):
+                    raise ValueError(f"Risk rule '{name}' compares text with '{rule['op']}'; use == or !=.")
+                table.setdefault(_category_key(rule['value']), {})[position] = effect
+                if rule['op'] == '!=':
+                    # Every other present value matches
+                    negated.setdefault(column, {})[position] = (_category_key(rule['value']), effect)
+        self.neutral = np.array(neutral, dtype=float)
+        self._adds = np.flatnonzero(self.neutral == 0.0)
+        self._multipliers = np.flatnonzero(self.neutral == 1.0)
+        self._comparisons = [_comparison_group(column, op, np.array(positions), np.array(thresholds),
+                                               np.array(effects), self.neutral)
+                             for (column, op), (positions, thresholds, effects) in comparisons.items()]
+        self._tables = [_category_table(column, table, negated.get(column, {}), self.neutral)
+                        for column, table in categories.items()]
+        self.columns = sorted({column for column, *_ in self._comparisons} | {column for column, *_ in self._tables})
+        # Table row of each category, for claims given as dicts
+        self._table_rows = {column: {value: row for row, value in enumerate(index)} for column, index, *_ in self._tables}
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load rules from a JSON file holding {"rules": [...]}.
+        """
+        with open(path) as f:
+            config = json.load(f)
+        if not isinstance(config, dict) or not isinstance(config.get('rules'), list):
+            raise ValueError(f"Risk rule file '{path}' must hold an object with a 'rules' list.")
+        return cls(config['rules'])
+
+    def __len__(self):
+        return len(self.rules)
+
+    def score(self, df, base, rows=None, claimant_store=None):
+        """
+        Investigation scores of claims after applying the rules.
+        Args:
+            df (pd.DataFrame): Claims. Derived columns are computed over all
+                of its rows, e.g. claimant_claim_count counts claims in df.
+            base (np.ndarray): Score of each claim before the rules,
+                aligned with rows or, without rows, with df.
+            rows (np.ndarray): Optional positions of the claims to score.
+            claimant_store (ClaimantAggregateStore): Optional claimant
+                history; claimant_claim_count then includes stored claims.
+        Returns:
+            np.ndarray: Scores aligned with base.
+        """
+        return self._evaluate(df, base, rows, claimant_store, contributions=False)[0]
+
+    def contributions(self, df, base, rows=None, claimant_store=None):
+        """
+        Scores together with each rule's contribution to them; see score.
+        Returns:
+            tuple: (scores, contributions), contributions being a float
+                matrix with one row per claim and one column per rule, in
+                the order of names.
+        """
+        return self._evaluate(df, base, rows, claimant_store, contributions=True)
+
+    def contributions_records(self, records, base, claimant_store=None):
+        """
+        Same as contributions, for claims given as dicts, without building a
+        DataFrame. Used by the single-claim JSON endpoint.
+        Args:
+            records (list): Claims as dicts of column name to value.
+            base (np.ndarray): Score of each claim before the rules.
+            claimant_store (ClaimantAggregateStore): See score.
+        Returns:
+            tuple: (scores, contributions), as from contributions.
+        """
+        numeric, codes = {}, {}
+        compared = {column for column, *_ in self._comparisons}
+        for column in self.columns:
+            values = _record_column(records, column, claimant_store)
+            if values is None:
+                continue
+            if column in compared:
+                numeric[column] = np.array([_to_number(value) for value in values], dtype=float)
+            if column in self._table_rows:
+                codes[column] = _record_codes(values, self._table_rows[column])
+        return self._apply(numeric, codes, np.asarray(base, dtype=float), contributions=True)
+
+    def explain(self, contributions):
+        """
+        Readable summaries of contribution rows: 'name:+0.200; other:-0.050'
+        listing the rules that changed each claim's score, in rule order.
+        """
+        names = np.array(self.names, dtype=object)
+        return ['; '.join(f"{name}:{value:+.3f}" for name, value in zip(names[row != 0], row[row != 0]))
+                for row in contributions]
+
+    def _evaluate(self, df, base, rows, claimant_store, contributions):
+        base = np.asarray(base, dtype=float)
+        # Each column is read and converted once; missing columns are left out and match nothing
+        series = {column: _column(df, column, rows, claimant_store) for column in self.columns}
+        numeric = {column: _numeric(series[column]) for column, *_ in self._comparisons if series[column] is not None}
+        codes = {column: _table_codes(series[column], index)
+                 for column, index, *_ in self._tables if series[column] is not None}
+        return self._apply(numeric, codes, base, contributions)
+
+    def _apply(self, numeric, codes, base, contributions):
+        if not contributions:
+            added, multiplied = self._totals(numeric, codes, len(base))
+            return (base + added) * multiplied, None
+        scores = np.empty(len(base))
+        matrix = np.empty((len(base), len(self.rules)))
+        for start in range(0, len(base), BLOCK_ROWS):
+            block = slice(start, start + BLOCK_ROWS)
+            effects = self._effects(numeric, codes, block, min(BLOCK_ROWS, len(base) - start))
+            scores[block], matrix[block] = self._combine(base[block], effects)
+        return scores, matrix
+
+    def _totals(self, numeric, codes, n_rows):
+        # Sum of the matching adds and product of the matching multipliers of each claim
+        added, multiplied = np.zeros(n_rows), np.ones(n_rows)
+        for column, op, positions, thresholds, effects, cumulative in self._comparisons:
+            if column not in numeric:
+                continue
+            values = numeric[column]
+            if cumulative is None:
+                # == and != on numbers: few thresholds, compared directly in blocks
+                for start in range(0, n_rows, BLOCK_ROWS):
+                    block = slice(start, start + BLOCK_ROWS)
+                    effect = _compare(op, values[block], thresholds, effects, self.neutral[positions])
+                    added[block] += effect[:, self.neutral[positions] == 0.0].sum(axis=1)
+                    multiplied[block] *= effect[:, self.neutral[positions] == 1.0].prod(axis=1)
+                continue
+            # Thresholds are sorted, so the matching rules are a prefix (> and >=)
+            # or a suffix (< and <=) of them, found by binary search
+            side = 'right' if op in ('>=', '<') else 'left'
+            position = np.searchsorted(thresholds, values, side=side)
+            adds, products = cumulative
+            missing = np.isnan(values)
+            added += np.where(missing, 0.0, adds[position])
+            multiplied *= np.where(missing, 1.0, products[position])
+        for column, _, positions, table in self._tables:
+            if column in codes:
+                rows = codes[column]
+                added += table[:, self.neutral[positions] == 0.0].sum(axis=1)[rows]
+                multiplied *= table[:, self.neutral[positions] == 1.0].prod(axis=1)[rows]
+        return added, multiplied
+
+    def _effects(self, numeric, codes, block, n_rows):
+        # Effect of every rule on every claim of the block, neutral where it does not match
+        effects = np.tile(self.neutral, (n_rows, 1))
+        for column, op, positions, thresholds, rule_effects, _ in self._comparisons:
+            if column in numeric:
+                effects[:, positions] = _compare(op, numeric[column][block], thresholds, rule_effects,
+                                                 self.neutral[positions])
+        for column, _, positions, table in self._tables:
+            if column in codes:
+                effects[:, positions] = table[codes[column][block]]
+        return effects
+
+    def _combine(self, base, effects):
+        added = base + effects[:, self._adds].sum(axis=1)
+        products = np.cumprod(effects[:, self._multipliers], axis=1)
+        scores = added * products[:, -1] if len(self._multipliers) else added
+        matrix = np.zeros_like(effects)
+        matrix[:, self._adds] = effects[:, self._adds]
+        if len(self._multipliers):
+            # Each multiplier changes the score it finds: (base + adds) times the earlier multipliers
+            earlier = np.hstack([np.ones((len(base), 1)), products[:, :-1]])
+            matrix[:, self._multipliers] = added[:, None] * (products - earlier)
+        return scores, matrix
+
+def load_rules(path=None):
+    """
+    Rule set from a JSON file, loaded at most once per process. Defaults to
+    RISK_RULES_FILE; returns None when no file is configured.
+    """
+    path = path or RISK_RULES_FILE
+    if not path:
+        return None
+    if path not in _rules_cache:
+        _rules_cache[path] = RuleSet.from_file(path)
+    return _rules_cache[path]
+
+def _parse(rule, names):
+    # (name, column, multiply, effect) of a rule, validated
+    name = rule.get('name')
+    if not name or name in names:
+        raise ValueError(f"Every risk rule needs a unique name; got {name!r}.")
+    if 'column' not in rule:
+        raise ValueError(f"Risk rule '{name}' has no column.")
+    if 'multipliers' in rule or 'adds' in rule:
+        mapping = rule.get('multipliers', rule.get('adds'))
+        if ('multipliers' in rule) == ('adds' in rule) or not isinstance(mapping, dict):
+            raise ValueError(f"Risk rule '{name}' needs one object of either multipliers or adds.")
+        return name, rule['column'], 'multipliers' in rule, None
+    if ('add' in rule) == ('multiply' in rule):
+        raise ValueError(f"Risk rule '{name}' needs exactly one of add or multiply.")
+    if 'in' in rule:
+        if not isinstance(rule['in'], list):
+            raise ValueError(f"Risk rule '{name}' needs a list of values for in.")
+    elif rule.get('op') not in OPERATORS or 'value' not in rule:
+        raise ValueError(f"Risk rule '{name}' needs an op ({', '.join(OPERATORS)}) and a value, or in.")
+    multiply = 'multiply' in rule
+    return name, rule['column'], multiply, float(rule['multiply'] if multiply else rule['add'])
+
+def _comparison_group(column, op, positions, thresholds, effects, neutral):
+    # Rules comparing one column with one operator, thresholds sorted, and
+    # for ordering operators the sums of adds and products of multipliers
+    # over each prefix (> and >=) or suffix (< and <=) of the thresholds
+    order = np.argsort(thresholds, kind='stable')
+    positions, thresholds, effects = positions[order], thresholds[order], effects[order]
+    if op in ('==', '!='):
+        return column, op, positions, thresholds, effects, None
+    multiply = neutral[positions] == 1.0
+    adds, products = np.where(multiply, 0.0, effects), np.where(multiply, effects, 1.0)
+    if op in ('>', '>='):
+        cumulative = (np.append(0.0, np.cumsum(adds)), np.append(1.0, np.cumprod(products)))
+    else:
+        cumulative = (np.append(np.cumsum(adds[::-1])[::-1], 0.0), np.append(np.cumprod(products[::-1])[::-1], 1.0))
+    return column, op, positions, thresholds, effects, cumulative
+
+def _compare(op, values, thresholds, effects, neutral):
+    # Effect of each rule of a comparison group on each claim, by broadcasting
+    matches = OPERATORS[op](values[:, None], thresholds[None, :]) & ~np.isnan(values)[:, None]
+    return np.where(matches, effects, neutral)
+
+def _category_table(column, table, negated, neutral):
+    # Effects of a column's categorical rules per category, with a last row
+    # for values no rule lists: neutral, except for != rules
+    positions = sorted({position for effects in table.values() for position in effects} | set(negated))
+    index = pd.Index(list(table), dtype=object)
+    effects = np.tile(neutral[positions], (len(index) + 2, 1))
+    for i, value in enumerate(index):
+        for j, position in enumerate(positions):
+            if position in negated:
+                effects[i, j] = neutral[position] if negated[position][0] == value else negated[position][1]
+            elif position in table[value]:
+                effects[i, j] = table[value][position]
+    for j, position in enumerate(positions):
+        if position in negated:
+            effects[len(index), j] = negated[position][1]
+    # The very last row, for missing values, stays neutral
+    return column, index, np.array(positions), effects
+
+def _table_codes(series, index):
+    # Table row of each value; text is compared once per distinct value
+    codes, uniques = pd.factorize(series)
+    rows = index.get_indexer(pd.Index([_category_key(value) for value in uniques], dtype=object))
+    rows[rows == -1] = len(index)
+    # Missing values (code -1) take the neutral last row
+    return np.append(rows, len(index) + 1)[codes]
+
+def _category_key(value):
+    # Text a category is looked up by. Numbers are written one way, so a
+    # listed 1 or "1" matches a column read as 1.0, and 0.5 matches "0.50"
+    if isinstance(value, (bool, np.bool_)):
+        return str(value)
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if not np.isfinite(number):
+        return str(value)
+    if number.is_integer():
+        # Exact for integers written as text, however many digits they have
+        try:
+            return str(int(value))
+        except (TypeError, ValueError):
+            return str(int(number))
+    return repr(number)
+
+def _column(df, column, rows, claimant_store):
+    # Values of a rule column for the scored claims, or None when unavailable
+    if column in df.columns:
+        series = df[column]
+    elif column == 'claim_policy_ratio' and {'claim_amount', 'policy_amount'} <= set(df.columns):
+        series = pd.Series(_numeric(df['claim_amount']) / (_numeric(df['policy_amount']) + 1e-5), index=df.index)
+    elif column == 'claimant_claim_count' and 'claimant_id' in df.columns:
+        series = pd.Series(_claimant_counts(df, claimant_store), index=df.index)
+    else:
+        return None
+    return series if rows is None else series.iloc[rows]
+
+def _record_column(records, column, claimant_store):
+    # _column for claims given as dicts: a list of values, or None when unavailable
+    if any(column in record for record in records):
+        return [record.get(column) for record in records]
+    if column == 'claim_policy_ratio' and _record_column(records, 'claim_amount', None) is not None \
+            and _record_column(records, 'policy_amount', None) is not None:
+        return [_to_number(record.get('claim_amount')) / (_to_number(record.get('policy_amount')) + 1e-5)
+                for record in records]
+    if column == 'claimant_claim_count' and _record_column(records, 'claimant_id', None) is not None:
+        ids = [record.get('claimant_id') for record in records]
+        claimant_ids = np.array([_to_number(value) for value in ids], dtype=float)
+        if any(np.isnan(number) and not _missing(value) for number, value in zip(claimant_ids, ids)):
+            claimant_ids = text_claimant_ids(ids)
+        if claimant_store is not None:
+            return claimant_store.history_features(claimant_ids)['claimant_claim_count'].tolist()
+        return claim_counts(claimant_ids).tolist()
+    return None
+
+def _record_codes(values, table_rows):
+    # _table_codes for a list of values, given the table row of each category
+    unlisted = len(table_rows)
+    return np.array([unlisted + 1 if _missing(value) else table_rows.get(_category_key(value), unlisted)
+                     for value in values], dtype=np.int64)
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+def _to_number(value):
+    # A record value as _numeric reads it: NaN when missing or not a number
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _numeric(series):
+    # Text that is not a number compares as missing
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+def _claimant_counts(df, claimant_store):
+    claimant_ids = _numeric(df['claimant_id'])
+    if (np.isnan(claimant_ids) & df['claimant_id'].notna().to_numpy()).any():
+        # Text IDs, keyed as the feature pipeline keys them
+        claimant_ids = text_claimant_ids(df['claimant_id'])
+    if claimant_store is not None:
+        return claimant_store.history_features(claimant_ids)['claimant_claim_count']
+    return claim_counts(claimant_ids)
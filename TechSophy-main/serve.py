@@ -0,0 +1,157 @@
+import os
+import gc
+import sys
+import signal
+import socket
+import argparse
+from model_registry import get_artifact
+from streaming import score_csv_stream, DEFAULT_CHUNKSIZE
+from drift_monitor import print_drift
+
+# Entry points for short-lived scoring jobs and web workers. Everything they
+# import is needed to score; sklearn, scipy and Flask are loaded only by
+# the paths that use them, so a cron job or a fresh worker starts in a
+# fraction of the time the training entry points take.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 5000
+# Pending connections queued on the shared socket while every worker is busy
+LISTEN_BACKLOG = 128
+
+def load_serving_artifact(version=None, registry_dir=None):
+    """
+    The serving copy of an artifact: the feature pipeline and the flat
+    forest engine, memory-mapped, with no sklearn models to unpickle.
+    Args:
+        version (str): Artifact version. Defaults to the latest.
+        registry_dir (str): Registry directory. Defaults to REGISTRY_DIR.
+    """
+    artifact = get_artifact(version, registry_dir, serving=True)
+    if artifact is None:
+        raise ValueError("No trained model artifact found. Run 'python model_registry.py train <csv>' first.")
+    return artifact
+
+def score_file(input_path, output_path, artifact=None, chunksize=DEFAULT_CHUNKSIZE, monitor=None,
+               project_columns=False):
+    """
+    Score a claims file with the serving artifact, chunk by chunk as in
+    streaming.score_csv_stream, without importing sklearn.
+    Returns:
+        dict: Summary with the number of rows, flagged claims and chunks.
+    """
+    return score_csv_stream(input_path, output_path, artifact or load_serving_artifact(), chunksize=chunksize,
+                            monitor=monitor, project_columns=project_columns)
+
+def prefork(app, n_workers, host=DEFAULT_HOST, port=DEFAULT_PORT, preload=None):
+    """
+    Serve a WSGI app from n_workers forked worker processes sharing one
+    listening socket. preload runs once in the parent before forking, so
+    the model it loads is shared with every worker copy-on-write instead
+    of being loaded by each. Workers that exit are replaced; SIGTERM or
+    SIGINT stops them all. Needs os.fork, so not available on Windows.
+    Args:
+        app: WSGI application.
+        n_workers (int): Worker processes.
+        host (str): Address to listen on.
+        port (int): Port to listen on.
+        preload (callable): Loads whatever the workers share.
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("Pre-forked workers need os.fork, which this platform does not have.")
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(LISTEN_BACKLOG)
+    if preload is not None:
+        preload()
+    # Move everything loaded so far out of the collector's reach: a worker's
+    # garbage collections would otherwise write to, and so copy, the pages
+    # holding the shared objects
+    gc.collect()
+    gc.freeze()
+
+    workers = set()
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        # A copy, as the main loop may be reaping a worker when the signal arrives
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(n_workers):
+        workers.add(_fork_worker(app, host, port, listener))
+    while workers:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            workers.add(_fork_worker(app, host, port, listener))
+    listener.close()
+
+def share_job_workers(job_queue, n_workers):
+    """
+    Split the cores between the upload job pools of n_workers web workers.
+    Each worker starts its own pool, which by default has one process per
+    core; together they now have about one per core. An explicit
+    FRAUD_JOB_WORKERS is kept as the size of each worker's pool.
+    Args:
+        job_queue (JobQueue): The web app's queue, before any worker forks.
+        n_workers (int): Web worker processes.
+    """
+    if not os.environ.get('FRAUD_JOB_WORKERS'):
+        job_queue.max_workers = max(1, (os.cpu_count() or 1) // n_workers)
+
+def _fork_worker(app, host, port, listener):
+    pid = os.fork()
+    if pid:
+        return pid
+    # Worker: default signal handling, then serve until terminated
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from werkzeug.serving import make_server
+    try:
+        make_server(host, port, app, fd=listener.fileno()).serve_forever()
+    finally:
+        os._exit(0)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fast-starting scoring with the registered serving model.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    score = commands.add_parser('score', help="Score a claims file without loading sklearn.")
+    score.add_argument('input', help="Claims CSV, Parquet or Arrow file.")
+    score.add_argument('output', help="Scored file to write.")
+    score.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="Rows scored at a time.")
+    score.add_argument('--model-version', default=None, help="Artifact version (default: latest).")
+    score.add_argument('--project-columns', action='store_true',
+                       help="Read and write only the columns the model uses.")
+    web = commands.add_parser('web', help="Run the web app in pre-forked worker processes.")
+    web.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes (default: one per core).")
+    web.add_argument('--host', default=DEFAULT_HOST)
+    web.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+
+    if args.command == 'score':
+        artifact = load_serving_artifact(args.model_version)
+        monitor = artifact.drift_monitor()
+        summary = score_file(args.input, args.output, artifact, args.chunksize, monitor, args.project_columns)
+        print(f"Scored {summary['rows']} claims in {summary['chunks']} chunks; flagged {summary['flagged']}.")
+        if monitor is not None:
+            print_drift(monitor.report())
+    else:
+        import web_app
+        share_job_workers(web_app.job_queue, args.workers)
+        print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers")
+        prefork(web_app.app, args.workers, args.host, args.port, preload=web_app.serving_artifact)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
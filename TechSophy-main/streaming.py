@@ -0,0 +1,131 @@
+import os
+import sys
+import numpy as np
+from data_processing import iter_chunks, file_format, DataWriter, FILE_FORMATS
+from model_registry import get_artifact
+from main import combine_predictions
+from parallel_scoring import ScoringPool
+from investigation_priority import InvestigationQueue
+from instrumentation import pipeline_run
+from drift_monitor import print_drift
+from risk_rules import load_rules
+
+DEFAULT_CHUNKSIZE = 50000
+
+def score_chunks(input_path, artifact, chunksize=DEFAULT_CHUNKSIZE, update_history=False, columns=None, monitor=None,
+                 anomaly_col=None):
+    """
+    Read a claims file in chunks and yield each chunk with its predictions.
+    Args:
+        input_path (str): Path to the claims CSV, Parquet or Arrow file.
+        artifact (ModelArtifact): Pre-fitted artifact, or a ScoringPool
+            wrapping one, to score with.
+        chunksize (int): Number of rows read and scored at a time.
+        update_history (bool): Add each scored chunk to the artifact's
+            claimant history so claimant features of later chunks include
+            earlier ones.
+        columns (list): Optional columns to read; see load_data.
+        monitor (DriftMonitor): Optional monitor each chunk's raw claims
+            are added to before scoring.
+        anomaly_col (str): Optional column to add the anomaly scores as,
+            for callers that apply the decision policy to the whole file.
+    Returns:
+        iterator: pd.DataFrame chunks with fraud_predicted and
+            fraud_confidence columns added. fraud_predicted follows the
+            artifact's decision policy; a flag budget applies per chunk.
+    """
+    policy = artifact.decision_policy()
+    for chunk in iter_chunks(input_path, chunksize, columns=columns):
+        if monitor is not None:
+            monitor.update(chunk)
+        _, fraud_confidence, _, anomaly_scores = artifact.score(chunk, update_history=update_history)
+        chunk['fraud_predicted'] = combine_predictions(fraud_confidence, anomaly_scores, policy)
+        chunk['fraud_confidence'] = fraud_confidence
+        if anomaly_col is not None:
+            chunk[anomaly_col] = anomaly_scores
+        yield chunk
+
+@pipeline_run('score_csv_stream')
+def score_csv_stream(input_path, output_path, artifact=None, chunksize=DEFAULT_CHUNKSIZE, progress=None,
+                     update_history=False, n_workers=None, queue=None, monitor=None, project_columns=False):
+    """
+    Score a claims file chunk by chunk with a pre-fitted artifact, appending
+    the scored rows to output_path as they are produced. Peak memory is
+    bounded by chunksize rather than by the size of the input file. Every
+    input column is written back alongside the predictions.
+    Args:
+        input_path (str): Path to the claims CSV, Parquet or Arrow file.
+        output_path (str): Path of the scored file to write. Its extension
+            picks CSV, Parquet or Arrow; without a known extension the
+            output has the input's format.
+        artifact (ModelArtifact): Artifact to score with. Defaults to the
+            latest artifact in the model registry.
+        chunksize (int): Number of rows read and scored at a time.
+        progress (callable): Optional callback receiving the running summary
+            dict after each chunk.
+        update_history (bool): See score_chunks.
+        n_workers (int): When above 1, each chunk is split across a pool of
+            this many worker processes, started once for the whole file.
+        queue (InvestigationQueue): Optional queue the flagged claims of
+            each chunk are pushed to, leaving the highest priority claims
+            of the whole file in it.
+        monitor (DriftMonitor): Optional monitor the file's claims are added
+            to; see ModelArtifact.drift_monitor.
+        project_columns (bool): Read, and so write back, only the columns
+            the artifact's pipeline reads. Faster on wide files, but other
+            columns such as notes or external IDs are left out of the output.
+    Returns:
+        dict: Summary with the number of rows, flagged claims and chunks.
+    """
+    if artifact is None:
+        artifact = get_artifact()
+        if artifact is None:
+            raise ValueError("No trained model artifact found. Run 'python model_registry.py train <csv>' first.")
+    summary = {'rows': 0, 'flagged': 0, 'chunks': 0}
+    # Write to a temporary file so a failed run never leaves a partial output
+    tmp_path = output_path + '.part'
+    has_extension = os.path.splitext(output_path)[1].lower() in FILE_FORMATS
+    writer = DataWriter(tmp_path, file_format(output_path if has_extension else input_path))
+    scorer = ScoringPool(artifact, n_workers, min_rows=0) if n_workers and n_workers > 1 else artifact
+    try:
+        columns = artifact.pipeline.input_columns() if project_columns else None
+        for chunk in score_chunks(input_path, scorer, chunksize, update_history, columns, monitor):
+            writer.write(chunk)
+            summary['rows'] += len(chunk)
+            summary['flagged'] += int(chunk['fraud_predicted'].sum())
+            summary['chunks'] += 1
+            if queue is not None:
+                queue.push_batch(chunk, np.flatnonzero(chunk['fraud_predicted'].to_numpy() == 1))
+            if progress is not None:
+                progress(dict(summary))
+        writer.close()
+        if summary['chunks'] == 0:
+            open(tmp_path, 'w').close()
+        os.replace(tmp_path, output_path)
+    finally:
+        writer.close()
+        if scorer is not artifact:
+            scorer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return summary
+
+if __name__ == "__main__":
+    project_columns = '--project-columns' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--project-columns']
+    if len(args) not in (2, 3, 4):
+        print("Usage: python streaming.py [--project-columns] <input_file> <output_file> [chunksize] [n_workers]")
+    else:
+        chunksize = int(args[2]) if len(args) >= 3 else DEFAULT_CHUNKSIZE
+        n_workers = int(args[3]) if len(args) == 4 else None
+        artifact = get_artifact()
+        claimant_store = artifact.pipeline.claimant_store if artifact is not None else None
+        queue = InvestigationQueue(10, rules=load_rules(), claimant_store=claimant_store)
+        monitor = artifact.drift_monitor() if artifact is not None else None
+        summary = score_csv_stream(args[0], args[1], artifact, chunksize=chunksize, n_workers=n_workers,
+                                   queue=queue, monitor=monitor, project_columns=project_columns)
+        print(f"Scored {summary['rows']} claims in {summary['chunks']} chunks; flagged {summary['flagged']}.")
+        if monitor is not None:
+            print_drift(monitor.report())
+        print("\nTop claims prioritized for investigation:")
+        print(queue.top())
@@ -0,0 +1,95 @@
+import sys
+import numpy as np
+import pandas as pd
+
+BASE_CLAIM_TYPES = ['Theft', 'Accident', 'Fire', 'Flood', 'Liability', 'Vandalism', 'Medical', 'Storm']
+INCIDENT_TYPES = {
+    'Theft': 'Robbery', 'Accident': 'Collision', 'Fire': 'House Fire', 'Flood': 'Water Damage',
+    'Liability': 'Injury', 'Vandalism': 'Property Damage', 'Medical': 'Hospitalization', 'Storm': 'Wind Damage',
+}
+
+def claim_type_names(n_claim_types):
+    """
+    The first n_claim_types claim type names, extending the real ones with
+    numbered types when more are requested.
+    """
+    names = BASE_CLAIM_TYPES[:n_claim_types]
+    names += [f"Type{i}" for i in range(len(names), n_claim_types)]
+    return names
+
+def generate_claims(n_rows, n_claimants=None, n_claim_types=5, fraud_rate=0.1, missing_rate=0.01,
+                    seed=42, start_claim_id=1, start_date='2023-01-01', days=365):
+    """
+    Generate synthetic insurance claims with the same schema as the shipped
+    sample files. Fraudulent claims tend to claim a larger share of the
+    policy amount, so the models have some signal to learn.
+    Args:
+        n_rows (int): Number of claims.
+        n_claimants (int): Number of distinct claimants. Defaults to n_rows // 3.
+        n_claim_types (int): Number of distinct claim types.
+        fraud_rate (float): Fraction of claims with fraud_reported 'Y'.
+        missing_rate (float): Fraction of claim_amount and claim_type values left empty.
+        seed (int): Random seed; the same arguments always give the same claims.
+        start_claim_id (int): claim_id of the first row.
+        start_date (str): Earliest claim date.
+        days (int): Number of days claim dates are spread over.
+    Returns:
+        pd.DataFrame: Claims with claim_id, claimant_id, claim_amount,
+            policy_amount, claim_date, claim_type, incident_type and
+            fraud_reported columns.
+    """
+    rng = np.random.default_rng(seed)
+    n_claimants = n_claimants or max(1, n_rows // 3)
+    types = np.array(claim_type_names(n_claim_types), dtype=object)
+    incidents = np.array([INCIDENT_TYPES.get(t, f"{t} Incident") for t in types], dtype=object)
+
+    fraud = rng.random(n_rows) < fraud_rate
+    policy_amount = rng.choice([5000, 7000, 10000, 12000, 15000, 18000, 25000], size=n_rows)
+    ratio = np.where(fraud, rng.uniform(0.6, 1.0, n_rows), rng.beta(2, 5, n_rows))
+    claim_amount = np.round(policy_amount * ratio, -2)
+    type_codes = rng.integers(0, n_claim_types, n_rows)
+    claim_dates = np.datetime64(start_date) + rng.integers(0, days, n_rows).astype('timedelta64[D]')
+
+    data = pd.DataFrame({
+        'claim_id': np.arange(start_claim_id, start_claim_id + n_rows),
+        'claimant_id': 1000 + rng.integers(0, n_claimants, n_rows),
+        'claim_amount': claim_amount,
+        'policy_amount': policy_amount,
+        'claim_date': np.datetime_as_string(claim_dates, unit='D'),
+        'claim_type': types[type_codes],
+        'incident_type': incidents[type_codes],
+        'fraud_reported': np.where(fraud, 'Y', 'N'),
+    })
+    if missing_rate:
+        data.loc[rng.random(n_rows) < missing_rate, 'claim_amount'] = np.nan
+        data.loc[rng.random(n_rows) < missing_rate, 'claim_type'] = None
+    return data
+
+def write_claims_csv(file_path, n_rows, chunk_rows=1000000, seed=42, **kwargs):
+    """
+    Write synthetic claims to a CSV file in chunks so that files with tens of
+    millions of rows can be generated in bounded memory. Each chunk uses a
+    seed derived from seed and its position, so output is reproducible.
+    Args:
+        file_path (str): Output CSV path.
+        n_rows (int): Total number of claims.
+        chunk_rows (int): Claims generated per chunk.
+        seed (int): Base random seed.
+        **kwargs: Passed to generate_claims. n_claimants defaults to
+            n_rows // 3 of the whole file, not of each chunk.
+    """
+    kwargs.setdefault('n_claimants', max(1, n_rows // 3))
+    written = 0
+    chunk_index = 0
+    while written < n_rows or chunk_index == 0:
+        size = min(chunk_rows, n_rows - written)
+        chunk = generate_claims(size, seed=seed + chunk_index, start_claim_id=written + 1, **kwargs)
+        chunk.to_csv(file_path, mode='w' if chunk_index == 0 else 'a', header=chunk_index == 0, index=False)
+        written += size
+        chunk_index += 1
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python synthetic_data.py <output_csv> <n_rows>")
+    else:
+        write_claims_csv(sys.argv[1], int(sys.argv[2]))
@@ -1,10 +1,27 @@
 import pandas as pd
 import numpy as np
-from data_processing import load_data, preprocess_data
+import os
+import warnings
+import tempfile
+# Metric snapshots of the suite's processes stay out of the working tree
+os.environ.setdefault('FRAUD_METRICS_DIR', tempfile.mkdtemp(prefix='fraud_metrics_'))
+from data_processing import load_data, preprocess_data, ClaimsPreprocessor, iter_chunks, save_data
 from feature_extraction import extract_features
 from anomaly_detection import AnomalyDetection
 from fraud_detection import FraudDetectionModel
-from investigation_priority import prioritize_investigations
+from investigation_priority import prioritize_investigations, InvestigationQueue
+from streaming import score_csv_stream
+from result_store import ResultStore
+from job_queue import JobQueue
+from result_cache import ResultCache
+from instrumentation import METRICS, pipeline_run, stage
+from synthetic_data import generate_claims
+from claimant_store import ClaimantAggregateStore, NO_HISTORY
+from feature_extraction import FeaturePipeline
+from model_registry import train_artifact, save_artifact, load_artifact, get_artifact, list_versions
+from parallel_scoring import ScoringPool
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_insurance_claims.csv')
 
 def test_missing_values():
     print("Testing missing values handling...")
@@ -20,6 +37,10 @@ def test_missing_values():
     })
     processed = preprocess_data(data)
     assert not processed.isnull().any().any(), "Missing values not handled properly"
+    assert data['claim_amount'].isna().any(), "Caller's frame modified"
+    owned = data.copy()
+    assert preprocess_data(owned, inplace=True).equals(processed), "In-place preprocessing differs"
+    assert not owned.isnull().any().any(), "Owned frame not filled in place"
     print("Missing values test passed.")
 
 def test_unexpected_feature_columns():
@@ -72,9 +93,961 @@ def test_prioritization_with_edge_scores():
     assert prioritized.iloc[0]['fraud_confidence'] == 1.0, "Prioritization sorting failed"
     print("Prioritization test passed.")
 
+def test_top_k_investigation_queue():
+    print("Testing top-k prioritization and the investigation queue...")
+    rng = np.random.default_rng(3)
+    flagged = pd.DataFrame({
+        'claim_id': np.arange(1000),
+        'fraud_confidence': np.round(rng.random(1000), 2),
+        'prior_claims': rng.integers(0, 3, 1000),
+        'late_report': rng.integers(0, 2, 1000),
+    })
+    risk_factors = {'prior_claims': 0.1, 'late_report': 0.05, 'not_a_column': 9.0}
+    full = prioritize_investigations(flagged, risk_factors=risk_factors)
+    expected = flagged['fraud_confidence'] + 0.1 * flagged['prior_claims'] + 0.05 * flagged['late_report']
+    assert np.allclose(full['investigation_score'], expected.sort_values(ascending=False, kind='stable')), "Weighted scores wrong"
+    top = prioritize_investigations(flagged, risk_factors=risk_factors, top_k=25)
+    assert top['claim_id'].tolist() == full['claim_id'].head(25).tolist(), "top_k differs from the full ranking"
+
+    queue = InvestigationQueue(25, risk_factors=risk_factors)
+    for start in range(0, 1000, 128):
+        queue.push_batch(flagged.iloc[start:start + 128])
+    assert len(queue) == 25, "Queue not bounded"
+    assert queue.top()['claim_id'].tolist() == full['claim_id'].head(25).tolist(), "Queue differs from the full ranking"
+    assert queue.top(5)['claim_id'].tolist() == full['claim_id'].head(5).tolist(), "Partial fetch wrong"
+    print("Top-k investigation queue test passed.")
+
+def test_risk_rule_engine():
+    print("Testing the configurable risk rule engine...")
+    import json
+    import tempfile
+    from risk_rules import RuleSet, load_rules
+    from main import score_claims
+    rng = np.random.default_rng(5)
+    n = 3000
+    claims = pd.DataFrame({
+        'claim_id': np.arange(n),
+        'claim_amount': rng.uniform(100, 20000, n),
+        'policy_amount': rng.uniform(5000, 20000, n),
+        'claim_type': rng.choice(['Theft', 'Fire', 'Collision', None], n),
+        'claimant_id': rng.integers(0, 800, n),
+        'fraud_confidence': rng.random(n),
+    })
+    claims.loc[::50, 'claim_amount'] = np.nan
+    rules = [
+        {'name': 'near_limit', 'column': 'claim_policy_ratio', 'op': '>=', 'value': 0.9, 'add': 0.2},
+        {'name': 'over_limit', 'column': 'claim_policy_ratio', 'op': '>', 'value': 1.0, 'add': 0.1},
+        {'name': 'small', 'column': 'claim_amount', 'op': '<', 'value': 1000, 'multiply': 0.5},
+        {'name': 'type_weight', 'column': 'claim_type', 'multipliers': {'Theft': 1.3, 'Fire': 1.1}},
+        {'name': 'not_collision', 'column': 'claim_type', 'op': '!=', 'value': 'Collision', 'add': 0.05},
+        {'name': 'repeat', 'column': 'claimant_claim_count', 'op': '>=', 'value': 6, 'multiply': 1.5},
+        {'name': 'no_column', 'column': 'not_a_column', 'op': '>', 'value': 0, 'add': 9.0},
+    ]
+    rule_set = RuleSet(rules)
+
+    # The same rules applied claim by claim
+    ratio = claims['claim_amount'] / (claims['policy_amount'] + 1e-5)
+    repeats = claims.groupby('claimant_id')['claim_id'].transform('count')
+    added = 0.2 * (ratio >= 0.9) + 0.1 * (ratio > 1.0) + 0.05 * (claims['claim_type'].notna() & (claims['claim_type'] != 'Collision'))
+    multiplied = (np.where(claims['claim_amount'] < 1000, 0.5, 1.0)
+                  * claims['claim_type'].map({'Theft': 1.3, 'Fire': 1.1}).fillna(1.0) * np.where(repeats >= 6, 1.5, 1.0))
+    expected = (claims['fraud_confidence'] + added).to_numpy() * multiplied.to_numpy()
+    scores = rule_set.score(claims, claims['fraud_confidence'].to_numpy())
+    assert np.allclose(scores, expected), "Rule scores differ from applying the rules claim by claim"
+    matrix_scores, contributions = rule_set.contributions(claims, claims['fraud_confidence'].to_numpy())
+    assert np.allclose(matrix_scores, scores), "Contribution path scores differently"
+    assert np.allclose(contributions.sum(axis=1), scores - claims['fraud_confidence']), "Contributions do not add up"
+    assert not contributions[:, -1].any(), "Rule on a missing column matched"
+    rows = np.arange(0, n, 7)
+    assert np.allclose(rule_set.score(claims, claims['fraud_confidence'].to_numpy()[rows], rows), scores[rows]), "Row subset wrong"
+
+    for bad in ({'name': 'x', 'column': 'a', 'op': '~', 'value': 1, 'add': 1},
+                {'name': 'x', 'column': 'a', 'op': '>', 'value': 1, 'add': 1, 'multiply': 2},
+                {'name': 'x', 'column': 'a', 'op': '>', 'value': 'text', 'add': 1}):
+        try:
+            RuleSet([bad])
+        except ValueError:
+            continue
+        raise AssertionError(f"Invalid rule accepted: {bad}")
+
+    prioritized = prioritize_investigations(claims, top_k=20, rules=rule_set)
+    assert np.allclose(prioritized['investigation_score'], np.sort(scores)[::-1][:20]), "Rules not used to rank"
+    first = contributions[prioritized.index[0]]
+    assert prioritized['rule_contributions'].iloc[0] == rule_set.explain(first[None, :])[0], "Contributions not explained"
+    queue = InvestigationQueue(20, rules=rule_set)
+    queue.push_batch(claims)
+    assert queue.top()['claim_id'].tolist() == prioritized['claim_id'].tolist(), "Queue ignores the rules"
+    # Claimant history counts in the queue as in prioritize_investigations, over the whole batch
+    store = ClaimantAggregateStore()
+    store.update(np.repeat(np.arange(0, 800, 3), 4))
+    flagged = np.flatnonzero(claims['fraud_confidence'].to_numpy() > 0.5)
+    expected = prioritize_investigations(claims, top_k=20, rows=flagged, rules=rule_set, claimant_store=store)
+    queue = InvestigationQueue(20, rules=rule_set, claimant_store=store)
+    queue.push_batch(claims, rows=flagged)
+    assert queue.top()['claim_id'].tolist() == expected['claim_id'].tolist(), "Queue ignores claimant history"
+    assert queue.top()['rule_contributions'].tolist() == expected['rule_contributions'].tolist(), "Queue explains differently"
+
+    # Claims given as dicts score as the same claims in a DataFrame
+    sample = claims.iloc[:40].astype(object).where(claims.iloc[:40].notna(), None)
+    records = [{key: value for key, value in record.items() if value is not None or key != 'claim_type'}
+               for record in sample.to_dict('records')]
+    for claimant_store in (None, store):
+        expected = rule_set.contributions(pd.DataFrame.from_records(records), sample['fraud_confidence'].to_numpy(float),
+                                          claimant_store=claimant_store)
+        got = rule_set.contributions_records(records, sample['fraud_confidence'].to_numpy(float), claimant_store)
+        assert np.allclose(got[0], expected[0]) and np.allclose(got[1], expected[1]), "Record rules differ"
+
+    # Numeric categories match however the rule and the column write them
+    numeric_rules = RuleSet([{'name': 'tier', 'column': 'tier', 'in': [1, '2.50'], 'add': 0.1},
+                             {'name': 'tier_weight', 'column': 'tier', 'multipliers': {'3': 2.0}},
+                             {'name': 'not_one', 'column': 'tier', 'op': '!=', 'value': '1', 'add': 1.0}])
+    for tier in (pd.Series([1.0, 2.5, 3.0, np.nan, 4.0]), pd.Series(['1', '2.5', '3.0', None, '4'])):
+        scores = numeric_rules.score(pd.DataFrame({'tier': tier}), np.ones(5))
+        assert np.allclose(scores, [1.1, 2.1, 4.0, 1.0, 2.0]), f"Numeric categories not matched: {scores}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rules_path = os.path.join(tmp_dir, 'rules.json')
+        with open(rules_path, 'w') as f:
+            json.dump({'rules': rules}, f)
+        loaded = load_rules(rules_path)
+        assert loaded.names == rule_set.names and load_rules(rules_path) is loaded, "Rule file not loaded once"
+        data = generate_claims(600, fraud_rate=0.2, seed=9)
+        data_path = os.path.join(tmp_dir, 'claims.csv')
+        data.to_csv(data_path, index=False)
+        artifact = train_artifact(data, n_estimators=20)
+        _, plain, _, _ = score_claims(data_path, artifact=artifact)
+        _, ruled, _, num_flagged = score_claims(data_path, artifact=artifact, rules=loaded)
+        assert len(ruled) == num_flagged == len(plain), "Rules changed which claims are flagged"
+        assert 'rule_contributions' in ruled.columns and 'rule_contributions' not in plain.columns, "Contributions missing"
+    print("Risk rule engine test passed.")
+
+def test_model_artifact_round_trip():
+    print("Testing model artifact save, load and scoring...")
+    import tempfile
+    train = load_data(SAMPLE_CSV)
+    artifact = train_artifact(train)
+    with tempfile.TemporaryDirectory() as registry_dir:
+        save_artifact(artifact, registry_dir)
+        assert list_versions(registry_dir) == [artifact.version], "Artifact version not registered"
+        loaded = load_artifact(registry_dir=registry_dir)
+        assert get_artifact(registry_dir=registry_dir) is get_artifact(registry_dir=registry_dir), "Artifact reloaded within process"
+    # Unlabeled batch with an unseen category must still score with the trained layout
+    new_claims = pd.DataFrame({
+        'claim_id': [100],
+        'claimant_id': [2001],
+        'claim_amount': [None],
+        'policy_amount': [8000],
+        'claim_type': ['Flood'],
+        'incident_type': ['Storm']
+    })
+    preds, conf, anomaly_flags, _ = loaded.score(new_claims)
+    assert len(preds) == len(conf) == len(anomaly_flags) == 1, "Scoring length mismatch"
+    expected_preds = artifact.score(train)[0]
+    loaded_preds = loaded.score(train)[0]
+    assert (expected_preds == loaded_preds).all(), "Loaded artifact scores differently"
+    print("Model artifact test passed.")
+
+def test_fitted_preprocessor_fixed_layout():
+    print("Testing fitted preprocessor layout across batches...")
+    train = pd.DataFrame({
+        'claim_amount': [1000, None, 3000],
+        'claim_type': ['Theft', 'Fire', None],
+        'fraud_reported': ['Y', 'N', 'N']
+    })
+    preprocessor = ClaimsPreprocessor(exclude=['fraud_reported']).fit(train)
+    assert preprocessor.feature_names_ == ['claim_amount', 'claim_type_Fire', 'claim_type_Theft', 'claim_type___unknown'], "Unexpected layout"
+    batch = pd.DataFrame({'claim_amount': [None, 500], 'claim_type': ['Flood', None]})
+    X = preprocessor.transform(batch)
+    assert X.shape == (2, len(preprocessor.feature_names_)), "Batch width depends on batch contents"
+    assert X[0, 0] == 2000, "Missing numeric value not filled with training median"
+    assert X[0, 3] == 1 and X[0, 1:3].sum() == 0, "Unseen category not mapped to reserved bucket"
+    assert X[1, 1:].sum() == 1, "Missing category not filled with training mode"
+    empty = preprocessor.transform(pd.DataFrame({'other': [1]}))
+    assert empty.shape == (1, 4), "Missing columns changed the layout"
+    print("Fitted preprocessor test passed.")
+
+def test_cardinality_based_encoding():
+    print("Testing cardinality-based encoding...")
+    claims = generate_claims(2000, n_claimants=500, seed=5)
+    claims['policy_number'] = 'P' + claims['claimant_id'].astype(str)
+    labels = claims['fraud_reported'].map({'Y': 1, 'N': 0})
+    for encoder, width in (('frequency', 1), ('hash', 8), ('target', 1)):
+        preprocessor = ClaimsPreprocessor(exclude=['fraud_reported'], high_cardinality=encoder, hash_buckets=8)
+        X = preprocessor.fit_transform(claims, labels)
+        assert preprocessor.encoders_ == {'claim_type': 'onehot', 'incident_type': 'onehot', 'policy_number': encoder}, "Wrong encoder choice"
+        assert preprocessor.date_columns_ == ['claim_date'], "Date column not detected"
+        assert X.shape[1] == 4 + 3 + 2 * 6 + width, "Layout width grows with cardinality"
+        batch = claims.iloc[:20].copy()
+        batch.loc[batch.index[0], 'policy_number'] = 'P-unseen'
+        batch.loc[batch.index[1], 'claim_date'] = None
+        records = batch.to_dict('records')
+        assert np.allclose(preprocessor.transform(batch), preprocessor.transform_records(records)), "Records encoded differently"
+    days = preprocessor.feature_names_.index('claim_date_days')
+    first = pd.Timestamp(claims['claim_date'].iloc[0])
+    assert X[0, days] == (first - pd.Timestamp(0)).days and X[0, days + 1] == first.month and X[0, days + 2] == first.dayofweek, "Date features wrong"
+    onehot = ClaimsPreprocessor(exclude=['fraud_reported'], encoding='onehot').fit(claims)
+    assert len(onehot.feature_names_) > 500, "onehot mode should keep one column per value"
+    print("Cardinality-based encoding test passed.")
+
+def test_flat_forest_engine_matches_sklearn():
+    print("Testing the flat-array forest engine...")
+    import tempfile
+    from forest_engine import ForestEngine
+    claims = generate_claims(3000, n_claimants=300, seed=21)
+    artifact = train_artifact(claims, n_estimators=25)
+    X = artifact.pipeline.transform(generate_claims(800, n_claimants=300, seed=22))
+    X[::7, 1] = np.nan
+    engine = ForestEngine.from_models(artifact.anomaly_detector, artifact.fraud_model)
+    for got, want in zip(engine.predict_fraud(X) + engine.score_anomaly(X),
+                         artifact.fraud_model.predict(X) + artifact.anomaly_detector.score(X)):
+        assert np.array_equal(got, want), "Engine output differs from sklearn"
+    # Under an unsupported scikit-learn release, anomalies are scored by sklearn
+    import forest_engine
+    supported = forest_engine.SKLEARN_SUPPORTED
+    forest_engine.SKLEARN_SUPPORTED = ((0, 1), (0, 2))
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            fallback = ForestEngine.from_models(artifact.anomaly_detector, artifact.fraud_model)
+    finally:
+        forest_engine.SKLEARN_SUPPORTED = supported
+    assert fallback.isolation is None and caught, "Unsupported release not detected"
+    for got, want in zip(fallback.score_anomaly(X), artifact.anomaly_detector.score(X)):
+        assert np.array_equal(got, want), "Fallback scores differ from sklearn"
+    with tempfile.TemporaryDirectory() as registry_dir:
+        save_artifact(artifact, registry_dir)
+        assert list_versions(registry_dir) == [artifact.version], "Serving copy listed as a version"
+        serving = load_artifact(registry_dir=registry_dir, serving=True)
+        assert serving.fraud_model is None and serving.engine is not None, "Serving copy carries sklearn models"
+        for got, want in zip(serving.score(claims.head(50)), artifact.score(claims.head(50))):
+            assert np.array_equal(got, want), "Serving copy scores differently"
+        del serving
+    print("Flat forest engine test passed.")
+
+def test_incremental_model_update():
+    print("Testing incremental model updates...")
+    from model_registry import update_artifact
+    claims = generate_claims(2000, n_claimants=200, seed=41)
+    artifact = train_artifact(claims, n_estimators=20)
+    artifact.anomaly_detector.window = 2500
+    first_trees = list(artifact.fraud_model.model.estimators_)
+    new_claims = generate_claims(1000, n_claimants=200, seed=42, start_claim_id=5001)
+    updated = update_artifact(artifact, new_claims, n_new_trees=5, max_estimators=22)
+    forest = updated.fraud_model.model
+    assert artifact.fraud_model.model.estimators_ == first_trees, "Original artifact modified"
+    assert forest.n_estimators == len(forest.estimators_) == 22, "Oldest trees not retired"
+    assert updated.version != artifact.version and updated.metadata['parent_version'] == artifact.version, "Not a new version"
+    assert len(updated.anomaly_detector.reference_) == 2500, "Reference window not bounded"
+    assert updated.pipeline.claimant_store.lookup(new_claims['claimant_id'].iloc[0])[0] > \
+        artifact.pipeline.claimant_store.lookup(new_claims['claimant_id'].iloc[0])[0], "Claimant history not updated"
+    X = updated.pipeline.transform(new_claims)
+    for got, want in zip(updated.engine.predict_fraud(X), updated.fraud_model.predict(X)):
+        assert np.array_equal(got, want), "Engine not recompiled after update"
+    assert not updated.metadata['decision_policy_reset'], "Default policy reported as reset"
+    # A policy calibrated on the old anomaly scores does not carry over
+    from decision_policy import DecisionPolicy
+    artifact.metadata['decision_policy'] = dict(artifact.decision_policy().to_dict(), anomaly_threshold=-0.1)
+    recalibrate = update_artifact(artifact, new_claims, n_new_trees=5)
+    assert recalibrate.metadata['decision_policy_reset'] and 'decision_policy' not in recalibrate.metadata, \
+        "Stale decision policy kept"
+    assert recalibrate.decision_policy().to_dict() == \
+        DecisionPolicy.default(recalibrate.anomaly_detector.model.offset_).to_dict(), "Not the default policy"
+    try:
+        update_artifact(updated, new_claims.assign(fraud_reported='N'))
+        assert False, "Single-class batch accepted"
+    except ValueError:
+        pass
+    print("Incremental model update test passed.")
+
+def test_cross_validated_evaluation():
+    print("Testing cross-validated metrics stored in the artifact...")
+    import json
+    import tempfile
+    from evaluation import out_of_fold_predictions
+    from model_registry import update_artifact
+    from main import score_claims
+    claims = generate_claims(1500, n_claimants=300, seed=51)
+    artifact = train_artifact(claims, n_estimators=20, cv_folds=3)
+    evaluation = artifact.metadata['evaluation']
+    json.dumps(artifact.metadata['holdout_report'])
+    json.dumps(evaluation)
+    assert evaluation['method'] == '3-fold cross-validation' and evaluation['rows'] == len(claims), "Wrong CV setup"
+    assert sum(fold['rows'] for fold in evaluation['per_fold']) == len(claims), "Folds do not cover the claims"
+    assert 0 < evaluation['pr_auc'] <= 1 and artifact.evaluation_report() is evaluation['report'], "Bad metrics"
+    recalls = [point['recall'] for point in evaluation['threshold_sweep']]
+    assert recalls == sorted(recalls, reverse=True), "Recall should fall as the threshold rises"
+    serial = out_of_fold_predictions(claims, n_splits=3, n_estimators=10)
+    parallel = out_of_fold_predictions(claims, n_splits=3, n_estimators=10, n_jobs=2)
+    assert np.array_equal(serial['fraud_proba'], parallel['fraud_proba']), "Parallel folds differ from serial"
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = os.path.join(data_dir, 'claims.csv')
+        save_data(generate_claims(300, seed=52).drop(columns=['fraud_reported']), path)
+        _, _, report, _ = score_claims(path, artifact)
+    assert report is evaluation['report'], "Scoring should read the stored metrics"
+    updated = update_artifact(artifact, generate_claims(500, seed=53, start_claim_id=5001), n_new_trees=5)
+    assert updated.evaluation_report() is None, "Stale evaluation carried over to an updated model"
+    # Small files are cross-validated over fewer folds, or not at all
+    fraud, legit = claims[claims['fraud_reported'] == 'Y'], claims[claims['fraud_reported'] == 'N']
+    small = train_artifact(pd.concat([fraud.head(3), legit.head(10)]), n_estimators=10, cv_folds=5)
+    assert small.metadata['evaluation']['method'] == '3-fold cross-validation', "Folds not lowered"
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        tiny = train_artifact(pd.concat([fraud.head(1), legit.head(10)]), n_estimators=10, cv_folds=5)
+    assert 'evaluation' not in tiny.metadata and tiny.metadata['holdout_report'], "Hold-out report not kept"
+    assert any('cross-validate' in str(w.message) for w in caught), "Skipped cross-validation not warned"
+    print("Cross-validated evaluation test passed.")
+
+def test_calibrated_decision_policy():
+    print("Testing calibrated decision thresholds and the flag budget...")
+    from decision_policy import DecisionPolicy, BUDGET_MIN_ROWS
+    from evaluation import out_of_fold_predictions, calibrate_policy, precision_recall
+    claims = generate_claims(1500, n_claimants=300, seed=61)
+    plain = train_artifact(claims, n_estimators=20)
+    fraud_preds, fraud_confidence, anomaly_flags, anomaly_scores = plain.score(claims)
+    legacy = ((fraud_preds == 1) | (anomaly_flags == 1)).astype(int)
+    assert np.array_equal(plain.decision_policy().flag(fraud_confidence, anomaly_scores), legacy), \
+        "Default policy differs from the predict-based rule"
+
+    policy = DecisionPolicy(0.75, 0.25, budget=0.02)
+    flags = policy.flag(fraud_confidence, anomaly_scores)
+    risk = policy.risk(fraud_confidence, anomaly_scores)
+    assert flags.sum() == 30 and risk[flags == 1].min() >= risk[flags == 0].max(), "Budget missed the top 2%"
+    small = DecisionPolicy(threshold=0.5, budget=0.02)
+    assert np.array_equal(small.flag(fraud_confidence[:BUDGET_MIN_ROWS - 1], anomaly_scores[:BUDGET_MIN_ROWS - 1]),
+                          (fraud_confidence[:BUDGET_MIN_ROWS - 1] >= 0.5).astype(int)), "Small batch ignored threshold"
+
+    predictions = out_of_fold_predictions(claims, n_splits=3, n_estimators=20)
+    best_f1 = calibrate_policy(predictions)
+    targeted = calibrate_policy(predictions, target_precision=0.9)
+    flagged = targeted.flag(predictions['fraud_proba'], predictions['anomaly_scores']) == 1
+    assert precision_recall(predictions['labels'], flagged) == {k: v for k, v in targeted.calibration.items()
+                                                                if k != 'rows'}, "Calibration metrics do not match"
+    assert targeted.calibration['precision'] >= 0.9, "Target precision not met"
+    legacy_f1 = precision_recall(predictions['labels'], (predictions['fraud_proba'] > 0.5) |
+                                 (predictions['anomaly_flags'] == 1))['f1']
+    assert best_f1.calibration['f1'] >= legacy_f1, "Calibration did worse than the fixed thresholds"
+
+    artifact = train_artifact(claims, n_estimators=20, cv_folds=3, budget=0.05)
+    stored = artifact.decision_policy()
+    assert stored.budget == 0.05 and stored.calibration['flagged_share'] == 0.05, "Budget policy not stored"
+    serving = artifact.serving_copy()
+    for got, want in zip(serving.score(claims.head(BUDGET_MIN_ROWS)), artifact.score(claims.head(BUDGET_MIN_ROWS))):
+        assert np.array_equal(got, want), "Serving copy scores differently"
+    _, fraud_confidence, _, anomaly_scores = serving.score(claims)
+    assert serving.decision_policy().flag(fraud_confidence, anomaly_scores).sum() == 75, "Budget not applied"
+    print("Calibrated decision policy test passed.")
+
+def test_streaming_scoring_in_chunks():
+    print("Testing chunked streaming scoring...")
+    import tempfile
+    train = load_data(SAMPLE_CSV)
+    artifact = train_artifact(train)
+    with tempfile.TemporaryDirectory() as out_dir:
+        output_path = os.path.join(out_dir, 'scored.csv')
+        seen = []
+        summary = score_csv_stream(SAMPLE_CSV, output_path, artifact=artifact, chunksize=4, progress=seen.append)
+        scored = pd.read_csv(output_path)
+    assert summary['rows'] == len(train) and summary['chunks'] == 3, "Rows or chunks miscounted"
+    assert [p['rows'] for p in seen] == [4, 8, 10], "Progress not reported per chunk"
+    assert scored['claim_id'].tolist() == train['claim_id'].tolist(), "Row order not preserved"
+    assert summary['flagged'] == scored['fraud_predicted'].sum(), "Flag count mismatch"
+    print("Streaming scoring test passed.")
+
+def test_columnar_input_and_output():
+    print("Testing Parquet and Arrow input with column projection...")
+    import tempfile
+    try:
+        import pyarrow
+    except ImportError:
+        print("pyarrow not installed; skipping columnar test.")
+        return
+    claims = generate_claims(600, n_claimants=100, seed=31)
+    artifact = train_artifact(claims, n_estimators=20)
+    wide = claims.assign(notes=['free text'] * len(claims), export_batch=7)
+    columns = artifact.pipeline.input_columns()
+    assert 'notes' not in columns and 'fraud_reported' in columns, "Unexpected input columns"
+    with tempfile.TemporaryDirectory() as data_dir:
+        csv_path = os.path.join(data_dir, 'claims.csv')
+        save_data(wide, csv_path)
+        expected = score_csv_stream(csv_path, os.path.join(data_dir, 'scored.csv'), artifact=artifact, chunksize=250)
+        scored_csv = pd.read_csv(os.path.join(data_dir, 'scored.csv'))
+        for name in ('claims.parquet', 'claims.arrow'):
+            path = os.path.join(data_dir, name)
+            save_data(wide, path)
+            loaded = load_data(path, columns=columns + ['not_in_file'])
+            assert list(loaded.columns) == [c for c in wide.columns if c in columns], "Projection not applied"
+            chunks = list(iter_chunks(path, 250, columns=columns))
+            assert [len(c) for c in chunks] == [250, 250, 100] and chunks[-1].index[0] == 500, "Chunks wrong"
+            output_path = os.path.join(data_dir, 'scored_' + name)
+            summary = score_csv_stream(path, output_path, artifact=artifact, chunksize=250)
+            scored = load_data(output_path)
+            assert summary == expected, "Columnar scoring summary differs from CSV"
+            assert np.allclose(scored['fraud_confidence'], scored_csv['fraud_confidence']), "Scores differ by format"
+            assert scored['claim_id'].tolist() == claims['claim_id'].tolist(), "Row order not preserved"
+            assert scored['notes'].eq('free text').all(), "Columns the model does not read were dropped"
+        projected_path = os.path.join(data_dir, 'projected.parquet')
+        score_csv_stream(os.path.join(data_dir, 'claims.parquet'), projected_path, artifact=artifact, chunksize=250,
+                         project_columns=True)
+        assert 'notes' not in load_data(projected_path).columns, "Opt-in projection not applied"
+        # Columns empty in the first chunk are read as float; later text or numbers must still fit
+        sparse = wide.assign(notes=[None] * 300 + ['late note'] * 300, export_batch=[None] * 300 + [7] * 300)
+        sparse_path = os.path.join(data_dir, 'sparse.csv')
+        save_data(sparse, sparse_path)
+        for name in ('sparse.parquet', 'sparse.arrow'):
+            output_path = os.path.join(data_dir, 'scored_' + name)
+            score_csv_stream(sparse_path, output_path, artifact=artifact, chunksize=250)
+            scored = load_data(output_path)
+            assert scored['notes'].iloc[300:].eq('late note').all(), "Text after an empty first chunk lost"
+            assert scored['notes'].iloc[:300].isna().all(), "Missing text not kept missing"
+            assert pd.to_numeric(scored['export_batch'].iloc[300:]).eq(7).all(), "Numbers after an empty chunk lost"
+    print("Columnar input test passed.")
+
+# Child process for the lean memory check: prints the growth of its peak RSS
+# (VmHWM, which unlike ru_maxrss is not inherited from the forking parent) while scoring
+_LEAN_RSS_CHILD = """
+import sys
+from model_registry import load_artifact
+from main import score_claims
+def peak_rss():
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+artifact = load_artifact(registry_dir=sys.argv[1])
+before = peak_rss()
+score_claims(sys.argv[2], artifact, lean=sys.argv[3] == 'lean')
+print(peak_rss() - before)
+"""
+
+def test_lean_pipeline_memory():
+    print("Testing lean mode results and peak memory...")
+    import subprocess
+    import sys
+    import data_processing
+    from main import score_claims
+    artifact = train_artifact(generate_claims(3000, n_claimants=500, seed=41), n_estimators=10)
+    chunk_rows = data_processing.LEAN_CHUNK_ROWS
+    # Several chunks, so lean loading has to join their categoricals
+    data_processing.LEAN_CHUNK_ROWS = 30000
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            path = os.path.join(data_dir, 'claims.csv')
+            save_data(generate_claims(100000, seed=42), path)
+            results = {lean: score_claims(path, artifact, lean=lean) for lean in (False, True)}
+            # A text column that is empty in a later chunk is still text there
+            sparse = pd.DataFrame({'claim_id': range(90000), 'note': ['late'] * 30000 + [None] * 60000,
+                                   'code': [None] * 1000 + ['A1', 'B2'] * 14500 + ['12'] * 60000})
+            sparse_path = os.path.join(data_dir, 'sparse.csv')
+            save_data(sparse, sparse_path)
+            sparse = load_data(sparse_path, lean=True)
+    finally:
+        data_processing.LEAN_CHUNK_ROWS = chunk_rows
+    data, prioritized, _, num_flagged = results[True]
+    assert isinstance(data['claim_type'].dtype, pd.CategoricalDtype), "Text column not loaded as categorical"
+    assert data['policy_amount'].dtype.itemsize < 8, "Numeric column not downcast"
+    assert num_flagged == results[False][3], "Lean mode flagged different claims"
+    assert prioritized['claim_id'].tolist() == results[False][1]['claim_id'].tolist(), "Lean priority order differs"
+    assert np.array_equal(prioritized['investigation_score'], results[False][1]['investigation_score']), "Scores differ"
+    assert isinstance(sparse['note'].dtype, pd.CategoricalDtype), "Empty chunk turned a text column into floats"
+    assert sparse['note'].notna().sum() == 30000, "Text values lost across chunks"
+    assert isinstance(sparse['code'].dtype, pd.CategoricalDtype) and sparse['code'].iloc[-1] == '12', \
+        "Text found after the sample not kept as text"
+    # Peak RSS is only comparable in fresh processes, on a file big enough to dwarf the model
+    if not os.path.exists('/proc/self/status'):
+        print("Lean pipeline memory test passed (RSS check skipped: no /proc).")
+        return
+    growth = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        save_artifact(artifact, registry_dir=data_dir)
+        path = os.path.join(data_dir, 'claims.csv')
+        save_data(generate_claims(500000, seed=43), path)
+        for mode in ('normal', 'lean'):
+            child = subprocess.run([sys.executable, '-c', _LEAN_RSS_CHILD, data_dir, path, mode],
+                                   capture_output=True, text=True, check=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+            growth[mode] = int(child.stdout.split()[-1])
+    assert growth['lean'] < 0.75 * growth['normal'], f"Lean RSS growth {growth['lean']} not well below {growth['normal']}"
+    print("Lean pipeline memory test passed.")
+
+def test_batch_scoring_many_files():
+    print("Testing batch scoring of many files...")
+    import tempfile
+    from batch_score import expand_inputs, score_files
+    from streaming import score_chunks
+    artifact = train_artifact(generate_claims(1500, n_claimants=300, seed=61), n_estimators=20)
+    with tempfile.TemporaryDirectory() as data_dir:
+        region_dir = os.path.join(data_dir, 'regions')
+        os.makedirs(region_dir)
+        for i in range(3):
+            claims = generate_claims(400, n_claimants=300, seed=62 + i, start_claim_id=1 + 1000 * i)
+            save_data(claims, os.path.join(region_dir, f"region_{i}.csv"))
+        files = expand_inputs([region_dir, os.path.join(region_dir, 'region_*.csv')])
+        assert [os.path.basename(f) for f in files] == ['region_0.csv', 'region_1.csv', 'region_2.csv'], "Bad expansion"
+        missing = os.path.join(data_dir, 'missing.csv')
+        runs = {}
+        for n_workers in (1, 2):
+            output_dir = os.path.join(data_dir, f"out_{n_workers}")
+            runs[n_workers] = score_files(files + [missing], output_dir, artifact, n_workers=n_workers,
+                                          chunksize=150, top_k=50)
+            assert sorted(os.listdir(output_dir)) == [f"region_{i}.scored.csv" for i in range(3)], "Missing outputs"
+        # Claimant features count within each scored chunk, so the reference is scored in the same chunks
+        flagged = [chunk[chunk['fraud_predicted'] == 1].assign(source_file=path)
+                   for path in files for chunk in score_chunks(path, artifact, 150)]
+        # Nothing to merge when every file fails; the summary still reports them
+        failed, empty = score_files([missing], os.path.join(data_dir, 'out_failed'), artifact, n_workers=1)
+        assert failed['failed'] == 1 and empty.empty, "Failure summary lost when no claim was flagged"
+    summary, merged = runs[2]
+    assert summary['succeeded'] == 3 and summary['failed'] == 1 and summary['rows'] == 1200, "Summary miscounted"
+    assert 'FileNotFoundError' in summary['results'][3]['error'], "Failure not reported"
+    assert merged.equals(runs[1][1]), "Worker pool changed the merged list"
+    expected = prioritize_investigations(pd.concat(flagged, ignore_index=True), top_k=50)
+    assert merged['claim_id'].tolist() == expected['claim_id'].tolist(), "Merged list not globally prioritized"
+    assert merged['source_file'].tolist() == expected['source_file'].tolist(), "Source files lost"
+    print("Batch scoring test passed.")
+
+def test_claimant_history_store():
+    print("Testing incremental claimant aggregates...")
+    store = ClaimantAggregateStore()
+    store.update([1001, 1002, 1001], amounts=[100, 200, 300], claim_days=[10, 20, np.nan])
+    store.update([1001], amounts=[50], claim_days=[15])
+    assert store.lookup(1001) == (3, 450.0, 15.0), "Aggregates not accumulated"
+    assert store.lookup(9999) == (0, 0.0, None), "Unknown claimant should have empty history"
+    features = store.history_features([1001, 1003], amounts=[10, 20], claim_days=[25, 30])
+    assert features['claimant_claim_count'].tolist() == [4, 1], "History count wrong"
+    assert features['claimant_days_since_last_claim'].tolist() == [10, NO_HISTORY], "Days since last claim wrong"
+
+    history = pd.DataFrame({
+        'claimant_id': [1001, 1001, 1002],
+        'claim_amount': [1000, 2000, 500],
+        'policy_amount': [10000, 10000, 5000],
+        'claim_date': ['2023-01-01', '2023-02-01', '2023-01-15'],
+        'fraud_reported': ['N', 'Y', 'N']
+    })
+    pipeline = FeaturePipeline()
+    pipeline.fit_transform(history)
+    single = pd.DataFrame({'claimant_id': [1001], 'claim_amount': [700], 'policy_amount': [10000], 'claim_date': ['2023-02-11']})
+    row = dict(zip(pipeline.feature_names_, pipeline.transform(single)[0]))
+    assert row['claimant_claim_count'] == 3, "Single claim not enriched with stored history"
+    assert row['claimant_total_amount'] == 3700, "Claimant amount history wrong"
+    assert row['claimant_days_since_last_claim'] == 10, "Last claim date not used"
+    # Training claims get the gap to the claimant's previous training claim, as later claims do
+    trained = pd.DataFrame(pipeline.fit_transform(history), columns=pipeline.feature_names_)
+    assert trained['claimant_days_since_last_claim'].tolist() == [NO_HISTORY, 31, NO_HISTORY], "Training history skewed"
+
+    # Text claimant IDs key the history instead of being encoded as a category
+    text_ids = pipeline.fit_transform(history.assign(claimant_id=['C1', 'C1', 'C2']))
+    assert not any(name.startswith('claimant_id') for name in pipeline.feature_names_), "Text IDs encoded"
+    assert 'claimant_id' in pipeline.input_columns(), "Text IDs not loaded for scoring"
+    row = dict(zip(pipeline.feature_names_, pipeline.transform(single.assign(claimant_id=['C1']))[0]))
+    assert row['claimant_claim_count'] == 3 and row['claimant_days_since_last_claim'] == 10, "Text IDs lost history"
+    record = pipeline.transform_records([{**single.iloc[0].to_dict(), 'claimant_id': 'C1'}])[0]
+    assert np.allclose(record, list(row.values())), "Records and batches disagree on text IDs"
+    assert text_ids.shape[1] == len(pipeline.feature_names_), "Layout mismatch"
+
+    # A missing numeric ID is filled for the encoding, but is nobody's history
+    unknown = history.assign(claimant_id=[1001, np.nan, np.nan])
+    trained = pd.DataFrame(pipeline.fit_transform(unknown), columns=pipeline.feature_names_)
+    assert pipeline.claimant_store.lookup(1001)[0] == 1 and len(pipeline.claimant_store) == 1, "Missing IDs stored"
+    assert trained['claimant_claim_count'].tolist() == [1, 0, 0], "Missing IDs given history"
+    missing = single.assign(claimant_id=[np.nan])
+    row = dict(zip(pipeline.feature_names_, pipeline.transform(missing)[0]))
+    assert row['claimant_claim_count'] == 0 and row['claimant_days_since_last_claim'] == NO_HISTORY, "Missing ID history"
+    record = pipeline.transform_records([{**single.iloc[0].to_dict(), 'claimant_id': None}])[0]
+    assert np.allclose(record, list(row.values())), "Records and batches disagree on missing IDs"
+    from risk_rules import RuleSet
+    counts = RuleSet([{'name': 'repeat', 'column': 'claimant_claim_count', 'op': '>=', 'value': 2, 'add': 1.0}])
+    assert counts.score(unknown, np.zeros(3)).tolist() == [0, 0, 0], "Rules counted missing IDs as one claimant"
+    print("Claimant history test passed.")
+
+def test_entity_graph_ring_features():
+    print("Testing entity graph ring features...")
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    from entity_graph import EntityGraph
+    graph = EntityGraph(['claimant_id', 'policy_id'])
+    graph.update({'claimant_id': [1, 1, 2, 3, None], 'policy_id': ['A', 'B', 'B', None, 'C']}, 5)
+    features = graph.features({'claimant_id': [3, 9], 'policy_id': ['C', None]}, 2)
+    assert features['ring_size'].tolist() == [3, 1], "Claim should join two stored rings"
+    assert features['entity_degree'].tolist() == [2, 0], "Links through shared entities miscounted"
+    # Nullable columns hold pd.NA, which is missing rather than a link
+    nullable = graph.features({'claimant_id': pd.array([3, pd.NA], dtype='Int64'),
+                               'policy_id': pd.array([pd.NA, pd.NA], dtype='string')}, 2)
+    plain = graph.features({'claimant_id': [3, None], 'policy_id': [None, None]}, 2)
+    assert nullable['ring_size'].tolist() == plain['ring_size'].tolist() == [2, 1], "pd.NA treated as an entity"
+
+    # Built in batches, the graph matches connected components of all claims at once
+    rng = np.random.default_rng(3)
+    n = 3000
+    claimants, policies = rng.integers(0, 1500, n).astype(float), rng.integers(0, 2500, n).astype(float)
+    policies[rng.random(n) < 0.1] = np.nan
+    incremental = EntityGraph(['claimant_id', 'policy_id'])
+    for start in range(0, n, 700):
+        incremental.update({'claimant_id': claimants[start:start + 700], 'policy_id': policies[start:start + 700]},
+                           len(claimants[start:start + 700]))
+    probe = {'claimant_id': claimants[:200], 'policy_id': policies[:200]}
+    got = incremental.features(probe, 200)
+    claims = np.concatenate([np.arange(n), np.arange(200) + n])
+    claimant_nodes = 2 * n + np.concatenate([claimants, claimants[:200]]).astype(int)
+    policy_values = np.concatenate([policies, policies[:200]])
+    has_policy = ~np.isnan(policy_values)
+    rows = np.concatenate([claims, claims[has_policy]])
+    cols = np.concatenate([claimant_nodes, 2 * n + 1500 + policy_values[has_policy].astype(int)])
+    size = 2 * n + 4000
+    _, labels = connected_components(coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(size, size)), directed=False)
+    ring_sizes = np.bincount(labels[:n + 200], minlength=labels.max() + 1)
+    assert np.array_equal(got['ring_size'], ring_sizes[labels[n:n + 200]]), "Incremental rings differ from a full build"
+    assert incremental.n_claims == n, "Claims not counted"
+
+    history = pd.DataFrame({
+        'claimant_id': [1001, 1002, 1003, 1004],
+        'policy_id': ['P1', 'P1', 'P2', 'P3'],
+        'claim_amount': [1000, 2000, 500, 700],
+        'fraud_reported': ['N', 'Y', 'N', 'N'],
+    })
+    pipeline = FeaturePipeline()
+    pipeline.fit_transform(history)
+    assert pipeline.feature_names_[-2:] == ['ring_size', 'entity_degree'] and 'policy_id' in pipeline.input_columns(), \
+        "Graph features missing from the layout"
+    records = [{'claimant_id': 1003, 'policy_id': 'P1', 'claim_amount': 300}, {'claimant_id': None, 'policy_id': None}]
+    X = pipeline.transform_records(records)
+    assert np.array_equal(X, pipeline.transform(pd.DataFrame(records))), "Record and batch graph features differ"
+    assert X[:, -2].tolist() == [4, 1] and X[:, -1].tolist() == [3, 0], "Ring features of a bridging claim wrong"
+    print("Entity graph test passed.")
+
+def test_input_drift_monitor():
+    print("Testing input drift and data-quality monitoring...")
+    import json
+    import tempfile
+    import web_app
+    from streaming import score_chunks
+    claims = generate_claims(4000, n_claimants=400, seed=71)
+    artifact = train_artifact(claims, n_estimators=15)
+    profile = artifact.metadata['drift_profile']
+    json.dumps(profile)
+    assert set(profile['columns']) >= {'claim_amount', 'claim_date', 'claim_type'}, "Input columns not profiled"
+
+    monitor = artifact.drift_monitor()
+    monitor.update(generate_claims(4000, n_claimants=400, seed=72))
+    assert monitor.report()['drifted'] == [], "Same-distribution claims reported as drifting"
+
+    shifted = generate_claims(4000, n_claimants=400, seed=73).drop(columns='policy_amount')
+    shifted['claim_amount'] *= 3
+    shifted.loc[::4, 'incident_type'] = None
+    shifted.loc[::20, 'claim_type'] = 'Cyber'
+    monitor = artifact.drift_monitor()
+    for start in range(0, len(shifted), 1000):
+        monitor.update(shifted.iloc[start:start + 1000])
+    report = monitor.report()
+    columns = report['columns']
+    assert columns['claim_amount']['status'] == 'drift' and columns['claim_amount']['psi'] > 0.25, "Shift not detected"
+    assert columns['policy_amount']['status'] == 'missing', "Dropped column not reported"
+    assert columns['incident_type']['status'] == 'drift' and columns['incident_type']['null_rate'] == 0.25, "Null rise not detected"
+    assert columns['claim_type']['unseen_values'] == {'Cyber': 200}, "Unseen category not reported"
+    assert columns['claim_date']['status'] == 'ok', "Unchanged column reported"
+    whole = artifact.drift_monitor()
+    whole.update(shifted)
+    assert whole.report() == report, "Chunked sketches differ from one pass"
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_path = os.path.join(work_dir, 'claims.csv')
+        shifted.to_csv(input_path, index=False)
+        streamed = artifact.drift_monitor()
+        for _ in score_chunks(input_path, artifact, chunksize=1500, monitor=streamed):
+            pass
+        assert streamed.report()['drifted'] == report['drifted'], "Streaming monitor differs"
+
+        original = web_app.result_store
+        web_app.result_store = ResultStore(work_dir)
+        try:
+            job_id = ResultStore.new_job_id()
+            web_app.result_store.save(job_id, shifted.head(5), shifted.head(0), drift=report)
+            client = web_app.app.test_client()
+            assert client.get(f'/api/drift/{job_id}').get_json() == json.loads(json.dumps(report)), "Drift not served"
+            assert b'Input Drift' in client.get(f'/results/{job_id}').data, "Drift not shown with the results"
+            assert client.get('/api/drift/' + 'f' * 32).status_code == 404, "Unknown job not reported"
+        finally:
+            web_app.result_store = original
+    print("Input drift monitor test passed.")
+
+def test_json_scoring_endpoint():
+    print("Testing single-claim JSON scoring endpoint...")
+    import web_app
+    train = load_data(SAMPLE_CSV)
+    artifact = train_artifact(train)
+    records = train.drop(columns=['fraud_reported']).to_dict(orient='records')
+    records[0]['claim_type'] = 'Flood'
+    records[1]['claim_amount'] = None
+    frame = pd.DataFrame(records)
+    assert np.allclose(artifact.pipeline.transform_records(records), artifact.pipeline.transform(frame)), "Record and batch encodings differ"
+
+    web_app.app.config['SERVING_ARTIFACT'] = artifact
+    try:
+        client = web_app.app.test_client()
+        response = client.post('/api/score', json=records[0])
+        assert response.status_code == 200, "Single claim not scored"
+        result = response.get_json()['results'][0]
+        assert set(result) == {'claim_id', 'fraud_probability', 'anomaly', 'fraud_predicted', 'priority_score'}, "Unexpected response fields"
+        response = client.post('/api/score', json=records[:3])
+        assert len(response.get_json()['results']) == 3, "Claim list not scored"
+        assert client.post('/api/score', json=[]).status_code == 400, "Empty payload accepted"
+    finally:
+        web_app.app.config.pop('SERVING_ARTIFACT', None)
+    print("JSON scoring endpoint test passed.")
+
+def test_paginated_result_store():
+    print("Testing server-side paginated results...")
+    import time
+    import tempfile
+    data = pd.DataFrame({
+        'claim_id': range(1, 8),
+        'claim_amount': [500, 700, None, 100, 900, 300, 200],
+        'fraud_predicted': [1, 0, 1, 0, 1, 0, 1],
+        'fraud_confidence': [0.9, 0.1, 0.55, 0.2, 0.95, 0.3, 0.6]
+    })
+    prioritized = prioritize_investigations(data[data['fraud_predicted'] == 1])
+    with tempfile.TemporaryDirectory() as results_dir:
+        store = ResultStore(results_dir)
+        job_id = store.new_job_id()
+        summary = store.save(job_id, data, prioritized, {'has_report': False})
+        assert summary['num_flagged'] == 4 and summary['not_flagged'] == 3, "Summary counts wrong"
+        assert sum(summary['confidence_histogram']) == 7, "Histogram does not cover all claims"
+        first = store.page(job_id, 'flagged', page=1, per_page=3)
+        assert [row['claim_id'] for row in first['rows']] == [5, 1, 7], "Flagged page not in priority order"
+        assert first['total_pages'] == 2, "Page count wrong"
+        last = store.page(job_id, 'claims', page=3, per_page=3, sort='claim_amount', ascending=False)
+        assert [row['claim_amount'] for row in last['rows']] == [None], "Missing values not sorted last"
+        assert not store.exists('../' + job_id), "Job ID path not validated"
+
+        # Old results are deleted as new ones are saved; unfinished jobs only once abandoned
+        bounded = ResultStore(results_dir, max_age_hours=1, max_jobs=3)
+        old = time.time() - 7200
+        expired, kept = bounded.new_job_id(), bounded.new_job_id()
+        bounded.save(expired, data, prioritized)
+        os.utime(os.path.join(bounded.job_dir(expired), 'summary.json'), (old, old))
+        bounded.save(kept, data, prioritized)
+        abandoned, running = bounded.new_job_id(), bounded.new_job_id()
+        for unfinished in (abandoned, running):
+            os.makedirs(bounded.job_dir(unfinished))
+            with open(os.path.join(bounded.job_dir(unfinished), 'status.json'), 'w') as f:
+                f.write('{}')
+        for path in (bounded.job_dir(abandoned), os.path.join(bounded.job_dir(abandoned), 'status.json')):
+            os.utime(path, (old, old))
+        newest = [bounded.new_job_id() for _ in range(2)]
+        for new_id in newest:
+            time.sleep(0.01)
+            bounded.save(new_id, data, prioritized)
+        remaining = {job for job in (job_id, expired, kept, abandoned, running) + tuple(newest)
+                     if os.path.isdir(bounded.job_dir(job))}
+        assert remaining == {kept, running} | set(newest), "Wrong results expired"
+    print("Paginated result store test passed.")
+
+def test_background_upload_job():
+    print("Testing queued upload processing with progress polling...")
+    import io
+    import time
+    import tempfile
+    import web_app
+    with tempfile.TemporaryDirectory() as work_dir:
+        original = (web_app.job_queue, web_app.result_store, web_app.app.config['UPLOAD_FOLDER'], METRICS.multiprocess_dir)
+        METRICS.multiprocess_dir = os.path.join(work_dir, 'metrics')
+        web_app.job_queue = JobQueue(work_dir, max_workers=1, cache=ResultCache(os.path.join(work_dir, 'cache')))
+        web_app.result_store = ResultStore(work_dir)
+        web_app.app.config['UPLOAD_FOLDER'] = work_dir
+        try:
+            client = web_app.app.test_client()
+            with open(SAMPLE_CSV, 'rb') as f:
+                response = client.post('/upload?format=json', data={'file': (io.BytesIO(f.read()), 'claims.csv')},
+                                       content_type='multipart/form-data')
+            assert response.status_code == 202, "Upload not queued"
+            job_id = response.get_json()['job_id']
+            deadline = time.time() + 120
+            status = client.get(f'/api/jobs/{job_id}').get_json()
+            while status['state'] not in ('done', 'failed') and time.time() < deadline:
+                time.sleep(0.2)
+                status = client.get(f'/api/jobs/{job_id}').get_json()
+            assert status['state'] == 'done', f"Job did not finish: {status}"
+            assert status['rows_read'] == 10, "Rows read not reported"
+            assert not [name for name in os.listdir(work_dir) if name.endswith('claims.csv')], "Upload not deleted"
+            assert {s['stage'] for s in status['metrics']['stages']} >= {'load_data', 'preprocess', 'prioritize'}, "Job stages not recorded"
+            metrics_text = client.get('/metrics').get_data(as_text=True)
+            assert 'fraud_pipeline_runs_total{pipeline="upload_job"} 1' in metrics_text, "Worker metrics not exposed"
+            summary = client.get(f'/api/results/{job_id}').get_json()
+            assert summary['total_claims'] == 10, "Results not stored for the job"
+            assert client.get(f'/jobs/{job_id}').status_code == 302, "Finished job page should redirect to results"
+            assert client.get('/api/jobs/' + 'f' * 32).status_code == 404, "Unknown job not reported"
+
+            # A job whose worker was killed is failed rather than left running
+            import subprocess
+            import sys
+            from job_queue import write_status
+            exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+            orphan_id = web_app.result_store.new_job_id()
+            write_status(web_app.result_store, orphan_id, state='running', stage='scoring', pid=int(exited.stdout))
+            assert client.get(f'/api/jobs/{orphan_id}').get_json()['state'] == 'failed', "Orphaned job left running"
+
+            with open(SAMPLE_CSV, 'rb') as f:
+                response = client.post('/upload?format=json', data={'file': (io.BytesIO(f.read()), 'again.csv')},
+                                       content_type='multipart/form-data')
+            assert response.status_code == 200 and response.get_json()['cached'], "Repeat upload not served from cache"
+            repeat_id = response.get_json()['job_id']
+            assert repeat_id != job_id, "Cached result should get its own job ID"
+            assert client.get(f'/api/results/{repeat_id}').get_json()['num_flagged'] == summary['num_flagged'], "Cached summary differs"
+        finally:
+            web_app.job_queue.shutdown()
+            web_app.job_queue, web_app.result_store, web_app.app.config['UPLOAD_FOLDER'], METRICS.multiprocess_dir = original
+    print("Background upload job test passed.")
+
+def test_result_cache_lru_eviction():
+    print("Testing result cache LRU eviction...")
+    import time
+    import tempfile
+    with tempfile.TemporaryDirectory() as work_dir:
+        store = ResultStore(os.path.join(work_dir, 'results'))
+        data = pd.DataFrame({'claim_id': [1, 2], 'fraud_predicted': [1, 0], 'fraud_confidence': [0.9, 0.1]})
+        cache = ResultCache(os.path.join(work_dir, 'cache'), max_bytes=10 ** 9)
+        keys = []
+        for i in range(3):
+            job_id = store.new_job_id()
+            store.save(job_id, data, data.iloc[:1])
+            keys.append(ResultCache.make_key(f'content-{i}', 'v1'))
+            cache.put(keys[-1], store.job_dir(job_id))
+            time.sleep(0.01)
+        entry = cache.entry_dir(keys[0])
+        entry_size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+        # Touch the oldest entry so the middle one becomes least recently used
+        assert cache.get(keys[0]) is not None, "Cached entry missing"
+        cache.max_bytes = 2 * entry_size + entry_size // 2
+        cache.evict()
+        assert cache.get(keys[1]) is None, "Least recently used entry not evicted"
+        assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None, "Recently used entries evicted"
+        assert ResultCache.make_key('content-0', 'v2') != keys[0], "Model version not part of the cache key"
+    print("Result cache test passed.")
+
+def test_stage_instrumentation():
+    print("Testing pipeline stage instrumentation...")
+    before = METRICS.snapshot()['stages'].get('unit_test_stage', {'runs': 0, 'rows': 0})
+    with pipeline_run('unit_test_pipeline') as run:
+        with stage('unit_test_stage', np.zeros((5, 3))) as record:
+            sum(range(10000))
+        with pipeline_run('unit_test_nested'):
+            with stage('unit_test_stage') as record:
+                record.set_shape(pd.DataFrame({'a': [1, 2]}))
+    assert [r.rows for r in run.stages] == [5, 2], "Nested run stages not attached to the parent run"
+    assert run.stages[0].cols == 3 and run.stages[0].wall_seconds > 0, "Stage shape or timing missing"
+    after = METRICS.snapshot()['stages']['unit_test_stage']
+    assert after['runs'] - before['runs'] == 2 and after['rows'] - before['rows'] == 7, "Stage totals not aggregated"
+    text = METRICS.render_prometheus()
+    assert 'fraud_pipeline_stage_wall_seconds_total{stage="unit_test_stage"}' in text, "Stage missing from metrics text"
+    assert run.stages[0].process_peak_rss_bytes >= run.stages[0].peak_rss_growth_bytes >= 0, "RSS fields inconsistent"
+
+    import subprocess
+    import sys
+    from instrumentation import MetricsRegistry
+    exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    with tempfile.TemporaryDirectory() as metrics_dir:
+        registry = MetricsRegistry(metrics_dir)
+        for pid in (exited.stdout.strip(), os.getppid()):
+            with open(os.path.join(metrics_dir, f"{pid}.json"), 'w') as f:
+                f.write('{"stages": {}, "pipelines": {}}')
+        registry.remove_stale_snapshots()
+        assert os.listdir(metrics_dir) == [f"{os.getppid()}.json"], "Stale snapshots not removed, or live ones removed"
+    print("Stage instrumentation test passed.")
+
+def test_synthetic_claims_and_benchmark():
+    print("Testing synthetic claim generation and benchmark harness...")
+    from benchmark import run_benchmark
+    claims = generate_claims(5000, n_claimants=50, n_claim_types=12, fraud_rate=0.2, seed=7)
+    assert list(claims.columns) == ['claim_id', 'claimant_id', 'claim_amount', 'policy_amount', 'claim_date',
+                                    'claim_type', 'incident_type', 'fraud_reported'], "Unexpected schema"
+    assert claims['claimant_id'].nunique() == 50 and claims['claim_type'].nunique() == 12, "Cardinality not respected"
+    assert abs((claims['fraud_reported'] == 'Y').mean() - 0.2) < 0.03, "Fraud rate not respected"
+    assert claims.equals(generate_claims(5000, n_claimants=50, n_claim_types=12, fraud_rate=0.2, seed=7)), "Generator not reproducible"
+
+    result = run_benchmark(600, train_rows=300, mode='stream', chunksize=250)
+    assert result['n_rows'] == 600 and result['claims_per_second'] > 0, "Throughput not recorded"
+    assert result['score_stages']['preprocess']['runs'] == 3, "Stream chunks not timed per stage"
+    assert {'load_data', 'fraud_train'} <= set(result['train_stages']), "Training stages missing"
+    assert result['cold_start']['seconds'] > 0 and not result['cold_start']['sklearn_loaded'], "Cold start not measured"
+    print("Synthetic claims and benchmark test passed.")
+
+def test_fast_start_scoring():
+    print("Testing the lean scoring entry point...")
+    import sys
+    import tempfile
+    import subprocess
+    import serve
+    probe = "import sys, serve, main, web_app; print(sorted(m for m in ('sklearn', 'scipy') if m in sys.modules))"
+    loaded = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+    assert loaded == ['[]'], f"Scoring entry points import {loaded}"
+    claims = generate_claims(1500, n_claimants=150, seed=61)
+    artifact = train_artifact(claims, n_estimators=15)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        save_artifact(artifact, os.path.join(tmp_dir, 'models'))
+        serving = serve.load_serving_artifact(registry_dir=os.path.join(tmp_dir, 'models'))
+        assert serving.fraud_model is None, "Scoring entry point loaded the sklearn models"
+        input_path = os.path.join(tmp_dir, 'claims.csv')
+        claims.head(400).to_csv(input_path, index=False)
+        summary = serve.score_file(input_path, os.path.join(tmp_dir, 'lean.csv'), serving, chunksize=150)
+        expected = score_csv_stream(input_path, os.path.join(tmp_dir, 'full.csv'), artifact, chunksize=150)
+        assert summary['rows'] == 400 and summary['flagged'] == expected['flagged'], "Lean scoring summary differs"
+        assert pd.read_csv(os.path.join(tmp_dir, 'lean.csv')).equals(pd.read_csv(os.path.join(tmp_dir, 'full.csv'))), "Lean scoring output differs"
+        del serving
+        # Pre-forked web workers share the cores between their upload job pools
+        jobs = JobQueue(tmp_dir)
+        configured = os.environ.pop('FRAUD_JOB_WORKERS', None)
+        try:
+            serve.share_job_workers(jobs, 4)
+        finally:
+            if configured is not None:
+                os.environ['FRAUD_JOB_WORKERS'] = configured
+        assert jobs.max_workers == max(1, (os.cpu_count() or 1) // 4), "Job pools not capped per web worker"
+    print("Lean scoring entry point test passed.")
+
+def test_parallel_scoring_matches_serial():
+    print("Testing parallel training and scoring...")
+    from main import parse_args
+    args = parse_args(['--n-jobs', '4', '--score', 'claims.csv', '--lean'])
+    assert (args.n_jobs, args.score, args.file, args.lean) == (4, True, 'claims.csv', True), "Options misparsed"
+    claims = generate_claims(3000, n_claimants=200, seed=11)
+    serial = train_artifact(claims, n_estimators=20)
+    parallel = train_artifact(claims, n_estimators=20, n_jobs=2)
+    X = serial.pipeline.transform(claims)
+    assert (serial.fraud_model.model.predict(X) == serial.fraud_model.predict(X)[0]).all(), "Single-pass labels differ from predict"
+    assert (serial.anomaly_detector.predict(X) == serial.anomaly_detector.score(X)[0]).all(), "Single-pass anomaly labels differ"
+    expected = serial.score(claims)
+    with ScoringPool(serial, n_workers=3, min_rows=0) as pool:
+        pooled = pool.score(claims)
+    for result in (parallel.score(claims), pooled):
+        for got, want in zip(result, expected):
+            assert np.array_equal(got, want), "Parallel results differ from serial results"
+    print("Parallel scoring test passed.")
+
 if __name__ == "__main__":
     test_missing_values()
     test_unexpected_feature_columns()
     test_model_prediction_on_edge_cases()
     test_prioritization_with_edge_scores()
+    test_top_k_investigation_queue()
+    test_risk_rule_engine()
+    test_model_artifact_round_trip()
+    test_fitted_preprocessor_fixed_layout()
+    test_cardinality_based_encoding()
+    test_flat_forest_engine_matches_sklearn()
+    test_incremental_model_update()
+    test_cross_validated_evaluation()
+    test_calibrated_decision_policy()
+    test_streaming_scoring_in_chunks()
+    test_columnar_input_and_output()
+    test_lean_pipeline_memory()
+    test_batch_scoring_many_files()
+    test_claimant_history_store()
+    test_entity_graph_ring_features()
+    test_input_drift_monitor()
+    test_json_scoring_endpoint()
+    test_paginated_result_store()
+    test_background_upload_job()
+    test_result_cache_lru_eviction()
+    test_stage_instrumentation()
+    test_synthetic_claims_and_benchmark()
+    test_fast_start_scoring()
+    test_parallel_scoring_matches_serial()
     print("All edge case tests completed successfully.")
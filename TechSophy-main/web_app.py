@@ -1,19 +1,39 @@
-from flask import Flask, request, render_template_string, redirect, url_for, flash
+from flask import Flask, request, render_template_string, redirect, url_for, flash, jsonify, Response
 import os
-import pandas as pd
-from main import process_claims
+import hashlib
+from main import combine_predictions
+from model_registry import get_artifact, latest_version
+from result_cache import ResultCache
+from result_store import ResultStore, DEFAULT_PER_PAGE
+from job_queue import JobQueue, DONE, FAILED
+from instrumentation import METRICS, pipeline_run
+from risk_rules import load_rules
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
 
 UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'csv'}
+RESULTS_FOLDER = os.environ.get('FRAUD_RESULTS_DIR', 'results')
+ALLOWED_EXTENSIONS = {'csv', 'parquet', 'pq', 'arrow', 'feather', 'ipc'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['RESULTS_FOLDER'] = RESULTS_FOLDER
+# Per-process metric totals are written here so /metrics includes job workers
+METRICS_FOLDER = os.environ.get('FRAUD_METRICS_DIR', 'metrics')
+METRICS.multiprocess_dir = METRICS_FOLDER
+METRICS.remove_stale_snapshots()
+# Largest number of claims accepted by one /api/score request
+MAX_SCORE_BATCH = 1000
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+result_store = ResultStore(RESULTS_FOLDER)
+# Uploads are scored by a pool of worker processes (one per core unless FRAUD_JOB_WORKERS
+# is set), and repeat uploads of a file scored by the same model are served from the cache
+job_queue = JobQueue(RESULTS_FOLDER, max_workers=int(os.environ.get('FRAUD_JOB_WORKERS', 0)) or None,
+                     cache=ResultCache())
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -34,7 +54,7 @@ UPLOAD_FORM = """
   </style>
 </head>
 <body>
-  <h1>Upload Insurance Claims CSV File</h1>
+  <h1>Upload Insurance Claims File (CSV, Parquet or Arrow)</h1>
   <form method=post enctype=multipart/form-data action="{{ url_for('upload_file') }}">
     <input type=file name=file>
     <input type=submit value=Upload>
@@ -52,6 +72,45 @@ UPLOAD_FORM = """
 </html>
 """
 
+JOB_PAGE = """
+<!doctype html>
+<html lang="en">
+<head>
+  <meta charset="UTF-8">
+  <title>Insurance Claims Fraud Detection - Processing</title>
+  <style>
+    body { font-family: Arial, sans-serif; margin: 40px; background-color: #f4f6f8; }
+    h1 { color: #2c3e50; }
+    .status { background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); max-width: 400px; }
+  </style>
+</head>
+<body>
+  <h1>Processing Claims</h1>
+  <div class="status">
+    <p><strong>Stage:</strong> <span id="stage">{{ status.stage }}</span></p>
+    <p><strong>Rows read:</strong> <span id="rows">{{ status.rows_read }}</span></p>
+  </div>
+  <script>
+    // Poll the job status and move on to the results once the job has finished
+    function poll() {
+      fetch("{{ url_for('job_status_api', job_id=status.job_id) }}")
+        .then(response => response.json())
+        .then(status => {
+          document.getElementById('stage').textContent = status.stage;
+          document.getElementById('rows').textContent = status.rows_read;
+          if (status.state === 'done' || status.state === 'failed') {
+            window.location = "{{ url_for('job_page', job_id=status.job_id) }}";
+          } else {
+            setTimeout(poll, 1000);
+          }
+        });
+    }
+    setTimeout(poll, 1000);
+  </script>
+</body>
+</html>
+"""
+
 RESULTS_PAGE = """
 <!doctype html>
 <html lang="en">
@@ -62,12 +121,17 @@ RESULTS_PAGE = """
   <style>
     body { font-family: Arial, sans-serif; margin: 40px; background-color: #f4f6f8; }
     h1 { color: #2c3e50; }
-    table { border-collapse: collapse; width: 100%; background: white; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); margin-bottom: 40px; }
+    table { border-collapse: collapse; width: 100%; background: white; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); margin-bottom: 20px; }
     th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
     th { background-color: #3498db; color: white; }
+    th a { color: white; margin-top: 0; }
     tr:nth-child(even) { background-color: #f2f2f2; }
     a { display: inline-block; margin-top: 20px; color: #3498db; text-decoration: none; }
     a:hover { text-decoration: underline; }
+    .tabs a { margin-right: 20px; }
+    .tabs a.active { font-weight: bold; color: #2c3e50; }
+    .pager { margin-bottom: 40px; }
+    .pager a { margin: 0 10px; }
     .chart-container { width: 600px; margin-bottom: 40px; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); }
   </style>
 </head>
@@ -75,41 +139,26 @@ RESULTS_PAGE = """
   <h1>AI CLAIM ANALYZER</h1>
 
   <div style="margin-bottom: 20px; padding: 10px; border: 1px solid #3498db; background-color: #ecf6fd; width: fit-content; border-radius: 5px;">
-    <strong>Flagged Claims:</strong> {{ eval_metrics.num_flagged }} out of {{ eval_metrics.total_claims }} total claims
+    <strong>Flagged Claims:</strong> {{ summary.num_flagged }} out of {{ summary.total_claims }} total claims
   </div>
 
-  <table>
-    <thead>
-      <tr>
-        {% for col in columns %}
-        <th>{{ col }}</th>
-        {% endfor %}
-      </tr>
-    </thead>
-    <tbody>
-      {% for row in data %}
-      <tr>
-        {% for col in columns %}
-        <td>{{ row[col] }}</td>
-        {% endfor %}
-      </tr>
-      {% endfor %}
-    </tbody>
-  </table>
+  <div class="tabs">
+    <a href="{{ url_for('results', job_id=summary.job_id, table='flagged') }}" class="{{ 'active' if table == 'flagged' }}">Flagged Claims Prioritized for Investigation</a>
+    <a href="{{ url_for('results', job_id=summary.job_id, table='claims') }}" class="{{ 'active' if table == 'claims' }}">Original Data with Predictions</a>
+  </div>
 
-  <h2>Original Data with Predictions</h2>
   <table>
     <thead>
       <tr>
-        {% for col in original_columns %}
-        <th>{{ col }}</th>
+        {% for col in result_page.columns %}
+        <th><a href="{{ url_for('results', job_id=summary.job_id, table=table, sort=col, order='desc' if sort == col and order == 'asc' else 'asc', per_page=result_page.per_page) }}">{{ col }}{% if sort == col %} {{ '&#9650;' if order == 'asc' else '&#9660;' }}{% endif %}</a></th>
         {% endfor %}
       </tr>
     </thead>
     <tbody>
-      {% for row in original_data %}
+      {% for row in result_page.rows %}
       <tr>
-        {% for col in original_columns %}
+        {% for col in result_page.columns %}
         <td>{{ row[col] }}</td>
         {% endfor %}
       </tr>
@@ -117,39 +166,58 @@ RESULTS_PAGE = """
     </tbody>
   </table>
 
-  <h2>Flagged Claims Prioritized for Investigation</h2>
+  <div class="pager">
+    {% if result_page.page > 1 %}
+    <a href="{{ url_for('results', job_id=summary.job_id, table=table, page=result_page.page - 1, per_page=result_page.per_page, sort=sort, order=order) }}">&laquo; Previous</a>
+    {% endif %}
+    Page {{ result_page.page }} of {{ result_page.total_pages }} ({{ result_page.total_rows }} rows)
+    {% if result_page.page < result_page.total_pages %}
+    <a href="{{ url_for('results', job_id=summary.job_id, table=table, page=result_page.page + 1, per_page=result_page.per_page, sort=sort, order=order) }}">Next &raquo;</a>
+    {% endif %}
+  </div>
+
+  {% if eval_metrics.has_report %}
+  <h2>Model Evaluation Metrics</h2>
+  <div class="chart-container">
+    <canvas id="evalChart"></canvas>
+  </div>
+  {% endif %}
+
+  {% if summary.drift %}
+  <h2>Input Drift from the Training Claims</h2>
   <table>
     <thead>
-      <tr>
-        {% for col in flagged_columns %}
-        <th>{{ col }}</th>
-        {% endfor %}
-      </tr>
+      <tr><th>Column</th><th>Status</th><th>PSI</th><th>Null rate</th><th>Null rate in training</th><th>Unseen values</th></tr>
     </thead>
     <tbody>
-      {% for row in flagged_data %}
+      {% for col, column in summary.drift.columns.items() %}
       <tr>
-        {% for col in flagged_columns %}
-        <td>{{ row[col] }}</td>
-        {% endfor %}
+        <td>{{ col }}</td>
+        <td>{{ column.status }}</td>
+        <td>{{ '%.3f' % column.psi if column.psi is not none else '-' }}</td>
+        <td>{{ '%.1f%%' % (100 * column.null_rate) if column.null_rate is not none else '-' }}</td>
+        <td>{{ '%.1f%%' % (100 * column.reference_null_rate) }}</td>
+        <td>{{ (column.unseen_values or {}).keys() | join(', ') }}</td>
       </tr>
       {% endfor %}
     </tbody>
   </table>
+  {% endif %}
 
-  <h2>Model Evaluation Metrics</h2>
+  <h2>Fraud Prediction Distribution</h2>
   <div class="chart-container">
-    <canvas id="evalChart"></canvas>
+    <canvas id="fraudDistChart"></canvas>
   </div>
 
-  <h2>Fraud Prediction Distribution</h2>
+  <h2>Fraud Confidence Distribution</h2>
   <div class="chart-container">
-    <canvas id="fraudDistChart"></canvas>
+    <canvas id="confidenceChart"></canvas>
   </div>
 
   <a href="{{ url_for('index') }}">Upload another file</a>
 
   <script>
+    {% if eval_metrics.has_report %}
     const evalCtx = document.getElementById('evalChart').getContext('2d');
     const evalChart = new Chart(evalCtx, {
       type: 'bar',
@@ -182,19 +250,16 @@ RESULTS_PAGE = """
         }
       }
     });
+    {% endif %}
 
     // Fraud prediction distribution pie chart
     const fraudDistCtx = document.getElementById('fraudDistChart').getContext('2d');
-    const fraudCounts = {
-      flagged: {{ original_data | selectattr("fraud_predicted", "equalto", 1) | list | length }},
-      total: {{ original_data | length }}
-    };
     const fraudDistChart = new Chart(fraudDistCtx, {
       type: 'pie',
       data: {
         labels: ['Flagged Fraud', 'Not Flagged'],
         datasets: [{
-          data: [fraudCounts.flagged, fraudCounts.total - fraudCounts.flagged],
+          data: [{{ summary.num_flagged }}, {{ summary.not_flagged }}],
           backgroundColor: ['#e74c3c', '#2ecc71']
         }]
       },
@@ -202,6 +267,21 @@ RESULTS_PAGE = """
         responsive: true
       }
     });
+
+    // Fraud confidence histogram, precomputed when the results were stored
+    const confidenceCtx = document.getElementById('confidenceChart').getContext('2d');
+    const confidenceCounts = {{ summary.confidence_histogram | tojson }};
+    const confidenceChart = new Chart(confidenceCtx, {
+      type: 'bar',
+      data: {
+        labels: confidenceCounts.map((_, i) => (i / confidenceCounts.length).toFixed(1) + '-' + ((i + 1) / confidenceCounts.length).toFixed(1)),
+        datasets: [{
+          label: 'Claims',
+          data: confidenceCounts,
+          backgroundColor: '#3498db'
+        }]
+      }
+    });
   </script>
 </body>
 </html>
@@ -222,34 +302,169 @@ def upload_file():
         return redirect(url_for('index'))
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        try:
-            data, prioritized, report, num_flagged = process_claims(filepath)
-            original_data = data.to_dict(orient='records')
-            original_columns = data.columns.tolist()
-            flagged_data = prioritized.to_dict(orient='records')
-            flagged_columns = prioritized.columns.tolist()
-            eval_metrics = {
-                'precision_0': round(report['0']['precision'], 2),
-                'recall_0': round(report['0']['recall'], 2),
-                'f1_0': round(report['0']['f1-score'], 2),
-                'support_0': report['0']['support'],
-                'precision_1': round(report['1']['precision'], 2),
-                'recall_1': round(report['1']['recall'], 2),
-                'f1_1': round(report['1']['f1-score'], 2),
-                'support_1': report['1']['support'],
-                'accuracy': round(report['accuracy'], 2),
-                'num_flagged': num_flagged,
-                'total_claims': len(data)
-            }
-            return render_template_string(RESULTS_PAGE, original_data=original_data, original_columns=original_columns, flagged_data=flagged_data, flagged_columns=flagged_columns, eval_metrics=eval_metrics)
-        except Exception as e:
-            flash(f'Error processing file: {e}')
-            return redirect(url_for('index'))
+        job_id = result_store.new_job_id()
+        # Prefix with the job ID so concurrent uploads of the same name don't collide
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_{filename}")
+        content_hash = save_upload(file, filepath)
+        job_queue.submit(filepath, job_id=job_id, model_version=latest_version(), content_hash=content_hash,
+                         remove_file=True)
+        cached = job_queue.status(job_id)['state'] == DONE
+        if wants_json():
+            return jsonify({
+                'job_id': job_id,
+                'cached': cached,
+                'status_url': url_for('job_status_api', job_id=job_id),
+                'results_url': url_for('results_summary_api', job_id=job_id),
+            }), 200 if cached else 202
+        if cached:
+            return redirect(url_for('results', job_id=job_id))
+        return redirect(url_for('job_page', job_id=job_id))
     else:
-        flash('Allowed file types are csv')
+        flash('Allowed file types are csv, parquet and arrow')
+        return redirect(url_for('index'))
+
+def save_upload(file, filepath, block_size=1024 * 1024):
+    """
+    Write an uploaded file to disk and return the SHA-256 of its content,
+    hashing while writing so the file is read only once.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'wb') as out:
+        for block in iter(lambda: file.stream.read(block_size), b''):
+            digest.update(block)
+            out.write(block)
+    return digest.hexdigest()
+
+def wants_json():
+    return request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        flash('Job not found')
+        return redirect(url_for('index'))
+    if status['state'] == DONE:
+        return redirect(url_for('results', job_id=job_id))
+    if status['state'] == FAILED:
+        flash(f"Error processing file: {status.get('error')}")
         return redirect(url_for('index'))
+    return render_template_string(JOB_PAGE, status=status)
+
+@app.route('/api/jobs/<job_id>')
+def job_status_api(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(status)
+
+def page_args():
+    order = request.args.get('order', 'asc')
+    return {
+        'page': request.args.get('page', 1, type=int),
+        'per_page': request.args.get('per_page', DEFAULT_PER_PAGE, type=int),
+        'sort': request.args.get('sort') or None,
+        'ascending': order != 'desc',
+    }
+
+@app.route('/results/<job_id>')
+def results(job_id):
+    if not result_store.exists(job_id):
+        flash('Results not found')
+        return redirect(url_for('index'))
+    table = request.args.get('table', 'flagged')
+    args = page_args()
+    try:
+        result_page = result_store.page(job_id, table=table, **args)
+    except KeyError as e:
+        flash(f'Invalid results request: {e}')
+        return redirect(url_for('index'))
+    summary = result_store.summary(job_id)
+    eval_metrics = summary['eval_metrics'] or {'has_report': False}
+    return render_template_string(RESULTS_PAGE, summary=summary, eval_metrics=eval_metrics, result_page=result_page,
+                                  table=table, sort=args['sort'], order='asc' if args['ascending'] else 'desc')
+
+@app.route('/api/results/<job_id>')
+def results_summary_api(job_id):
+    if not result_store.exists(job_id):
+        return jsonify({'error': 'Results not found.'}), 404
+    return jsonify(result_store.summary(job_id))
+
+@app.route('/api/results/<job_id>/<table>')
+def results_page_api(job_id, table):
+    if not result_store.exists(job_id):
+        return jsonify({'error': 'Results not found.'}), 404
+    try:
+        return jsonify(result_store.page(job_id, table=table, **page_args()))
+    except KeyError as e:
+        return jsonify({'error': str(e.args[0])}), 400
+
+@app.route('/api/drift/<job_id>')
+def drift_api(job_id):
+    """
+    Per-column drift of a job's claims from the model's training claims,
+    computed while the job was scored; see drift_monitor.
+    """
+    if not result_store.exists(job_id):
+        return jsonify({'error': 'Results not found.'}), 404
+    drift = result_store.summary(job_id).get('drift')
+    if drift is None:
+        return jsonify({'error': 'No drift report: the model has no training profile to compare with.'}), 404
+    return jsonify(drift)
+
+def serving_artifact():
+    # Resolved once per process so JSON scoring does no registry file I/O.
+    # The serving copy scores with the flat forest engine and loads faster.
+    if app.config.get('SERVING_ARTIFACT') is None:
+        app.config['SERVING_ARTIFACT'] = get_artifact(serving=True)
+    return app.config['SERVING_ARTIFACT']
+
+@app.route('/api/score', methods=['POST'])
+def score_api():
+    """
+    Score one claim (a JSON object) or a small list of claims against the
+    preloaded model artifact.
+    """
+    payload = request.get_json(silent=True)
+    records = [payload] if isinstance(payload, dict) else payload
+    if not isinstance(records, list) or not records or not all(isinstance(r, dict) for r in records):
+        return jsonify({'error': 'Expected a JSON claim object or a non-empty list of claim objects.'}), 400
+    if len(records) > MAX_SCORE_BATCH:
+        return jsonify({'error': f'At most {MAX_SCORE_BATCH} claims can be scored per request.'}), 413
+    artifact = serving_artifact()
+    if artifact is None:
+        return jsonify({'error': 'No trained model artifact is available.'}), 503
+    with pipeline_run('score_api'):
+        _, fraud_confidence, anomaly_flags, anomaly_scores = artifact.score_records(records)
+    combined = combine_predictions(fraud_confidence, anomaly_scores, artifact.decision_policy())
+    # Same score prioritize_investigations ranks flagged claims by
+    priority_scores, explanations = fraud_confidence, None
+    rules = load_rules()
+    if rules is not None:
+        priority_scores, contributions = rules.contributions_records(records, fraud_confidence,
+                                                                     claimant_store=artifact.pipeline.claimant_store)
+        explanations = rules.explain(contributions)
+    results = []
+    for i, (record, flagged, confidence, anomaly) in enumerate(zip(records, combined.tolist(), fraud_confidence.tolist(),
+                                                                   anomaly_flags.tolist())):
+        result = {
+            'claim_id': record.get('claim_id'),
+            'fraud_probability': confidence,
+            'anomaly': bool(anomaly),
+            'fraud_predicted': flagged,
+            'priority_score': float(priority_scores[i]),
+        }
+        if explanations is not None:
+            result['rule_contributions'] = explanations[i]
+        results.append(result)
+    return jsonify({'model_version': artifact.version, 'results': results})
+
+@app.route('/metrics')
+def metrics():
+    """
+    Pipeline stage metrics in the Prometheus text exposition format.
+    """
+    return Response(METRICS.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug=True)